@@ -185,7 +185,14 @@ class HoldingCorporationAdmin(admin.ModelAdmin):
     list_filter = ["corporation__alliance", "is_active"]
     sortable_by = ["is_active"]
     actions = [enable_all_owners, disable_all_owners]
-    readonly_fields = ["corporation", "last_updated", "count_markets"]
+    readonly_fields = [
+        "corporation",
+        "last_updated",
+        "last_update_duration",
+        "last_update_succeeded",
+        "last_update_failed",
+        "count_markets",
+    ]
     inlines = (OwnerCharacterAdminInline,)
 
     @admin.display(description="Number markets")
@@ -1,21 +1,30 @@
 """Interactions with the fuzzwork market API"""
 
+import threading
 from enum import Enum
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from eveuniverse.models import EveType
 
 from allianceauth.services.hooks import get_extension_logger
 
 from markets import __version__, repo_url
+from markets.app_settings import MARKETS_FUZZWORK_RETRIES, MARKETS_FUZZWORK_TIMEOUT
 
 FUZZWORK_URL = "https://market.fuzzwork.co.uk/aggregates/"
 THE_FORGE_REGION_ID = 10000002
+MAX_TYPES_PER_REQUEST = 200
+"""Type ids sent in a single request to keep the URL short enough"""
 
 logger = get_extension_logger(__name__)
 
+_session: Optional[requests.Session] = None  # pylint: disable = invalid-name
+_session_lock = threading.Lock()
+
 
 class BuySell(Enum):
     """Parameter to see if you want to fetch buy or sell orders"""
@@ -46,31 +55,88 @@ def get_types_prices(
     return get_type_ids_prices(type_ids, buy_sell, price_type)
 
 
-def get_type_ids_prices(
-    eve_types_ids: List[int],
-    buy_sell: BuySell = BuySell.BUY,
-    price_type: PriceType = PriceType.FIVE_PERCENT_WEIGHTED_AVERAGE,
-) -> Dict[int, float]:
+def get_session() -> requests.Session:
     """
-    Retrieves the price of the given eve_type_ids from the Fuzzwork API
-    The parameters allow to select the  price type you want
+    Returns the session shared by the requests to the Fuzzwork API.
+    Connections are reused and failed requests retried with an exponential backoff
+    """
+    global _session  # pylint: disable = global-statement
+
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=MARKETS_FUZZWORK_RETRIES,
+                backoff_factor=1,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET",),
+            )
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(max_retries=retry))
+            session.headers["User-Agent"] = f"aa-markets v{__version__} {repo_url}"
+            _session = session
+
+        return _session
+
+
+def get_type_ids_aggregates(
+    eve_types_ids: Iterable[int],
+) -> Dict[int, Dict[str, Dict[str, float]]]:
+    """
+    Retrieves the buy and sell price aggregates of the given eve_type_ids from the Fuzzwork API
+    The ids are sent by batches of MAX_TYPES_PER_REQUEST, usually a single request
     """
 
+    eve_types_ids = sorted(set(eve_types_ids))
     if not eve_types_ids:
         logger.warning("Received an empty list for fetching prices")
         return {}
 
-    url = f"{FUZZWORK_URL}?region={THE_FORGE_REGION_ID}&types={','.join([str(eve_type_id) for eve_type_id in eve_types_ids])}"
+    aggregates = {}
+    for start in range(0, len(eve_types_ids), MAX_TYPES_PER_REQUEST):
+        batch = eve_types_ids[start : start + MAX_TYPES_PER_REQUEST]
+        url = f"{FUZZWORK_URL}?region={THE_FORGE_REGION_ID}&types={','.join(str(eve_type_id) for eve_type_id in batch)}"
+
+        logger.info("Trying to fetch data from %s", url)
+        r = get_session().get(url, timeout=MARKETS_FUZZWORK_TIMEOUT)
+        r.raise_for_status()
+
+        for type_id, market_info in r.json().items():
+            aggregates[int(type_id)] = {
+                side: {name: float(value) for name, value in values.items()}
+                for side, values in market_info.items()
+            }
+
+    return aggregates
+
 
-    user_agent = f"aa-markets v{__version__} {repo_url}"
+def select_prices(
+    aggregates: Dict[int, Dict[str, Dict[str, float]]],
+    buy_sell: BuySell = BuySell.BUY,
+    price_type: PriceType = PriceType.FIVE_PERCENT_WEIGHTED_AVERAGE,
+    eve_types_ids: Optional[Iterable[int]] = None,
+) -> Dict[int, float]:
+    """
+    Picks a price out of aggregates returned by get_type_ids_aggregates
+    Only the prices of eve_types_ids are returned if given
+    """
+    if eve_types_ids is None:
+        eve_types_ids = aggregates.keys()
 
-    logger.info("Trying to fetch data from %s" % url)
-    r = requests.get(url, headers={"User-Agent": user_agent}, timeout=5)
-    r.raise_for_status()
+    return {
+        type_id: aggregates[type_id][buy_sell.value][price_type.value]
+        for type_id in eve_types_ids
+        if type_id in aggregates
+    }
 
-    output_dic = {}
 
-    for type_id, market_info in r.json().items():
-        output_dic[int(type_id)] = float(market_info[buy_sell.value][price_type.value])
+def get_type_ids_prices(
+    eve_types_ids: List[int],
+    buy_sell: BuySell = BuySell.BUY,
+    price_type: PriceType = PriceType.FIVE_PERCENT_WEIGHTED_AVERAGE,
+) -> Dict[int, float]:
+    """
+    Retrieves the price of the given eve_type_ids from the Fuzzwork API
+    The parameters allow to select the  price type you want
+    """
 
-    return output_dic
+    return select_prices(get_type_ids_aggregates(eve_types_ids), buy_sell, price_type)
@@ -45,3 +45,159 @@ MARKETS_MAGMATIC_GASES_PER_HOUR = clean_setting("MARKETS_MAGMATIC_GASES_PER_HOUR
 How many magmatic gases a running Markets consumes every hours.
 This value shouldn't be edited
 """
+
+MARKETS_ESI_MAX_CONCURRENT_HOLDINGS = clean_setting(
+    "MARKETS_ESI_MAX_CONCURRENT_HOLDINGS", 10
+)
+"""
+Maximum number of holding corporations fetched from the ESI at the same time
+when updating all holdings
+"""
+
+MARKETS_ESI_MAX_CONCURRENT_PAGES = clean_setting("MARKETS_ESI_MAX_CONCURRENT_PAGES", 5)
+"""
+Maximum number of pages of a paginated ESI endpoint fetched at the same time
+"""
+
+MARKETS_ESI_CONDITIONAL_CACHE_TIMEOUT = clean_setting(
+    "MARKETS_ESI_CONDITIONAL_CACHE_TIMEOUT", 86_400
+)
+"""
+Seconds the ETag and payload of the structures and assets endpoints are kept
+to make conditional requests to the ESI
+"""
+
+MARKETS_STRUCTURE_LOCATION_RETENTION_DAYS = clean_setting(
+    "MARKETS_STRUCTURE_LOCATION_RETENTION_DAYS", 30
+)
+"""
+Days the location of a structure is kept after it stopped being seen in any holding corporation
+"""
+
+MARKETS_MOON_MAX_DISTANCE = clean_setting("MARKETS_MOON_MAX_DISTANCE", 10_000_000)
+"""
+Maximum distance in meters between a structure and the moon it's anchored on.
+If no moon known locally is that close the moon is looked up through eveuniverse instead
+"""
+
+MARKETS_ESI_MAX_REQUESTS_PER_SECOND = clean_setting(
+    "MARKETS_ESI_MAX_REQUESTS_PER_SECOND", 20
+)
+"""
+Maximum number of ESI requests made each second by all the workers together.
+0 disables the rate limit
+"""
+
+MARKETS_ESI_ERROR_LIMIT_THRESHOLD = clean_setting(
+    "MARKETS_ESI_ERROR_LIMIT_THRESHOLD", 20
+)
+"""
+Remaining ESI error budget under which no ESI request is made until the error limit resets.
+Tasks hitting it are deferred until then
+"""
+
+MARKETS_ESI_TOKEN_EXPIRY_MARGIN = clean_setting("MARKETS_ESI_TOKEN_EXPIRY_MARGIN", 60)
+"""
+Seconds before its expiry an access token resolved during a refresh cycle stops being reused
+"""
+
+MARKETS_OWNER_MAX_FAILURES = clean_setting("MARKETS_OWNER_MAX_FAILURES", 3)
+"""
+Consecutive ESI forbidden errors after which an owner is disabled.
+Owners with failures are tried after the healthy ones until then
+"""
+
+MARKETS_ASSETS_REFRESH_INTERVAL = clean_setting("MARKETS_ASSETS_REFRESH_INTERVAL", 12)
+"""
+Hours between two fetches of the corporation assets when updating a holding.
+Assets are fetched earlier when a markets is projected to need a ping or to have its bay nearly full.
+0 fetches the assets on every update
+"""
+
+MARKETS_ASSETS_REFRESH_BAY_RATIO = clean_setting(
+    "MARKETS_ASSETS_REFRESH_BAY_RATIO", 0.9
+)
+"""
+Projected fill ratio of a moon material bay at which the corporation assets are fetched early
+"""
+
+MARKETS_ESI_STATUS_CACHE_TIMEOUT = clean_setting("MARKETS_ESI_STATUS_CACHE_TIMEOUT", 30)
+"""
+Seconds the ESI status is reused by all the ESI calls before being fetched again
+"""
+
+MARKETS_SNAPSHOT_TIMEOUT = clean_setting("MARKETS_SNAPSHOT_TIMEOUT", 21_600)
+"""
+Seconds the fetched ESI data of a holding is kept in the cache for the tasks updating its markets
+"""
+
+MARKETS_HOLDING_LOCK_LEASE = clean_setting("MARKETS_HOLDING_LOCK_LEASE", 900)
+"""
+Seconds a holding update holds the lock of its holding before another update can take it over
+"""
+
+MARKETS_HOLDING_REFRESH_INTERVAL = clean_setting("MARKETS_HOLDING_REFRESH_INTERVAL", 60)
+"""
+Minutes between two updates of a holding planned by the schedule_holdings_updates task
+"""
+
+MARKETS_HOLDING_SCHEDULER_TICK = clean_setting("MARKETS_HOLDING_SCHEDULER_TICK", 5)
+"""
+Minutes between two runs of the schedule_holdings_updates task in the beat schedule
+"""
+
+MARKETS_FUZZWORK_TIMEOUT = clean_setting("MARKETS_FUZZWORK_TIMEOUT", 10)
+"""
+Seconds to wait for an answer of the Fuzzwork API before retrying
+"""
+
+MARKETS_FUZZWORK_RETRIES = clean_setting("MARKETS_FUZZWORK_RETRIES", 3)
+"""
+Retries of a failed request to the Fuzzwork API, waiting longer after each one
+"""
+
+MARKETS_PRICE_CACHE_TTL = clean_setting("MARKETS_PRICE_CACHE_TTL", 300)
+"""
+Seconds a process serves its prices from memory before reloading them from the database.
+New prices are picked up within seconds anyway
+"""
+
+MARKETS_MOON_REVALUATION_BATCH_SIZE = clean_setting(
+    "MARKETS_MOON_REVALUATION_BATCH_SIZE", 1000
+)
+"""Moons written per query when updating the value of every moon after a price update"""
+
+MARKETS_PRICE_CHANGE_EPSILON = clean_setting("MARKETS_PRICE_CHANGE_EPSILON", 0.001)
+"""
+Relative change under which a new price is ignored and the moons harvesting it aren't revalued.
+0.001 ignores changes of less than 0.1%
+"""
+
+MARKETS_PRICE_HISTORY_RAW_RETENTION_DAYS = clean_setting(
+    "MARKETS_PRICE_HISTORY_RAW_RETENTION_DAYS", 7
+)
+"""Days every fetched price is kept in the price history before only its hourly average is left"""
+
+MARKETS_PRICE_HISTORY_HOURLY_RETENTION_DAYS = clean_setting(
+    "MARKETS_PRICE_HISTORY_HOURLY_RETENTION_DAYS", 90
+)
+"""Days the hourly price averages are kept before only the daily averages are left"""
+
+MARKETS_PRICE_HISTORY_DAILY_RETENTION_DAYS = clean_setting(
+    "MARKETS_PRICE_HISTORY_DAILY_RETENTION_DAYS", 5 * 365
+)
+"""Days the daily price averages are kept"""
+
+MARKETS_PRICE_MOVING_AVERAGE_HOURS = clean_setting(
+    "MARKETS_PRICE_MOVING_AVERAGE_HOURS", 0
+)
+"""
+Hours of price history averaged to get the price of the types.
+Smooths out a bad Fuzzwork sample. 0 uses the last fetched price
+"""
+
+MARKETS_ESI_DOWNTIME_END = clean_setting("APPUTILS_ESI_DOWNTIME_END", 11.25)
+"""
+End of the ESI daily downtime in UTC hours.
+Shares the app_utils setting reporting the ESI as offline until then
+"""
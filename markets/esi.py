@@ -2,22 +2,45 @@
 Modules containing all ESI interactions
 """
 
+import datetime as dt
+import hashlib
+import json
+import time
 from collections import defaultdict
-from typing import Dict, List, Set
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 
-from bravado.exception import HTTPForbidden
+from bravado.exception import HTTPError, HTTPForbidden, HTTPNotModified
 
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+from django.utils.http import parse_http_date_safe
 from esi.clients import EsiClientProvider
 from esi.models import Token
 
 from allianceauth.services.hooks import get_extension_logger
-from app_utils.esi import fetch_esi_status
-
-from markets.models import HoldingCorporation
+from app_utils.esi import EsiStatus, fetch_esi_status
+
+from markets.app_settings import (
+    MARKETS_ESI_CONDITIONAL_CACHE_TIMEOUT,
+    MARKETS_ESI_DOWNTIME_END,
+    MARKETS_ESI_MAX_CONCURRENT_HOLDINGS,
+    MARKETS_ESI_MAX_CONCURRENT_PAGES,
+    MARKETS_ESI_STATUS_CACHE_TIMEOUT,
+)
+from markets.esi_guard import esi_guard
+from markets.models import HoldingCorporation, StructureLocation, parse_esi_datetime
+from markets.owner_scheduler import owner_scheduler
+from markets.token_pool import get_access_token
 
 from . import __version__
 
 MARKETS_TYPE_ID = 81826
+ESI_STATUS_CACHE_KEY = "markets-esi-status"
+DOWNTIME_END_MARGIN = 120
 
 logger = get_extension_logger(__name__)
 
@@ -31,127 +54,438 @@ class ESIError(Exception):
 class DownTimeError(Exception):
     """Signifies that it is currently the downtime and no data will be returned"""
 
+    def __init__(self, retry_after: int = 0):
+        super().__init__(f"ESI daily downtime. Retry in {retry_after}s")
+        self.retry_after = retry_after
 
-def get_markets_from_esi(
-    holding_corporation: HoldingCorporation,
-) -> List[Dict]:
-    """Returns all markets associated with a given Owner"""
 
-    structures = get_structures_from_esi(holding_corporation)
+class NotModifiedError(Exception):
+    """Signifies that the ESI data didn't change since the last time it was fetched"""
 
-    return [
-        structure for structure in structures if structure["type_id"] == MARKETS_TYPE_ID
-    ]
+    def __init__(self, headers: Optional[Dict] = None):
+        super().__init__("ESI data not modified")
+        self.headers = headers
 
 
-def get_structure_info_from_esi(
-    holding_corporation: HoldingCorporation, structure_id: int
-) -> Dict:
-    """Returns the location information of a structure"""
+@dataclass
+class HoldingMarketsData:
+    """ESI data required to refresh the markets of a holding corporation"""
 
-    for owner in holding_corporation.owners.all():
+    markets_info: Dict[int, Dict] = field(default_factory=dict)
+    markets_assets: Dict[int, List[Dict]] = field(default_factory=dict)
+    locations: Dict[int, Dict] = field(default_factory=dict)
+    is_modified: bool = True
+    assets_fetched: bool = True
+    expires: Optional[dt.datetime] = None
 
-        structure_info = esi.client.Universe.get_universe_structures_structure_id(
-            structure_id=structure_id,
-            token=owner.fetch_token().valid_access_token(),
-        ).result()
 
-        return structure_info
+class EsiConditionalCache:
+    """
+    Remembers the ETag and the digest of the last payload received from an ESI endpoint for a corporation.
+    The payload is kept to be reused when the ESI reports that nothing changed.
+    The scope identifies the parameters used to build the payload, the ETag is only sent if it didn't change.
+    Only the ETag of the first page is known, it's only sent when the payload fit on a single page.
+    """
 
+    def __init__(self, corporation_id: int, endpoint: str, scope: str = ""):
+        self.cache_key = f"markets-esi-conditional-{endpoint}-{corporation_id}"
+        self.scope = scope
+        self.response_etag = None
+        self.response_pages = None
+        self.response_expires = None
+        entry = cache.get(self.cache_key) or {}
+        self._entry = entry if entry.get("scope") == scope else {}
+
+    @property
+    def etag(self) -> Optional[str]:
+        """ETag of the stored payload"""
+        return self._entry.get("etag")
+
+    @property
+    def data(self) -> Any:
+        """Stored payload"""
+        return self._entry.get("data")
+
+    @property
+    def is_single_page(self) -> bool:
+        """True if the stored payload was fetched from a single page"""
+        return self._entry.get("pages") == 1
+
+    def request_options(self) -> Dict:
+        """Bravado request options making the request conditional"""
+        if self.etag is None or not self.is_single_page:
+            return {}
+        return {"headers": {"If-None-Match": self.etag}}
+
+    def check_headers(self, headers: Dict, pages_count: int = 1):
+        """
+        Raises NotModifiedError if the response is the one already stored.
+        Responses of several pages are never considered as stored, their other pages might have changed
+        """
+        self.record_expires(headers)
+        self.response_etag = headers.get("ETag")
+        self.response_pages = pages_count
+        if (
+            pages_count == 1
+            and self.is_single_page
+            and self.etag is not None
+            and self.response_etag == self.etag
+        ):
+            raise NotModifiedError(headers)
+
+    def record_expires(self, headers: Optional[Dict]):
+        """Remembers until when the ESI serves the same response from its cache"""
+        if not headers:
+            return
+        if expires := parse_http_date_safe(headers.get("Expires") or ""):
+            self.response_expires = dt.datetime.fromtimestamp(
+                expires, tz=dt.timezone.utc
+            )
 
-def get_structures_from_esi(
-    holding_corporation: HoldingCorporation,
-) -> List[Dict]:
-    """Returns all structures associated with a given owner"""
+    def store(self, data) -> bool:
+        """Stores the payload and returns True if it differs from the previous one"""
+        digest = payload_digest(data)
+        is_modified = digest != self._entry.get("digest")
+        self._entry = {
+            "scope": self.scope,
+            "etag": self.response_etag,
+            "pages": self.response_pages,
+            "digest": digest,
+            "data": data,
+        }
+        cache.set(self.cache_key, self._entry, MARKETS_ESI_CONDITIONAL_CACHE_TIMEOUT)
+        return is_modified
+
+
+def get_esi_status() -> EsiStatus:
+    """
+    Returns the ESI status shared by every ESI call.
+    The status is only fetched again once it's older than MARKETS_ESI_STATUS_CACHE_TIMEOUT seconds
+    """
+    status = cache.get(ESI_STATUS_CACHE_KEY)
+    if status is None:
+        esi_status = fetch_esi_status()
+        status = {
+            "is_online": bool(esi_status.is_online),
+            "is_daily_downtime": bool(esi_status.is_daily_downtime),
+        }
+        cache.set(ESI_STATUS_CACHE_KEY, status, MARKETS_ESI_STATUS_CACHE_TIMEOUT)
+
+    return EsiStatus(**status)
+
+
+def seconds_until_downtime_end(now: Optional[dt.datetime] = None) -> int:
+    """Returns in how many seconds ESI calls can be made again after the daily downtime"""
+    now = now or timezone.now()
+    hours = int(MARKETS_ESI_DOWNTIME_END)
+    minutes = int((MARKETS_ESI_DOWNTIME_END - hours) * 60)
+    downtime_end = now.astimezone(dt.timezone.utc).replace(
+        hour=hours, minute=minutes, second=0, microsecond=0
+    )
+    if downtime_end < now:
+        downtime_end += dt.timedelta(days=1)
+    return int((downtime_end - now).total_seconds()) + DOWNTIME_END_MARGIN
+
+
+def payload_digest(data) -> str:
+    """Returns a stable digest of an ESI payload"""
+    serialized = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def structure_digest(structure_info: Dict, markets_assets: List[Dict]) -> str:
+    """
+    Returns a stable digest of the ESI data a markets update depends on:
+    the structure name, its fuel expiry and the content of its fuel and moon material bays.
+    The same digest is returned once the data went through celery serialization
+    """
+    fuel_expires = parse_esi_datetime(structure_info.get("fuel_expires"))
+    return payload_digest(
+        {
+            "name": structure_info["name"],
+            "fuel_expires": fuel_expires.isoformat() if fuel_expires else None,
+            "assets": sorted(
+                [asset["location_flag"], asset["type_id"], asset["quantity"]]
+                for asset in markets_assets
+            ),
+        }
+    )
+
+
+def _get_conditionally(
+    conditional_cache: EsiConditionalCache, fetch: Callable[[], Any]
+) -> Tuple[Any, bool]:
+    """
+    Runs the fetch function and returns its data and if it changed since the last fetch.
+    The cached payload is returned when the ESI reports that nothing changed.
+    """
+    try:
+        data = fetch()
+    except NotModifiedError as exc:
+        logger.debug("%s not modified", conditional_cache.cache_key)
+        conditional_cache.record_expires(exc.headers)
+        return conditional_cache.data, False
 
-    if fetch_esi_status().is_daily_downtime:
-        raise DownTimeError
+    return data, conditional_cache.store(data)
 
-    for owner in holding_corporation.active_owners():
+
+def _call_with_active_owners(
+    holding_corporation: HoldingCorporation,
+    esi_call: Callable[[str], Any],
+    data_name: str,
+) -> Tuple[str, Any]:
+    """
+    Runs the ESI call with the access token of each active owner until one succeeds.
+    Owners are tried in the order given by the owner scheduler and their latency and failures are recorded.
+    Returns the access token that worked with the result of the call.
+    Owners without a valid token are disabled.
+    Owners without the director role are deprioritized and disabled after several failures in a row.
+    """
+
+    owners = owner_scheduler.order(
+        holding_corporation, list(holding_corporation.active_owners())
+    )
+    for owner in owners:
+        start = time.monotonic()
         try:
-            return esi.client.Corporation.get_corporations_corporation_id_structures(
-                corporation_id=owner.corporation.corporation.corporation_id,
-                token=owner.fetch_token().valid_access_token(),
-            ).results()
+            access_token = get_access_token(owner)
+            result = esi_call(access_token)
         except Token.DoesNotExist:
-            logger.error("No token found for owner %s when fetching assets", owner)
+            logger.error(
+                "No token found for owner %s when fetching %s", owner, data_name
+            )
             owner.disable(
-                cause="ESI error fetching assets. No token found for this character."
+                cause=f"ESI error fetching {data_name}. No token found for this character."
             )
+        except HTTPNotModified as e:
+            owner_scheduler.record_success(owner, time.monotonic() - start)
+            raise NotModifiedError(getattr(e.response, "headers", None)) from e
         except HTTPForbidden as e:
             logger.error(
-                "HTTPForbidden error when fetching holding corporation %s assets with owner %s. Error: %s",
+                "HTTPForbidden error when fetching holding corporation %s %s with owner %s. Error: %s",
                 holding_corporation,
+                data_name,
                 owner,
                 e,
             )
-            owner.disable(
-                cause="ESI error fetching assets. The character might not be a director."
-            )
+            failures = owner_scheduler.record_failure(owner)
+            if owner_scheduler.should_disable(failures):
+                owner.disable(
+                    cause=f"ESI error fetching {data_name}. The character might not be a director."
+                )
         except OSError as e:
             logger.warning(
-                "Unexpected OsError when fetching holding corporation %s assets with owner %s. Error: %s",
+                "Unexpected OsError when fetching holding corporation %s %s with owner %s. Error: %s",
                 holding_corporation,
+                data_name,
                 owner,
                 e,
             )
-
-        continue
+            owner_scheduler.record_failure(owner)
+        else:
+            owner_scheduler.record_success(owner, time.monotonic() - start)
+            return access_token, result
 
     raise ESIError(
-        "All active owners returned exceptions when trying to get structure data"
+        f"All active owners returned exceptions when trying to get their {data_name}"
     )
 
 
-def get_corporation_assets(holding_corporation: HoldingCorporation):
-    """Returns all the assets of a corporation"""
+def _get_esi_result(operation) -> Tuple[Any, Any]:
+    """
+    Executes an ESI operation through the shared rate limiter and returns its data and response.
+    The error limit headers of the response are recorded, including on errors.
+    Raises EsiBudgetExhaustedError without calling the ESI if the error budget is too low.
+    """
 
-    if fetch_esi_status().is_daily_downtime:
-        raise DownTimeError
+    esi_guard.acquire()
+    operation.request_config.also_return_response = True
+    try:
+        data, response = operation.result()
+    except HTTPError as e:
+        esi_guard.record_headers(getattr(e.response, "headers", None))
+        raise
+    esi_guard.record_headers(response.headers)
 
-    for owner in holding_corporation.active_owners():
-        try:
-            return esi.client.Assets.get_corporations_corporation_id_assets(
-                corporation_id=holding_corporation.corporation.corporation_id,
-                token=owner.fetch_token().valid_access_token(),
-            ).results()
-        except Token.DoesNotExist:
-            logger.error("No token found for owner %s when fetching assets", owner)
-            owner.disable(
-                cause="ESI error fetching assets. No token found for this character."
-            )
-        except HTTPForbidden as e:
-            logger.error(
-                "HTTPForbidden error when fetching holding corporation %s assets with owner %s. Error: %s",
-                holding_corporation,
-                owner,
-                e,
-            )
-            owner.disable(
-                cause="ESI error fetching assets. The character might not be a director."
-            )
-        except OSError as e:
-            logger.warning(
-                "Unexpected OsError when fetching holding corporation %s assets with owner %s. Error: %s",
-                holding_corporation,
-                owner,
-                e,
+    return data, response
+
+
+def _get_esi_page(operation) -> Tuple[List[Dict], int, Dict]:
+    """Executes a paginated ESI operation and returns its data, the number of pages and the response headers"""
+
+    data, response = _get_esi_result(operation)
+
+    return data, int(response.headers.get("X-Pages", 1)), response.headers
+
+
+def _get_esi_pages(
+    holding_corporation: HoldingCorporation,
+    get_page: Callable[[str, int, Dict], Tuple[List[Dict], int, Dict]],
+    data_name: str,
+    conditional_cache: Optional[EsiConditionalCache] = None,
+) -> Iterator[List[Dict]]:
+    """
+    Yields the data of a paginated endpoint page by page.
+    The first page gives the number of pages, the remaining ones are then fetched concurrently
+    and yielded in the order they arrive.
+    If a conditional cache is given and the data fits on a single page that didn't change
+    NotModifiedError is raised.
+    """
+
+    if get_esi_status().is_daily_downtime:
+        raise DownTimeError(seconds_until_downtime_end())
+
+    request_options = conditional_cache.request_options() if conditional_cache else {}
+    try:
+        access_token, (first_page, pages_count, headers) = _call_with_active_owners(
+            holding_corporation,
+            lambda access_token: get_page(access_token, 1, request_options),
+            data_name,
+        )
+    except NotModifiedError as exc:
+        if int((exc.headers or {}).get("X-Pages", 1)) == 1:
+            raise
+        # The first page didn't change but the others might have, it's needed to fetch them
+        access_token, (first_page, pages_count, headers) = _call_with_active_owners(
+            holding_corporation,
+            lambda access_token: get_page(access_token, 1, {}),
+            data_name,
+        )
+    if conditional_cache:
+        conditional_cache.check_headers(headers, pages_count)
+
+    yield first_page
+
+    if pages_count > 1:
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(MARKETS_ESI_MAX_CONCURRENT_PAGES, pages_count - 1))
+        ) as executor:
+            futures = [
+                executor.submit(get_page, access_token, page, {})
+                for page in range(2, pages_count + 1)
+            ]
+            for future in as_completed(futures):
+                data, _, _ = future.result()
+                yield data
+
+
+def get_markets_from_esi(
+    holding_corporation: HoldingCorporation,
+    conditional_cache: Optional[EsiConditionalCache] = None,
+) -> List[Dict]:
+    """Returns all markets associated with a given Owner"""
+
+    structures = get_structures_from_esi(holding_corporation, conditional_cache)
+
+    return [
+        structure for structure in structures if structure["type_id"] == MARKETS_TYPE_ID
+    ]
+
+
+def get_structure_info_from_esi(
+    holding_corporation: HoldingCorporation, structure_id: int
+) -> Dict:
+    """Returns the location information of a structure"""
+
+    if get_esi_status().is_daily_downtime:
+        raise DownTimeError(seconds_until_downtime_end())
+
+    for owner in holding_corporation.owners.all():
+
+        structure_info, _ = _get_esi_result(
+            esi.client.Universe.get_universe_structures_structure_id(
+                structure_id=structure_id,
+                token=get_access_token(owner),
             )
+        )
 
-        continue
+        return structure_info
 
-    raise ESIError(
-        "All active owners returned exceptions when trying to get their structure data"
+
+def _get_corporation_structures_page(
+    corporation_id: int, access_token: str, page: int, request_options: Dict = None
+) -> Tuple[List[Dict], int, Dict]:
+    """Returns a page of a corporation's structures, the total number of pages and the response headers"""
+
+    return _get_esi_page(
+        esi.client.Corporation.get_corporations_corporation_id_structures(
+            corporation_id=corporation_id,
+            token=access_token,
+            page=page,
+            _request_options=request_options or {},
+        )
+    )
+
+
+def get_structures_from_esi(
+    holding_corporation: HoldingCorporation,
+    conditional_cache: Optional[EsiConditionalCache] = None,
+) -> List[Dict]:
+    """Returns all structures associated with a given owner"""
+
+    corporation_id = holding_corporation.corporation.corporation_id
+
+    return [
+        structure
+        for structures_page in _get_esi_pages(
+            holding_corporation,
+            lambda access_token, page, request_options: _get_corporation_structures_page(
+                corporation_id, access_token, page, request_options
+            ),
+            "structures",
+            conditional_cache,
+        )
+        for structure in structures_page
+    ]
+
+
+def _get_corporation_assets_page(
+    corporation_id: int, access_token: str, page: int, request_options: Dict = None
+) -> Tuple[List[Dict], int, Dict]:
+    """Returns a page of a corporation's assets, the total number of pages and the response headers"""
+
+    return _get_esi_page(
+        esi.client.Assets.get_corporations_corporation_id_assets(
+            corporation_id=corporation_id,
+            token=access_token,
+            page=page,
+            _request_options=request_options or {},
+        )
+    )
+
+
+def get_corporation_assets_pages(
+    holding_corporation: HoldingCorporation,
+    conditional_cache: Optional[EsiConditionalCache] = None,
+) -> Iterator[List[Dict]]:
+    """
+    Yields the assets of a corporation page by page.
+    The first page gives the number of pages, the remaining ones are then fetched concurrently
+    and yielded in the order they arrive.
+    """
+
+    corporation_id = holding_corporation.corporation.corporation_id
+
+    return _get_esi_pages(
+        holding_corporation,
+        lambda access_token, page, request_options: _get_corporation_assets_page(
+            corporation_id, access_token, page, request_options
+        ),
+        "assets",
+        conditional_cache,
     )
 
 
 def get_corporation_markets_assets(
-    holding_corporation: HoldingCorporation, markets_set_ids: Set[int]
+    holding_corporation: HoldingCorporation,
+    markets_set_ids: Set[int],
+    conditional_cache: Optional[EsiConditionalCache] = None,
 ) -> Dict[int, List[Dict]]:
     """
     Return the assets in the corporation's Markets MoonMaterialBay and FuelBay.
     Need to receive the set of the corporation's markets ids.
     The data is formatted as a dict with the key being the markets structure id and a list with the info
+    Pages are filtered as they arrive so the full list of assets is never kept in memory.
     """
 
     interesting_location_flags = [
@@ -159,13 +493,121 @@ def get_corporation_markets_assets(
         "StructureFuel",
     ]
 
-    holding_assets = get_corporation_assets(holding_corporation)
     assets_dic = defaultdict(list)
-    for asset in holding_assets:
-        if (
-            asset["location_id"] in markets_set_ids
-            and asset["location_flag"] in interesting_location_flags
-        ):
-            assets_dic[asset["location_id"]].append(asset)
+    for assets_page in get_corporation_assets_pages(
+        holding_corporation, conditional_cache
+    ):
+        for asset in assets_page:
+            if (
+                asset["location_id"] in markets_set_ids
+                and asset["location_flag"] in interesting_location_flags
+            ):
+                assets_dic[asset["location_id"]].append(asset)
 
     return assets_dic
+
+
+def get_holding_markets_data(
+    holding_corporation: HoldingCorporation, known_markets_ids: Set[int]
+) -> HoldingMarketsData:
+    """
+    Fetches the structures, assets and new structures locations of a holding corporation.
+    The location is only fetched for markets that aren't part of `known_markets_ids`
+    and whose location isn't already stored.
+    The assets are only fetched if the holding corporation needs an assets refresh
+    according to the fetched structures.
+    Structures and assets are requested with the ETag of the previous fetch.
+    The data is flagged as not modified when neither of them changed.
+    """
+
+    corporation_id = holding_corporation.corporation.corporation_id
+
+    structures_cache = EsiConditionalCache(corporation_id, "structures")
+    markets_list, structures_modified = _get_conditionally(
+        structures_cache,
+        lambda: get_markets_from_esi(holding_corporation, structures_cache),
+    )
+    markets_info = {markets["structure_id"]: markets for markets in markets_list}
+    markets_ids = set(markets_info)
+
+    assets_fetched = holding_corporation.needs_assets_refresh(markets_info)
+    if assets_fetched:
+        assets_cache = EsiConditionalCache(
+            corporation_id,
+            "assets",
+            scope=",".join(str(i) for i in sorted(markets_ids)),
+        )
+        markets_assets, assets_modified = _get_conditionally(
+            assets_cache,
+            lambda: dict(
+                get_corporation_markets_assets(
+                    holding_corporation, markets_ids, assets_cache
+                )
+            ),
+        )
+    else:
+        logger.debug("Skipping assets of corporation id %s", corporation_id)
+        markets_assets, assets_modified = {}, False
+
+    new_markets_ids = markets_ids - known_markets_ids
+    stored_locations_ids = set(
+        StructureLocation.objects.filter(
+            structure_id__in=new_markets_ids, eve_moon__isnull=False
+        ).values_list("structure_id", flat=True)
+    )
+    locations = {
+        markets_id: get_structure_info_from_esi(holding_corporation, markets_id)
+        for markets_id in new_markets_ids - stored_locations_ids
+    }
+
+    return HoldingMarketsData(
+        markets_info,
+        markets_assets,
+        locations,
+        is_modified=structures_modified or assets_modified,
+        assets_fetched=assets_fetched,
+        expires=structures_cache.response_expires,
+    )
+
+
+def _get_holding_markets_data_in_thread(
+    holding_corporation: HoldingCorporation, known_markets_ids: Set[int]
+) -> HoldingMarketsData:
+    """Runs `get_holding_markets_data` and releases the thread's database connections"""
+    try:
+        return get_holding_markets_data(holding_corporation, known_markets_ids)
+    finally:
+        connections.close_all()
+
+
+def get_holdings_markets_data(
+    holding_corporations: List[HoldingCorporation],
+    known_markets_ids: Dict[int, Set[int]],
+    max_workers: int = MARKETS_ESI_MAX_CONCURRENT_HOLDINGS,
+) -> Iterator[Tuple[HoldingCorporation, Union[HoldingMarketsData, Exception]]]:
+    """
+    Fetches the markets data of several holding corporations concurrently.
+    At most `max_workers` holdings are fetched at the same time.
+    `known_markets_ids` maps a holding corporation pk to the markets ids already in the database.
+
+    Results are yielded as soon as a holding is done.
+    If fetching a holding failed the exception is yielded instead of its data.
+    Each holding runs in a copy of the current context to share the active token pool.
+    """
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(
+                copy_context().run,
+                _get_holding_markets_data_in_thread,
+                holding_corporation,
+                known_markets_ids.get(holding_corporation.pk, set()),
+            ): holding_corporation
+            for holding_corporation in holding_corporations
+        }
+        for future in as_completed(futures):
+            holding_corporation = futures[future]
+            try:
+                yield holding_corporation, future.result()
+            except Exception as exc:  # pylint: disable = broad-exception-caught
+                yield holding_corporation, exc
@@ -0,0 +1,113 @@
+"""Rate limiting and error budget tracking shared by every worker calling the ESI"""
+
+import math
+import time
+from typing import Mapping, Optional
+
+from django.core.cache import BaseCache, cache
+
+from allianceauth.services.hooks import get_extension_logger
+
+from markets.app_settings import (
+    MARKETS_ESI_ERROR_LIMIT_THRESHOLD,
+    MARKETS_ESI_MAX_REQUESTS_PER_SECOND,
+)
+
+logger = get_extension_logger(__name__)
+
+
+class EsiBudgetExhaustedError(Exception):
+    """Signifies that the ESI error budget is too low to make more requests for now"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"ESI error budget exhausted. Retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class EsiGuard:
+    """
+    Throttles ESI requests and keeps track of the ESI error limit for every worker.
+    The state is kept in a Django cache. Any cache backend can be given, like a LocMemCache in tests.
+
+    Requests are counted in one second windows and wait for the next window once
+    `max_requests_per_second` is reached.
+    The remaining error budget is read from the ESI response headers and no request is allowed
+    while it's under `error_limit_threshold`.
+    """
+
+    RATE_KEY = "markets-esi-rate"
+    ERROR_LIMIT_KEY = "markets-esi-error-limit"
+
+    def __init__(
+        self,
+        cache_backend: Optional[BaseCache] = None,
+        max_requests_per_second: int = MARKETS_ESI_MAX_REQUESTS_PER_SECOND,
+        error_limit_threshold: int = MARKETS_ESI_ERROR_LIMIT_THRESHOLD,
+    ):
+        self._cache = cache_backend
+        self.max_requests_per_second = max_requests_per_second
+        self.error_limit_threshold = error_limit_threshold
+
+    @property
+    def cache(self) -> BaseCache:
+        """Cache holding the shared state"""
+        return self._cache if self._cache is not None else cache
+
+    def acquire(self):
+        """
+        Blocks until a request can be made.
+        Raises EsiBudgetExhaustedError if the error budget is too low.
+        """
+        self.check_error_budget()
+        self.wait_for_rate_limit()
+
+    def check_error_budget(self):
+        """Raises EsiBudgetExhaustedError if the remaining error budget is under the threshold"""
+        error_limit = self.cache.get(self.ERROR_LIMIT_KEY)
+        if not error_limit or error_limit["remain"] > self.error_limit_threshold:
+            return
+
+        retry_after = error_limit["reset_at"] - time.time()
+        if retry_after > 0:
+            raise EsiBudgetExhaustedError(math.ceil(retry_after))
+
+    def wait_for_rate_limit(self):
+        """Waits until the current one second window has room for another request"""
+        if self.max_requests_per_second <= 0:
+            return
+
+        while True:
+            now = time.time()
+            window = int(now)
+            key = f"{self.RATE_KEY}-{window}"
+            self.cache.add(key, 0, timeout=2)
+            try:
+                count = self.cache.incr(key)
+            except ValueError:  # the window expired between add and incr
+                continue
+            if count <= self.max_requests_per_second:
+                return
+            time.sleep(window + 1 - now)
+
+    def record_headers(self, headers: Optional[Mapping]):
+        """Stores the error limit received in the headers of an ESI response"""
+        if not headers:
+            return
+        try:
+            remain = int(headers["X-ESI-Error-Limit-Remain"])
+            reset = int(headers["X-ESI-Error-Limit-Reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        self.cache.set(
+            self.ERROR_LIMIT_KEY,
+            {"remain": remain, "reset_at": time.time() + reset},
+            timeout=max(1, reset),
+        )
+        if remain <= self.error_limit_threshold:
+            logger.warning(
+                "ESI error budget is low: %s errors left for %s seconds", remain, reset
+            )
+
+
+esi_guard = EsiGuard()
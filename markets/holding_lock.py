@@ -0,0 +1,87 @@
+"""Keeps at most one update of each holding corporation running or pending"""
+
+import uuid
+from typing import Optional
+
+from django.core.cache import BaseCache, cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from allianceauth.services.hooks import get_extension_logger
+
+from markets.app_settings import MARKETS_HOLDING_LOCK_LEASE
+
+logger = get_extension_logger(__name__)
+
+_local_cache = LocMemCache("markets-holding-lock", {})
+
+
+class HoldingLock:
+    """
+    Lease based lock of the holding corporations updates shared by every worker through a Django cache.
+
+    A running update holds the lease of its holding for at most `lease_seconds`
+    so a crashed worker can't block the holding forever.
+    A queued update sets the pending flag of its holding until it starts running,
+    any other enqueue is dropped while the holding is pending or running.
+
+    Releases aren't atomic, a lease expiring right before its release could free a lease taken in between.
+    Falls back to a cache local to the process when the Django cache doesn't store anything.
+    """
+
+    LEASE_KEY = "markets-holding-lease-{}"
+    PENDING_KEY = "markets-holding-pending-{}"
+
+    def __init__(
+        self,
+        cache_backend: Optional[BaseCache] = None,
+        lease_seconds: int = MARKETS_HOLDING_LOCK_LEASE,
+    ):
+        self._cache = cache_backend
+        self.lease_seconds = lease_seconds
+
+    @property
+    def cache(self) -> BaseCache:
+        """Cache holding the leases"""
+        if self._cache is not None:
+            return self._cache
+        if isinstance(cache, DummyCache):
+            return _local_cache
+        return cache
+
+    def acquire(self, holding_corp_id: int) -> Optional[str]:
+        """Takes the lease of the holding and returns its token. Returns None if it's already taken"""
+        token = uuid.uuid4().hex
+        if self.cache.add(
+            self.LEASE_KEY.format(holding_corp_id), token, self.lease_seconds
+        ):
+            return token
+        return None
+
+    def release(self, holding_corp_id: int, token: str):
+        """Releases the lease of the holding if it's still held with the token"""
+        key = self.LEASE_KEY.format(holding_corp_id)
+        if self.cache.get(key) == token:
+            self.cache.delete(key)
+
+    def is_running(self, holding_corp_id: int) -> bool:
+        """True if an update of the holding holds its lease"""
+        return self.cache.get(self.LEASE_KEY.format(holding_corp_id)) is not None
+
+    def mark_pending(self, holding_corp_id: int, countdown: int = 0) -> bool:
+        """
+        Flags an update of the holding as queued to start in `countdown` seconds.
+        Returns False if the holding is already pending
+        """
+        return self.cache.add(
+            self.PENDING_KEY.format(holding_corp_id),
+            True,
+            countdown + self.lease_seconds,
+        )
+
+    def clear_pending(self, holding_corp_id: int):
+        """Removes the pending flag once the queued update starts"""
+        self.cache.delete(self.PENDING_KEY.format(holding_corp_id))
+
+
+holding_lock = HoldingLock()
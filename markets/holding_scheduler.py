@@ -0,0 +1,125 @@
+"""Spreads the updates of the holding corporations over the refresh interval"""
+
+import datetime as dt
+from typing import List, Optional, Set, Tuple
+
+from django.utils import timezone
+
+from allianceauth.services.hooks import get_extension_logger
+
+from markets.app_settings import (
+    MARKETS_HOLDING_REFRESH_INTERVAL,
+    MARKETS_HOLDING_SCHEDULER_TICK,
+)
+from markets.models import HoldingCorporation, Markets
+
+logger = get_extension_logger(__name__)
+
+
+class HoldingScheduler:
+    """
+    Plans the holding updates starting during the next tick of the beat schedule.
+
+    Every holding gets a slot in the refresh interval by rank of corporation id
+    so the updates are spread evenly instead of all starting at the same time.
+    A holding is planned at its slot unless it was updated during the last half interval.
+    Overdue holdings are spread over the tick
+    and holdings with markets about to cross their fuel ping threshold are planned first.
+    No update starts before the ESI stops serving the previous structures from its cache,
+    holdings whose cache outlives the tick are left to a later tick.
+    """
+
+    def __init__(
+        self,
+        interval: int = MARKETS_HOLDING_REFRESH_INTERVAL * 60,
+        tick: int = MARKETS_HOLDING_SCHEDULER_TICK * 60,
+    ):
+        self.interval = interval
+        self.tick = tick
+
+    def holdings_near_fuel_threshold(self, now: dt.datetime) -> Set[int]:
+        """
+        Returns the ids of the holdings with a markets whose fuel blocks will run under the ping threshold
+        of its corporation before the next update
+        """
+        return {
+            corporation_pk
+            for corporation_pk, fuel_expires, ping_days in Markets.objects.filter(
+                was_fuel_pinged=False,
+                fuel_expires__isnull=False,
+                corporation__ping_on_remaining_fuel_days__gt=0,
+            ).values_list(
+                "corporation_id",
+                "fuel_expires",
+                "corporation__ping_on_remaining_fuel_days",
+            )
+            if fuel_expires <= now + dt.timedelta(days=ping_days, seconds=self.interval)
+        }
+
+    def plan(
+        self,
+        holdings: List[HoldingCorporation],
+        now: Optional[dt.datetime] = None,
+    ) -> List[Tuple[int, int]]:
+        """
+        Returns the corporation ids of the holdings to update during the next tick
+        with the countdown of their update in seconds, the most urgent first
+        """
+        now = now or timezone.now()
+        now_ts = now.timestamp()
+        cycle_start = now_ts - now_ts % self.interval
+        near_fuel_threshold = self.holdings_near_fuel_threshold(now)
+
+        holdings = sorted(holdings, key=lambda holding: holding.pk)
+        overdue_ranks = {
+            holding.pk: rank
+            for rank, holding in enumerate(
+                holding
+                for holding in holdings
+                if holding.last_updated is None
+                or now_ts - holding.last_updated.timestamp()
+                >= self.interval + self.tick
+            )
+        }
+
+        planned = []
+        for rank, holding in enumerate(holdings):
+            last_updated = (
+                holding.last_updated.timestamp() if holding.last_updated else None
+            )
+            slot = cycle_start + rank * self.interval / len(holdings)
+            if slot < now_ts:
+                slot += self.interval
+
+            is_urgent = holding.pk in near_fuel_threshold and (
+                last_updated is None or now_ts - last_updated >= self.tick
+            )
+            if is_urgent:
+                start = now_ts
+            elif holding.pk in overdue_ranks:
+                start = now_ts + overdue_ranks[holding.pk] * self.tick / len(
+                    overdue_ranks
+                )
+            elif slot < now_ts + self.tick and slot - last_updated >= self.interval / 2:
+                start = slot
+            else:
+                continue
+
+            if holding.esi_expires:
+                start = max(start, holding.esi_expires.timestamp())
+            if start >= now_ts + self.tick:
+                logger.debug(
+                    "ESI data of corporation id %s still cached. Not planned",
+                    holding.corporation.corporation_id,
+                )
+                continue
+
+            planned.append((not is_urgent, start, holding.corporation.corporation_id))
+
+        return [
+            (corporation_id, round(start - now_ts))
+            for _, start, corporation_id in sorted(planned)
+        ]
+
+
+holding_scheduler = HoldingScheduler()
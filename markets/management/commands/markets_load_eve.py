@@ -2,6 +2,8 @@ from django.core.management import BaseCommand, call_command
 
 from allianceauth.services.hooks import get_extension_logger
 
+from markets.type_catalog import invalidate_type_catalog
+
 logger = get_extension_logger(__name__)
 
 
@@ -19,6 +21,7 @@ class Command(BaseCommand):
             "--type_id",
             81143,  # magmatic
         )
+        invalidate_type_catalog()
 
         """
         self.stdout.write("Loading data from the ESI. It might take a while")
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eveuniverse", "0010_alter_eveindustryactivityduration_eve_type_and_more"),
+        ("markets", "0004_alter_markets_tags"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StructureLocation",
+            fields=[
+                (
+                    "structure_id",
+                    models.PositiveBigIntegerField(primary_key=True, serialize=False),
+                ),
+                ("position_x", models.FloatField()),
+                ("position_y", models.FloatField()),
+                ("position_z", models.FloatField()),
+                (
+                    "disappeared_at",
+                    models.DateTimeField(
+                        default=None,
+                        help_text="When the structure stopped being seen in a holding corporation",
+                        null=True,
+                    ),
+                ),
+                (
+                    "eve_moon",
+                    models.ForeignKey(
+                        default=None,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="eveuniverse.evemoon",
+                    ),
+                ),
+                (
+                    "solar_system",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="eveuniverse.evesolarsystem",
+                    ),
+                ),
+            ],
+        ),
+    ]
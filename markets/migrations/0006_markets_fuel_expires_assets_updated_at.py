@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("markets", "0005_structurelocation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="holdingcorporation",
+            name="assets_updated_at",
+            field=models.DateTimeField(
+                default=None,
+                help_text="Last time the corporation assets were fetched to update its markets",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="markets",
+            name="fuel_expires",
+            field=models.DateTimeField(
+                default=None,
+                help_text="When the markets runs out of fuel blocks according to the ESI",
+                null=True,
+            ),
+        ),
+    ]
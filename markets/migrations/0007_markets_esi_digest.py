@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("markets", "0006_markets_fuel_expires_assets_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="markets",
+            name="esi_digest",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Digest of the ESI structure and assets data of the last update",
+                max_length=64,
+            ),
+        ),
+    ]
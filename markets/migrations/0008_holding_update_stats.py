@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("markets", "0007_markets_esi_digest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="holdingcorporation",
+            name="last_update_duration",
+            field=models.FloatField(
+                default=None,
+                help_text="Seconds the last update took from the ESI fetch to its last markets written",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="holdingcorporation",
+            name="last_update_failed",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Markets the last update failed to create or update",
+            ),
+        ),
+        migrations.AddField(
+            model_name="holdingcorporation",
+            name="last_update_succeeded",
+            field=models.PositiveIntegerField(
+                default=0, help_text="Markets created or updated by the last update"
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("markets", "0008_holding_update_stats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="holdingcorporation",
+            name="esi_expires",
+            field=models.DateTimeField(
+                default=None,
+                help_text="When the ESI stops serving the last fetched structures of the corporation from its cache",
+                null=True,
+            ),
+        ),
+    ]
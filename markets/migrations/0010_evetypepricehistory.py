@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eveuniverse", "0012_alter_evebloodline_eve_ship_type"),
+        ("markets", "0009_holdingcorporation_esi_expires"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EveTypePriceHistory",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "side",
+                    models.CharField(
+                        choices=[("buy", "Buy"), ("sell", "Sell")], max_length=4
+                    ),
+                ),
+                (
+                    "resolution",
+                    models.PositiveIntegerField(
+                        choices=[(0, "Raw"), (3600, "Hourly"), (86400, "Daily")]
+                    ),
+                ),
+                (
+                    "timestamp",
+                    models.DateTimeField(
+                        help_text="When the price or its period started"
+                    ),
+                ),
+                ("price", models.FloatField()),
+                ("low", models.FloatField()),
+                ("high", models.FloatField()),
+                ("samples", models.PositiveIntegerField(default=1)),
+                (
+                    "eve_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="eveuniverse.evetype",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="evetypepricehistory",
+            constraint=models.UniqueConstraint(
+                fields=("eve_type", "side", "resolution", "timestamp"),
+                name="functional_pk_evetypepricehistory",
+            ),
+        ),
+    ]
@@ -1,19 +1,24 @@
 """Models."""
 
+# pylint: disable = too-many-lines
+
 import datetime
 import re
-from math import ceil, floor
-from typing import Dict, List, Optional, Set
+from collections import defaultdict
+from math import ceil
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import dhooks_lite
 from moonmining.models import Moon as MoonminigMoon
 
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Count, Min, Sum
+from django.db import connections, models, router
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import Floor, Greatest
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from esi.models import Token
-from eveuniverse.models import EveGroup, EveMoon, EveType
+from eveuniverse.models import EveMoon, EveSolarSystem, EveType
 
 from allianceauth.authentication.models import CharacterOwnership
 from allianceauth.eveonline.evelinks.dotlan import solar_system_url
@@ -25,10 +30,17 @@ from app_utils.allianceauth import notify_admins
 
 from markets.app_settings import (
     MARKETS_ADMIN_NOTIFICATIONS_ENABLED,
+    MARKETS_ASSETS_REFRESH_BAY_RATIO,
+    MARKETS_ASSETS_REFRESH_INTERVAL,
     MARKETS_FUEL_BLOCKS_PER_HOUR,
     MARKETS_MAGMATIC_GASES_PER_HOUR,
     MARKETS_MOON_MATERIAL_BAY_CAPACITY,
+    MARKETS_PRICE_HISTORY_DAILY_RETENTION_DAYS,
+    MARKETS_PRICE_HISTORY_HOURLY_RETENTION_DAYS,
+    MARKETS_PRICE_HISTORY_RAW_RETENTION_DAYS,
 )
+from markets.prices import price_cache
+from markets.type_catalog import MAGMATIC_TYPE_ID, get_type_catalog
 
 ESI_SCOPES = [
     "esi-universe.read_structures.v1",
@@ -39,6 +51,13 @@ ESI_SCOPES = [
 logger = get_extension_logger(__name__)
 
 
+def parse_esi_datetime(value) -> Optional[datetime.datetime]:
+    """Returns the datetime of an ESI value received either as a datetime or as an ISO string"""
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return parse_datetime(value)
+
+
 class General(models.Model):
     """A meta model for app permissions."""
 
@@ -65,6 +84,29 @@ class HoldingCorporation(models.Model):
 
     is_active = models.BooleanField(default=True)
     last_updated = models.DateTimeField(null=True, default=None)
+    assets_updated_at = models.DateTimeField(
+        null=True,
+        default=None,
+        help_text="Last time the corporation assets were fetched to update its markets",
+    )
+    esi_expires = models.DateTimeField(
+        null=True,
+        default=None,
+        help_text="When the ESI stops serving the last fetched structures of the corporation from its cache",
+    )
+    last_update_duration = models.FloatField(
+        null=True,
+        default=None,
+        help_text="Seconds the last update took from the ESI fetch to its last markets written",
+    )
+    last_update_succeeded = models.PositiveIntegerField(
+        default=0,
+        help_text="Markets created or updated by the last update",
+    )
+    last_update_failed = models.PositiveIntegerField(
+        default=0,
+        help_text="Markets the last update failed to create or update",
+    )
 
     ping_on_remaining_magmatic_days = models.IntegerField(
         default=0,
@@ -106,10 +148,82 @@ class HoldingCorporation(models.Model):
         """Returns corporation owners that haven't been disabled"""
         return self.owners.filter(is_enabled=True)
 
-    def set_update_time_now(self):
-        """Informs that this corporation has just been properly updated"""
+    def needs_assets_refresh(
+        self, markets_info: Dict[int, Dict], now: Optional[datetime.datetime] = None
+    ) -> bool:
+        """
+        Tells if the corporation assets should be fetched during this update.
+        They are fetched every MARKETS_ASSETS_REFRESH_INTERVAL hours and earlier when, according to
+        the projected consumption and harvest since the last fetch, a markets of the structures info
+        crossed a fuel or magmatic gas ping threshold or its moon material bay got nearly full
+        """
+        if not MARKETS_ASSETS_REFRESH_INTERVAL or self.assets_updated_at is None:
+            return True
+
+        now = now or timezone.now()
+        hours_since_refresh = (now - self.assets_updated_at).total_seconds() / 3600
+        if hours_since_refresh >= MARKETS_ASSETS_REFRESH_INTERVAL:
+            return True
+
+        stored_volumes = dict(
+            MarketsStoredMoonMaterials.objects.filter(markets__corporation=self)
+            .values("markets_id")
+            .annotate(volume=Sum(F("amount") * F("product__volume")))
+            .values_list("markets_id", "volume")
+        )
+        hourly_volumes = dict(
+            MarketsHourlyProducts.objects.filter(moon__markets__corporation=self)
+            .values("moon__markets")
+            .annotate(volume=Sum(F("amount") * F("product__volume")))
+            .values_list("moon__markets", "volume")
+        )
+        nearly_full_volume = (
+            MARKETS_MOON_MATERIAL_BAY_CAPACITY * MARKETS_ASSETS_REFRESH_BAY_RATIO
+        )
+
+        for markets in self.markets.filter(structure_id__in=markets_info).annotate(
+            **Markets.remaining_days_annotations(hours_since_refresh)
+        ):
+            if (
+                markets.remaining_fuel_days < self.ping_on_remaining_fuel_days
+            ) != markets.was_fuel_pinged:
+                logger.debug("Markets %s crossed its fuel threshold", markets)
+                return True
+
+            if (
+                markets.remaining_magmatic_days < self.ping_on_remaining_magmatic_days
+                and not markets.was_magmatic_pinged
+            ):
+                logger.debug("Markets %s crossed its magmatic gas threshold", markets)
+                return True
+
+            stored_volume = stored_volumes.get(markets.structure_id) or 0
+            projected_volume = stored_volume + hours_since_refresh * (
+                hourly_volumes.get(markets.structure_id) or 0
+            )
+            if stored_volume < nearly_full_volume <= projected_volume:
+                logger.debug("Markets %s moon material bay is nearly full", markets)
+                return True
+
+        return False
+
+    def record_update(self, started_at: float, succeeded: int = 0, failed: int = 0):
+        """
+        Records the completion of an update started at the `started_at` timestamp
+        with the number of markets it wrote and failed to write
+        """
         self.last_updated = timezone.now()
-        self.save()
+        self.last_update_duration = max(0.0, self.last_updated.timestamp() - started_at)
+        self.last_update_succeeded = succeeded
+        self.last_update_failed = failed
+        self.save(
+            update_fields=[
+                "last_updated",
+                "last_update_duration",
+                "last_update_succeeded",
+                "last_update_failed",
+            ]
+        )
 
     def ping_markets_fuel(self, markets: "Markets", new_fuel_blocks_amount: int):
         """Sends out to all webhooks a notification about the Markets low fuel blocks level"""
@@ -316,8 +430,9 @@ class Moon(models.Model):
 
     def update_price(self):
         """Updates the Markets price attribute to display"""
+        prices = price_cache.get()
         hourly_harvest_value = sum(
-            EveTypePrice.get_eve_type_price(moon_goo) * moon_goo_amount
+            prices.price(moon_goo.id) * moon_goo_amount
             for moon_goo, moon_goo_amount in self.hourly_pull.items()
         )
         self.value = hourly_harvest_value * 24 * 30
@@ -387,6 +502,18 @@ class Markets(models.Model):
 
     fuel_blocks_count = models.IntegerField(default=0)
     magmatic_gas_count = models.IntegerField(default=0)
+    fuel_expires = models.DateTimeField(
+        null=True,
+        default=None,
+        help_text="When the markets runs out of fuel blocks according to the ESI",
+    )
+
+    esi_digest = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        help_text="Digest of the ESI structure and assets data of the last update",
+    )
 
     was_magmatic_pinged = models.BooleanField(
         default=False,
@@ -397,6 +524,169 @@ class Markets(models.Model):
         help_text="If a ping has been sent out after noticing a low fuel level",
     )
 
+    TRACKED_FIELDS = (
+        "structure_name",
+        "fuel_blocks_count",
+        "magmatic_gas_count",
+        "fuel_expires",
+        "esi_digest",
+        "was_magmatic_pinged",
+        "was_fuel_pinged",
+    )
+    """Fields updated from the ESI whose changes are tracked to only write what changed"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._saved_values = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.reset_tracked_fields()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.reset_tracked_fields()
+
+    def reset_tracked_fields(self):
+        """Remembers the current values of the tracked fields as the ones in the database"""
+        self._saved_values = {
+            field_name: self.__dict__[field_name]
+            for field_name in self.TRACKED_FIELDS
+            if field_name in self.__dict__
+        }
+
+    def changed_fields(self) -> List[str]:
+        """Returns the tracked fields edited since the markets was loaded or saved"""
+        return [
+            field_name
+            for field_name in self.TRACKED_FIELDS
+            if field_name in self._saved_values
+            and getattr(self, field_name) != self._saved_values[field_name]
+        ]
+
+    @classmethod
+    def bulk_save_changes(cls, markets_list: List["Markets"]) -> int:
+        """Writes the changed tracked fields of many markets in bulk and returns how many changed"""
+        changed_markets = {}
+        for markets in markets_list:
+            if changed_fields := markets.changed_fields():
+                changed_markets[markets] = changed_fields
+
+        if not changed_markets:
+            return 0
+
+        update_fields = sorted(
+            {
+                field_name
+                for changed_fields in changed_markets.values()
+                for field_name in changed_fields
+            }
+        )
+        cls.objects.bulk_update(changed_markets, fields=update_fields)
+        for markets in changed_markets:
+            markets.reset_tracked_fields()
+
+        return len(changed_markets)
+
+    @staticmethod
+    def remaining_days_annotations(hours_elapsed: float = 0.0) -> Dict:
+        """
+        Returns the remaining_fuel_days and remaining_magmatic_days annotations,
+        the full days the stored fuel blocks and magmatic gases last once consumed for `hours_elapsed` hours
+        """
+
+        def remaining_days(count_field: str, per_hour: int):
+            projected_count = Greatest(
+                F(count_field) - hours_elapsed * per_hour,
+                0.0,
+                output_field=models.FloatField(),
+            )
+            return Floor(projected_count / (per_hour * 24))
+
+        return {
+            "remaining_fuel_days": remaining_days(
+                "fuel_blocks_count", MARKETS_FUEL_BLOCKS_PER_HOUR
+            ),
+            "remaining_magmatic_days": remaining_days(
+                "magmatic_gas_count", MARKETS_MAGMATIC_GASES_PER_HOUR
+            ),
+        }
+
+    @classmethod
+    def evaluate_alerts(cls, markets_ids: Set[int]) -> List[Tuple[int, str, int]]:
+        """
+        Finds the markets whose fuel blocks or magmatic gases crossed the ping threshold of their corporation.
+        The remaining days of all the markets are computed in a single query and the pinged flags flipped in bulk.
+        Returns the (markets id, "fuel" or "magmatic", amount) alerts to send out
+        """
+        fuel_days = F("corporation__ping_on_remaining_fuel_days")
+        magmatic_days = F("corporation__ping_on_remaining_magmatic_days")
+        markets_qs = cls.objects.filter(pk__in=markets_ids).annotate(
+            **cls.remaining_days_annotations()
+        )
+        crossings = {
+            "low_fuel": Q(remaining_fuel_days__lt=fuel_days, was_fuel_pinged=False),
+            "fuel_back": Q(remaining_fuel_days__gte=fuel_days, was_fuel_pinged=True),
+            "low_magmatic": Q(
+                remaining_magmatic_days__lt=magmatic_days, was_magmatic_pinged=False
+            ),
+            "magmatic_back": Q(
+                remaining_magmatic_days__gte=magmatic_days, was_magmatic_pinged=True
+            ),
+        }
+
+        crossed = defaultdict(list)
+        for row in markets_qs.filter(
+            crossings["low_fuel"]
+            | crossings["fuel_back"]
+            | crossings["low_magmatic"]
+            | crossings["magmatic_back"]
+        ).values(
+            "pk",
+            "fuel_blocks_count",
+            "magmatic_gas_count",
+            "was_fuel_pinged",
+            "was_magmatic_pinged",
+            "remaining_fuel_days",
+            "remaining_magmatic_days",
+            fuel_threshold=fuel_days,
+            magmatic_threshold=magmatic_days,
+        ):
+            if row["remaining_fuel_days"] < row["fuel_threshold"]:
+                if not row["was_fuel_pinged"]:
+                    crossed["low_fuel"].append(row)
+            elif row["was_fuel_pinged"]:
+                crossed["fuel_back"].append(row)
+            if row["remaining_magmatic_days"] < row["magmatic_threshold"]:
+                if not row["was_magmatic_pinged"]:
+                    crossed["low_magmatic"].append(row)
+            elif row["was_magmatic_pinged"]:
+                crossed["magmatic_back"].append(row)
+
+        for crossing, field_name, value in (
+            ("low_fuel", "was_fuel_pinged", True),
+            ("fuel_back", "was_fuel_pinged", False),
+            ("low_magmatic", "was_magmatic_pinged", True),
+            ("magmatic_back", "was_magmatic_pinged", False),
+        ):
+            if crossed[crossing]:
+                cls.objects.filter(
+                    pk__in=[row["pk"] for row in crossed[crossing]]
+                ).update(**{field_name: value})
+
+        logger.debug(
+            "Markets alerts crossings: %s",
+            {crossing: len(rows) for crossing, rows in crossed.items()},
+        )
+        return [
+            (row["pk"], "fuel", row["fuel_blocks_count"]) for row in crossed["low_fuel"]
+        ] + [
+            (row["pk"], "magmatic", row["magmatic_gas_count"])
+            for row in crossed["low_magmatic"]
+        ]
+
     @property
     def system_name(self) -> str:
         """Returns the system name from the structure name"""
@@ -408,103 +698,80 @@ class Markets(models.Model):
 
     def get_stored_moon_materials_value(self) -> float:
         """Return the value of all moon materials stored in the markets"""
+        prices = price_cache.get()
         return sum(
-            EveTypePrice.get_eve_type_price(stored_moon_material.product)
-            * stored_moon_material.amount
+            prices.price(stored_moon_material.product_id) * stored_moon_material.amount
             for stored_moon_material in self.get_stored_moon_materials()
         )
 
     def get_stored_moon_materials_volume(self) -> float:
         """Return the volume of all moon materials stored in the markets"""
+        volumes = get_type_catalog().volumes
         return round(
             sum(
-                stored_moon_material.product.volume * stored_moon_material.amount
+                (
+                    volumes[stored_moon_material.product_id]
+                    if stored_moon_material.product_id in volumes
+                    else stored_moon_material.product.volume
+                )
+                * stored_moon_material.amount
                 for stored_moon_material in self.get_stored_moon_materials()
             ),
             2,
         )
 
-    def set_fuel_blocs(self, new_amount):
-        """Edits the amount of fuel blocks in the Markets and sends a notification if needed"""
-
-        self.fuel_blocks_count = new_amount
-
-        remaining_fuel_days = floor(
-            self.fuel_blocks_count / (MARKETS_FUEL_BLOCKS_PER_HOUR * 24)
-        )
-
-        ping_on_remaining_fuel_days = self.corporation.ping_on_remaining_fuel_days
-        if (
-            ping_on_remaining_fuel_days > remaining_fuel_days
-            and not self.was_fuel_pinged
-        ):
-            logger.info(
-                "Fuel blocks level of markets id %s are under %s (%s)",
-                self.structure_id,
-                ping_on_remaining_fuel_days,
-                new_amount,
-            )
-            self.corporation.ping_markets_fuel(self, new_amount)
-            self.was_fuel_pinged = True
-
-        elif (
-            ping_on_remaining_fuel_days <= remaining_fuel_days and self.was_fuel_pinged
-        ):
-            logger.info(
-                "Fuel block level of markets id %s is now back above %s (%s)",
-                self.structure_id,
-                ping_on_remaining_fuel_days,
-                new_amount,
-            )
-            self.was_fuel_pinged = False
-
-        self.save()
-
-    def set_magmatic_gases(self, new_amount):
-        """Edits the amount of magmatic gases in the Markets and sends a notification if needed"""
+    def __str__(self):
+        return self.structure_name
 
-        self.magmatic_gas_count = new_amount
+    class Meta:
+        verbose_name_plural = "Markets"
 
-        remaining_gas_days = floor(
-            self.magmatic_gas_count / (MARKETS_MAGMATIC_GASES_PER_HOUR * 24)
-        )
 
-        ping_on_remaining_magmatic_days = (
-            self.corporation.ping_on_remaining_magmatic_days
-        )
-
-        if (
-            ping_on_remaining_magmatic_days > remaining_gas_days
-            and not self.was_magmatic_pinged
-        ):
-            logger.info(
-                "Magmatic gas level of markets id %s are under %s (%s)",
-                self.structure_id,
-                ping_on_remaining_magmatic_days,
-                new_amount,
-            )
-            self.corporation.ping_markets_magma(self, new_amount)
-            self.was_magmatic_pinged = True
+class StructureLocation(models.Model):
+    """
+    Location of a structure as returned by the ESI and the moon it was anchored on.
+    Structures never move so the location is kept even if the Markets is deleted
+    and only removed once the structure disappeared for good.
+    """
 
-        elif (
-            ping_on_remaining_magmatic_days <= remaining_gas_days
-            and self.was_magmatic_pinged
-        ):
-            logger.info(
-                "Magmatic gas level of markets id %s is now back above %s (%s)",
-                self.structure_id,
-                ping_on_remaining_magmatic_days,
-                new_amount,
-            )
-            self.was_magmatic_pinged = False
+    structure_id = models.PositiveBigIntegerField(primary_key=True)
+    solar_system = models.ForeignKey(
+        EveSolarSystem, on_delete=models.CASCADE, related_name="+"
+    )
+    position_x = models.FloatField()
+    position_y = models.FloatField()
+    position_z = models.FloatField()
+    eve_moon = models.ForeignKey(
+        EveMoon,
+        on_delete=models.CASCADE,
+        null=True,
+        default=None,
+        related_name="+",
+    )
 
-        self.save()
+    disappeared_at = models.DateTimeField(
+        null=True,
+        default=None,
+        help_text="When the structure stopped being seen in a holding corporation",
+    )
 
     def __str__(self):
-        return self.structure_name
+        return f"{self.structure_id} - {self.eve_moon or self.solar_system}"
 
-    class Meta:
-        verbose_name_plural = "Markets"
+    @classmethod
+    def mark_disappeared(cls, structure_ids: Set[int]):
+        """Flags the locations of structures that aren't present in a holding anymore"""
+        cls.objects.filter(
+            structure_id__in=structure_ids, disappeared_at__isnull=True
+        ).update(disappeared_at=timezone.now())
+
+    @classmethod
+    def delete_disappeared(cls, retention: datetime.timedelta) -> int:
+        """Deletes the locations of structures that disappeared for longer than the retention"""
+        deleted, _ = cls.objects.filter(
+            disappeared_at__lt=timezone.now() - retention
+        ).delete()
+        return deleted
 
 
 class MarketsHourlyProducts(models.Model):
@@ -550,6 +817,59 @@ class MarketsStoredMoonMaterials(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.amount} in {self.markets.structure_name}"
 
+    @classmethod
+    def sync_bay_contents(cls, bay_contents: Dict[int, Dict[int, int]]):
+        """
+        Replaces the stored moon materials of markets with the received bay contents.
+        `bay_contents` maps a markets id to the amount of each product id in its moon material bay.
+        Current amounts are upserted and materials not in the bay anymore deleted
+        in a constant number of queries.
+        """
+        if not bay_contents:
+            return
+
+        stored_moon_materials = [
+            cls(markets_id=markets_id, product_id=product_id, amount=amount)
+            for markets_id, products in bay_contents.items()
+            for product_id, amount in products.items()
+        ]
+
+        features = connections[router.db_for_write(cls)].features
+        if features.supports_update_conflicts_with_target:
+            cls.objects.bulk_create(
+                stored_moon_materials,
+                update_conflicts=True,
+                unique_fields=["markets", "product"],
+                update_fields=["amount"],
+            )
+        elif features.supports_update_conflicts:
+            cls.objects.bulk_create(
+                stored_moon_materials, update_conflicts=True, update_fields=["amount"]
+            )
+        else:
+            existing_ids = {
+                (markets_id, product_id): pk
+                for pk, markets_id, product_id in cls.objects.filter(
+                    markets_id__in=bay_contents
+                ).values_list("pk", "markets_id", "product_id")
+            }
+            for stored_moon_material in stored_moon_materials:
+                stored_moon_material.pk = existing_ids.get(
+                    (stored_moon_material.markets_id, stored_moon_material.product_id)
+                )
+            cls.objects.bulk_update(
+                [stored for stored in stored_moon_materials if stored.pk],
+                fields=["amount"],
+            )
+            cls.objects.bulk_create(
+                [stored for stored in stored_moon_materials if not stored.pk]
+            )
+
+        stale_filter = Q()
+        for markets_id, products in bay_contents.items():
+            stale_filter |= Q(markets_id=markets_id) & ~Q(product_id__in=list(products))
+        cls.objects.filter(stale_filter).delete()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -577,9 +897,7 @@ class EveTypePrice(models.Model):
     Represent an eve type and its last fetched price
     """
 
-    __MOON_GOOS_GROUP_ID = 427
-    __FUEL_BLOCK_GROUP_ID = 1136
-    __MAGMATIC_TYPE_ID = 81143
+    __MAGMATIC_TYPE_ID = MAGMATIC_TYPE_ID
 
     eve_type = models.OneToOneField(EveType, on_delete=models.CASCADE, related_name="+")
     price = models.FloatField(default=0)
@@ -588,6 +906,15 @@ class EveTypePrice(models.Model):
     def __str__(self):
         return f"{self.eve_type.name} - {self.price} ISK"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        price_cache.invalidate()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        price_cache.invalidate()
+        return result
+
     def update_price(self, new_price: float):
         """Updates the price of an item"""
         if new_price <= 0:
@@ -598,31 +925,22 @@ class EveTypePrice(models.Model):
     @classmethod
     def get_eve_type_price(cls, eve_type: EveType) -> float:
         """Returns the price of an item"""
-        type_price, _ = cls.objects.get_or_create(eve_type=eve_type)
-        return type_price.price
+        return cls.get_eve_type_id_price(eve_type.id)
 
     @classmethod
     def get_eve_type_id_price(cls, eve_type_id: int) -> float:
         """Returns the price of an item id"""
-        return cls.get_eve_type_price(EveType.objects.get(id=eve_type_id))
-
-    @classmethod
-    def _get_type_ids_from_group(cls, group_id: int) -> Set[int]:
-        """Fetches type ids from their group and returns it as a set"""
-        group = EveGroup.objects.get(id=group_id)
-        return set(group.eve_types.filter(published=True).values_list("id", flat=True))
+        return price_cache.price(eve_type_id)
 
     @classmethod
     def get_fuels_type_ids(cls) -> Set[int]:
-        """Fetches the id of all 4 fuel blocks from their group and magmatic gas"""
-        return cls._get_type_ids_from_group(cls.__FUEL_BLOCK_GROUP_ID) | {
-            cls.__MAGMATIC_TYPE_ID
-        }
+        """Returns the id of all 4 fuel blocks and magmatic gas"""
+        return set(get_type_catalog().fuel_type_ids)
 
     @classmethod
     def get_moon_goos_type_ids(cls) -> Set[int]:
-        """Fetches the ids of all moon goos from their group"""
-        return cls._get_type_ids_from_group(cls.__MOON_GOOS_GROUP_ID)
+        """Returns the ids of all moon goos"""
+        return set(get_type_catalog().moon_goo_type_ids)
 
     @classmethod
     def get_magmatic_gas_type_id(cls) -> int:
@@ -632,12 +950,7 @@ class EveTypePrice(models.Model):
     @classmethod
     def get_fuel_block_price(cls) -> float:
         """Returns the price of the cheapest fuel block"""
-        return (
-            cls.objects.filter(eve_type__eve_group=cls.__FUEL_BLOCK_GROUP_ID).aggregate(
-                Min("price")
-            )["price__min"]
-            or 0.0
-        )
+        return price_cache.get().fuel_block_price
 
     @classmethod
     def get_magmatic_gases_price(cls) -> float:
@@ -645,6 +958,215 @@ class EveTypePrice(models.Model):
         return cls.get_eve_type_id_price(cls.__MAGMATIC_TYPE_ID)
 
 
+class EveTypePriceHistory(models.Model):
+    """
+    Average price of an eve type on one side of the market over a period.
+    Every fetched price is stored as a raw sample, then rolled up in hourly and daily averages
+    kept for longer and longer periods
+    """
+
+    class Side(models.TextChoices):
+        """Side of the market, same values as the Fuzzwork API"""
+
+        BUY = "buy"
+        SELL = "sell"
+
+    class Resolution(models.IntegerChoices):
+        """Period averaged by a sample, in seconds"""
+
+        RAW = 0
+        HOURLY = 3600
+        DAILY = 86400
+
+    RETENTION_DAYS = {
+        Resolution.RAW: MARKETS_PRICE_HISTORY_RAW_RETENTION_DAYS,
+        Resolution.HOURLY: MARKETS_PRICE_HISTORY_HOURLY_RETENTION_DAYS,
+        Resolution.DAILY: MARKETS_PRICE_HISTORY_DAILY_RETENTION_DAYS,
+    }
+
+    eve_type = models.ForeignKey(EveType, on_delete=models.CASCADE, related_name="+")
+    side = models.CharField(max_length=4, choices=Side.choices)
+    resolution = models.PositiveIntegerField(choices=Resolution.choices)
+    timestamp = models.DateTimeField(help_text="When the price or its period started")
+    price = models.FloatField()
+    low = models.FloatField()
+    high = models.FloatField()
+    samples = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.eve_type_id} - {self.side} - {self.timestamp} - {self.price} ISK"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["eve_type", "side", "resolution", "timestamp"],
+                name="functional_pk_evetypepricehistory",
+            )
+        ]
+
+    @classmethod
+    def record_prices(
+        cls,
+        prices: Dict[int, float],
+        side: str,
+        now: Optional[datetime.datetime] = None,
+    ):
+        """Stores the fetched prices of one side of the market as raw samples"""
+        now = now or timezone.now()
+        cls.objects.bulk_create(
+            cls(
+                eve_type_id=type_id,
+                side=side,
+                resolution=cls.Resolution.RAW,
+                timestamp=now,
+                price=price,
+                low=price,
+                high=price,
+            )
+            for type_id, price in prices.items()
+            if price > 0
+        )
+
+    @classmethod
+    def downsample(
+        cls, resolution: int, now: Optional[datetime.datetime] = None
+    ) -> int:
+        """
+        Rolls up the samples of the finer resolution in averages of `resolution` seconds.
+        Only periods ended before now and after the last rolled up period are averaged.
+        Returns the number of averages created
+        """
+        source_resolution = (
+            cls.Resolution.RAW
+            if resolution == cls.Resolution.HOURLY
+            else cls.Resolution.HOURLY
+        )
+        now = now or timezone.now()
+        until = _floor_datetime(now, resolution)
+        samples = cls.objects.filter(resolution=source_resolution, timestamp__lt=until)
+        if last_period := cls.objects.filter(resolution=resolution).aggregate(
+            last_period=Max("timestamp")
+        )["last_period"]:
+            samples = samples.filter(
+                timestamp__gte=last_period + datetime.timedelta(seconds=resolution)
+            )
+
+        periods = _sum_periods(
+            samples.values_list(
+                "eve_type_id", "side", "timestamp", "price", "low", "high", "samples"
+            ),
+            resolution,
+        )
+        cls.objects.bulk_create(
+            cls(
+                eve_type_id=type_id,
+                side=side,
+                resolution=resolution,
+                timestamp=timestamp,
+                price=total / count,
+                low=low,
+                high=high,
+                samples=count,
+            )
+            for (type_id, side, timestamp), (total, low, high, count) in periods.items()
+        )
+        return len(periods)
+
+    @classmethod
+    def delete_expired(cls, now: Optional[datetime.datetime] = None) -> int:
+        """Deletes the samples older than the retention of their resolution"""
+        now = now or timezone.now()
+        expired = Q()
+        for resolution, retention_days in cls.RETENTION_DAYS.items():
+            expired |= Q(
+                resolution=resolution,
+                timestamp__lt=now - datetime.timedelta(days=retention_days),
+            )
+        deleted_count, _ = cls.objects.filter(expired).delete()
+        return deleted_count
+
+    @classmethod
+    def resolution_covering(
+        cls, start: datetime.datetime, now: Optional[datetime.datetime] = None
+    ) -> int:
+        """Returns the finest resolution still kept from start"""
+        now = now or timezone.now()
+        for resolution, retention_days in cls.RETENTION_DAYS.items():
+            if start >= now - datetime.timedelta(days=retention_days):
+                return resolution
+        return cls.Resolution.DAILY
+
+    @classmethod
+    def get_range(
+        cls,
+        eve_type_id: int,
+        side: str,
+        start: datetime.datetime,
+        end: Optional[datetime.datetime] = None,
+    ) -> List[Tuple[datetime.datetime, float]]:
+        """Returns the prices of a type from start to end at the finest resolution still kept"""
+        samples = cls.objects.filter(
+            eve_type_id=eve_type_id,
+            side=side,
+            resolution=cls.resolution_covering(start),
+            timestamp__gte=start,
+        )
+        if end:
+            samples = samples.filter(timestamp__lt=end)
+        return list(samples.order_by("timestamp").values_list("timestamp", "price"))
+
+    @classmethod
+    def get_moving_averages(
+        cls,
+        eve_type_ids: Iterable[int],
+        side: str,
+        hours: int,
+        now: Optional[datetime.datetime] = None,
+    ) -> Dict[int, float]:
+        """Returns the average price of the types over the last `hours` hours"""
+        now = now or timezone.now()
+        start = now - datetime.timedelta(hours=hours)
+        return {
+            type_id: total / count
+            for type_id, total, count in cls.objects.filter(
+                eve_type_id__in=eve_type_ids,
+                side=side,
+                resolution=cls.resolution_covering(start, now),
+                timestamp__gte=start,
+            )
+            .values("eve_type_id")
+            .annotate(total=Sum(F("price") * F("samples")), count=Sum("samples"))
+            .values_list("eve_type_id", "total", "count")
+            if count
+        }
+
+
+def _sum_periods(samples: Iterable[Tuple], resolution: int) -> Dict[Tuple, List]:
+    """
+    Sums the samples of each type, side and period of `resolution` seconds.
+    Returns the price total weighted by samples, lowest and highest prices and samples count of each period
+    """
+    periods = {}
+    for type_id, side, timestamp, price, low, high, count in samples:
+        key = (type_id, side, _floor_datetime(timestamp, resolution))
+        if key not in periods:
+            periods[key] = [0.0, low, high, 0]
+        period = periods[key]
+        period[0] += price * count
+        period[1] = min(period[1], low)
+        period[2] = max(period[2], high)
+        period[3] += count
+    return periods
+
+
+def _floor_datetime(value: datetime.datetime, seconds: int) -> datetime.datetime:
+    """Rounds down a datetime to a multiple of `seconds` since the epoch"""
+    timestamp = value.timestamp()
+    return datetime.datetime.fromtimestamp(
+        timestamp - timestamp % seconds, tz=datetime.timezone.utc
+    )
+
+
 class Webhook(models.Model):
     """Represents a discord webhook information"""
 
@@ -0,0 +1,160 @@
+"""Local spatial index of moon positions used to find which moon a structure is anchored on"""
+
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from math import inf, sqrt
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from eveuniverse.models import EveMoon
+
+from allianceauth.services.hooks import get_extension_logger
+
+from markets.app_settings import MARKETS_MOON_MAX_DISTANCE
+
+logger = get_extension_logger(__name__)
+
+Position = Tuple[float, float, float]
+
+
+class SolarSystemMoonIndex:
+    """
+    Moons of a solar system sorted by their x coordinate.
+    Nearest moon queries only look at moons whose x coordinate is closer than the best match found so far.
+    """
+
+    def __init__(self, moons: Iterable[Tuple[int, float, float, float]]):
+        self._moons = sorted(moons, key=lambda moon: moon[1])
+        self._xs = [moon[1] for moon in self._moons]
+
+    def __len__(self) -> int:
+        return len(self._moons)
+
+    def nearest(self, x: float, y: float, z: float) -> Optional[Tuple[int, float]]:
+        """Returns the id of the nearest moon and its distance or None if the index is empty"""
+
+        if not self._moons:
+            return None
+
+        best_moon_id, best_squared_distance = None, inf
+        right = bisect_left(self._xs, x)
+        left = right - 1
+
+        while right < len(self._moons) or left >= 0:
+            for index in (right, left):
+                if not 0 <= index < len(self._moons):
+                    continue
+                moon_id, moon_x, moon_y, moon_z = self._moons[index]
+                squared_distance = (
+                    (moon_x - x) ** 2 + (moon_y - y) ** 2 + (moon_z - z) ** 2
+                )
+                if squared_distance < best_squared_distance:
+                    best_moon_id, best_squared_distance = moon_id, squared_distance
+
+            if right < len(self._moons):
+                right = (
+                    right + 1
+                    if (self._xs[right] - x) ** 2 < best_squared_distance
+                    else len(self._moons)
+                )
+            if left >= 0:
+                left = (
+                    left - 1
+                    if (x - self._xs[left]) ** 2 < best_squared_distance
+                    else -1
+                )
+
+        return best_moon_id, sqrt(best_squared_distance)
+
+
+_indexes: Dict[int, SolarSystemMoonIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _load_indexes(solar_system_ids: Iterable[int]):
+    """
+    Builds the index of every solar system not loaded yet in a single query.
+    Moons without a known position can't be matched and are left out
+    """
+
+    with _indexes_lock:
+        missing_ids = set(solar_system_ids) - set(_indexes)
+    if not missing_ids:
+        return
+
+    moons_by_system = defaultdict(list)
+    for moon_id, solar_system_id, x, y, z in EveMoon.objects.filter(
+        eve_planet__eve_solar_system_id__in=missing_ids,
+        position_x__isnull=False,
+        position_y__isnull=False,
+        position_z__isnull=False,
+    ).values_list(
+        "id",
+        "eve_planet__eve_solar_system_id",
+        "position_x",
+        "position_y",
+        "position_z",
+    ):
+        moons_by_system[solar_system_id].append((moon_id, x, y, z))
+
+    with _indexes_lock:
+        for solar_system_id, moons in moons_by_system.items():
+            _indexes[solar_system_id] = SolarSystemMoonIndex(moons)
+
+
+def get_solar_system_index(solar_system_id: int) -> SolarSystemMoonIndex:
+    """
+    Returns the moon index of a solar system, building it on first use.
+    Solar systems without any known moon aren't kept to pick up moons loaded later.
+    """
+    _load_indexes([solar_system_id])
+    return _indexes.get(solar_system_id, SolarSystemMoonIndex([]))
+
+
+def clear_indexes(solar_system_id: Optional[int] = None):
+    """Drops the index of a solar system, or all of them, to have it rebuilt on next use"""
+    with _indexes_lock:
+        if solar_system_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(solar_system_id, None)
+
+
+def find_nearest_moon_id(
+    solar_system_id: int,
+    position: Position,
+    max_distance: float = MARKETS_MOON_MAX_DISTANCE,
+) -> Optional[int]:
+    """
+    Returns the id of the moon nearest to the position in the solar system.
+    None is returned if no known moon is closer than `max_distance` meters.
+    """
+    return find_nearest_moons_ids([(solar_system_id, position)], max_distance)[0]
+
+
+def find_nearest_moons_ids(
+    locations: List[Tuple[int, Position]],
+    max_distance: float = MARKETS_MOON_MAX_DISTANCE,
+) -> List[Optional[int]]:
+    """
+    Resolves the nearest moon of many (solar system id, position) locations at once.
+    Indexes of all the solar systems involved are loaded in a single query.
+    """
+
+    _load_indexes(solar_system_id for solar_system_id, _ in locations)
+
+    moons_ids = []
+    for solar_system_id, position in locations:
+        index = _indexes.get(solar_system_id)
+        nearest = index.nearest(*position) if index else None
+        if nearest is None or nearest[1] > max_distance:
+            logger.debug(
+                "No known moon close to %s in solar system id %s",
+                position,
+                solar_system_id,
+            )
+            moons_ids.append(None)
+        else:
+            moons_ids.append(nearest[0])
+
+    return moons_ids
@@ -0,0 +1,129 @@
+"""Chooses which owner of a holding corporation makes the next ESI call"""
+
+from typing import Dict, List, Optional
+
+from django.core.cache import BaseCache, cache
+
+from allianceauth.services.hooks import get_extension_logger
+
+from markets.app_settings import MARKETS_OWNER_MAX_FAILURES
+from markets.models import HoldingCorporation, Owner
+
+logger = get_extension_logger(__name__)
+
+
+class OwnerScheduler:
+    """
+    Spreads ESI calls between the owners of a holding corporation.
+    Healthy owners take turns, owners much slower than the fastest one come after them
+    and owners whose last calls failed are only tried last, fewest failures first.
+
+    The health of every owner is kept in a Django cache to be shared between workers.
+    Updates aren't atomic, the statistics are only used to order owners.
+    """
+
+    HEALTH_KEY = "markets-owner-health-{}"
+    ROTATION_KEY = "markets-owner-rotation-{}"
+    HEALTH_TIMEOUT = 86_400
+    LATENCY_WEIGHT = 0.3
+    SLOW_FACTOR = 3
+
+    def __init__(
+        self,
+        cache_backend: Optional[BaseCache] = None,
+        max_failures: int = MARKETS_OWNER_MAX_FAILURES,
+    ):
+        self._cache = cache_backend
+        self.max_failures = max_failures
+
+    @property
+    def cache(self) -> BaseCache:
+        """Cache holding the owners health"""
+        return self._cache if self._cache is not None else cache
+
+    def health(self, owner: Owner) -> Dict:
+        """Returns the average latency in seconds and the consecutive failures of the owner"""
+        return self.cache.get(self.HEALTH_KEY.format(owner.pk)) or {
+            "latency": None,
+            "failures": 0,
+        }
+
+    def order(
+        self, holding_corporation: HoldingCorporation, owners: List[Owner]
+    ) -> List[Owner]:
+        """Returns the owners in the order they should be tried for the next call"""
+
+        if len(owners) <= 1:
+            return list(owners)
+
+        stored_healths = self.cache.get_many(
+            [self.HEALTH_KEY.format(owner.pk) for owner in owners]
+        )
+        healths = {
+            owner.pk: stored_healths.get(
+                self.HEALTH_KEY.format(owner.pk), {"latency": None, "failures": 0}
+            )
+            for owner in owners
+        }
+
+        healthy_owners = [
+            owner for owner in owners if not healths[owner.pk]["failures"]
+        ]
+        failing_owners = sorted(
+            (owner for owner in owners if healths[owner.pk]["failures"]),
+            key=lambda owner: (
+                healths[owner.pk]["failures"],
+                healths[owner.pk]["latency"] or 0,
+            ),
+        )
+
+        if healthy_owners:
+            rotation_key = self.ROTATION_KEY.format(holding_corporation.pk)
+            self.cache.add(rotation_key, 0, timeout=None)
+            try:
+                turn = self.cache.incr(rotation_key)
+            except ValueError:
+                turn = 0
+            offset = turn % len(healthy_owners)
+            healthy_owners = healthy_owners[offset:] + healthy_owners[:offset]
+
+            latencies = [
+                healths[owner.pk]["latency"]
+                for owner in healthy_owners
+                if healths[owner.pk]["latency"] is not None
+            ]
+            if latencies:
+                slow_latency = min(latencies) * self.SLOW_FACTOR
+                healthy_owners.sort(
+                    key=lambda owner: (healths[owner.pk]["latency"] or 0) > slow_latency
+                )
+
+        return healthy_owners + failing_owners
+
+    def record_success(self, owner: Owner, latency: float):
+        """Resets the failures of the owner and updates its average latency"""
+        health = self.health(owner)
+        if health["latency"] is not None:
+            latency = (
+                self.LATENCY_WEIGHT * latency
+                + (1 - self.LATENCY_WEIGHT) * health["latency"]
+            )
+        self.cache.set(
+            self.HEALTH_KEY.format(owner.pk),
+            {"latency": latency, "failures": 0},
+            self.HEALTH_TIMEOUT,
+        )
+
+    def record_failure(self, owner: Owner) -> int:
+        """Counts a failed call of the owner and returns its number of consecutive failures"""
+        health = self.health(owner)
+        health["failures"] += 1
+        self.cache.set(self.HEALTH_KEY.format(owner.pk), health, self.HEALTH_TIMEOUT)
+        return health["failures"]
+
+    def should_disable(self, failures: int) -> bool:
+        """True if an owner failed enough times in a row to be disabled"""
+        return failures >= self.max_failures
+
+
+owner_scheduler = OwnerScheduler()
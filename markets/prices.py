@@ -0,0 +1,143 @@
+"""Prices of the types handled by markets, kept in memory by each process"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from django.apps import apps
+from django.core.cache import BaseCache, cache
+
+from allianceauth.services.hooks import get_extension_logger
+
+from markets.app_settings import MARKETS_PRICE_CACHE_TTL, MARKETS_PRICE_CHANGE_EPSILON
+from markets.type_catalog import get_type_catalog
+
+logger = get_extension_logger(__name__)
+
+VERSION_CACHE_KEY = "markets-prices-version"
+VERSION_CHECK_INTERVAL = 5
+
+
+def has_price_moved(
+    stored_price: float,
+    new_price: float,
+    epsilon: float = MARKETS_PRICE_CHANGE_EPSILON,
+) -> bool:
+    """True if the new price differs from the stored one by more than `epsilon` of the stored price"""
+    if stored_price <= 0:
+        return new_price > 0
+    return abs(new_price - stored_price) > epsilon * stored_price
+
+
+@dataclass(frozen=True)
+class PriceSnapshot:
+    """Prices of every type by type id, with the version they were loaded at"""
+
+    prices: Dict[int, float] = field(default_factory=dict)
+    version: Optional[float] = None
+    loaded_at: float = 0.0
+
+    def price(self, type_id: int) -> float:
+        """Returns the price of a type, 0 if it has no price yet"""
+        return self.prices.get(type_id, 0.0)
+
+    @property
+    def fuel_block_price(self) -> float:
+        """Returns the price of the cheapest fuel block, 0 if no fuel block has a price yet"""
+        return min(
+            (
+                self.prices[type_id]
+                for type_id in get_type_catalog().fuel_block_type_ids
+                if type_id in self.prices
+            ),
+            default=0.0,
+        )
+
+    @classmethod
+    def load(cls, version: Optional[float] = None) -> "PriceSnapshot":
+        """Loads the prices in a single query"""
+        eve_type_price_model = apps.get_model("markets", "EveTypePrice")
+        return cls(
+            dict(eve_type_price_model.objects.values_list("eve_type_id", "price")),
+            version,
+            time.monotonic(),
+        )
+
+
+class PriceCache:
+    """
+    Snapshot of the prices of this process served with stale-while-revalidate semantics.
+
+    A snapshot is stale once older than `ttl` seconds or when the shared version changed.
+    The first reader of a stale snapshot reloads it while the readers in other threads
+    keep getting the stale one instead of waiting.
+    The shared version is checked every VERSION_CHECK_INTERVAL seconds to pick up the new prices
+    written by other processes.
+    """
+
+    def __init__(
+        self,
+        cache_backend: Optional[BaseCache] = None,
+        ttl: int = MARKETS_PRICE_CACHE_TTL,
+    ):
+        self._cache = cache_backend
+        self.ttl = ttl
+        self._snapshot: Optional[PriceSnapshot] = None
+        self._version_checked_at = 0.0
+        self._reload_lock = threading.Lock()
+
+    @property
+    def cache(self) -> BaseCache:
+        """Cache holding the shared version"""
+        return self._cache if self._cache is not None else cache
+
+    def _is_stale(self, snapshot: PriceSnapshot) -> bool:
+        now = time.monotonic()
+        if now - snapshot.loaded_at >= self.ttl:
+            return True
+        if now - self._version_checked_at >= VERSION_CHECK_INTERVAL:
+            if self.cache.get(VERSION_CACHE_KEY) != snapshot.version:
+                return True
+            self._version_checked_at = now
+        return False
+
+    def _reload(self) -> PriceSnapshot:
+        snapshot = PriceSnapshot.load(self.cache.get(VERSION_CACHE_KEY))
+        self._snapshot, self._version_checked_at = snapshot, snapshot.loaded_at
+        logger.debug("Loaded %s prices", len(snapshot.prices))
+        return snapshot
+
+    def get(self) -> PriceSnapshot:
+        """Returns the price snapshot, loading it on first use"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._reload_lock:
+                return self._snapshot or self._reload()
+
+        if not self._is_stale(snapshot):
+            return snapshot
+
+        if not self._reload_lock.acquire(  # pylint: disable = consider-using-with
+            blocking=False
+        ):
+            return snapshot
+        try:
+            return self._reload()
+        finally:
+            self._reload_lock.release()
+
+    def price(self, type_id: int) -> float:
+        """Returns the price of a type, 0 if it has no price yet"""
+        return self.get().price(type_id)
+
+    def invalidate(self):
+        """
+        Bumps the shared version to have every process reload its prices.
+        This process drops its snapshot to read the new prices right away
+        """
+        self.cache.set(VERSION_CACHE_KEY, time.time(), timeout=None)
+        self._snapshot = None
+
+
+price_cache = PriceCache()
@@ -0,0 +1,106 @@
+"""Tracks the markets subtasks of a holding refresh until the last one completes"""
+
+import uuid
+from typing import NamedTuple, Optional
+
+from django.core.cache import BaseCache, cache
+
+from allianceauth.services.hooks import get_extension_logger
+
+from markets.app_settings import MARKETS_SNAPSHOT_TIMEOUT
+
+logger = get_extension_logger(__name__)
+
+
+class RefreshSummary(NamedTuple):
+    """Outcome of the markets subtasks of a holding refresh"""
+
+    holding_corp_id: int
+    started_at: float
+    succeeded: int
+    failed: int
+
+
+class RefreshTracker:
+    """
+    Counts down the subtasks of holding refreshes in a Django cache.
+    Each subtask reports how many structures it succeeded or failed to write
+    and the last one to report gets the summary of the refresh, like the body of a chord.
+    Doesn't need a Celery result backend.
+
+    Counters are kept until `timeout` seconds after the refresh started
+    so a refresh whose subtask got lost doesn't leave them behind.
+    """
+
+    KEY = "markets-holding-refresh-{}"
+
+    def __init__(
+        self,
+        cache_backend: Optional[BaseCache] = None,
+        timeout: int = MARKETS_SNAPSHOT_TIMEOUT,
+    ):
+        self._cache = cache_backend
+        self.timeout = timeout
+
+    @property
+    def cache(self) -> BaseCache:
+        """Cache holding the counters"""
+        return self._cache if self._cache is not None else cache
+
+    def start(self, holding_corp_id: int, started_at: float, subtasks: int) -> str:
+        """Starts tracking a refresh of `subtasks` subtasks and returns its id"""
+        refresh_id = uuid.uuid4().hex
+        key = self.KEY.format(refresh_id)
+        self.cache.set_many(
+            {
+                f"{key}-info": (holding_corp_id, started_at),
+                f"{key}-pending": subtasks,
+                f"{key}-succeeded": 0,
+                f"{key}-failed": 0,
+            },
+            self.timeout,
+        )
+        return refresh_id
+
+    def report(
+        self, refresh_id: str, succeeded: int = 0, failed: int = 0
+    ) -> Optional[RefreshSummary]:
+        """
+        Adds the outcome of a subtask to its refresh.
+        Returns the summary of the refresh if it was the last subtask, None otherwise
+        """
+        key = self.KEY.format(refresh_id)
+        try:
+            if succeeded:
+                self.cache.incr(f"{key}-succeeded", succeeded)
+            if failed:
+                self.cache.incr(f"{key}-failed", failed)
+            pending = self.cache.decr(f"{key}-pending")
+        except ValueError:
+            logger.warning(
+                "Refresh %s expired before its subtasks completed", refresh_id
+            )
+            return None
+
+        if pending > 0:
+            return None
+
+        values = self.cache.get_many(
+            [f"{key}-info", f"{key}-succeeded", f"{key}-failed"]
+        )
+        self.cache.delete_many(
+            [f"{key}-info", f"{key}-pending", f"{key}-succeeded", f"{key}-failed"]
+        )
+        if f"{key}-info" not in values:
+            return None
+
+        holding_corp_id, started_at = values[f"{key}-info"]
+        return RefreshSummary(
+            holding_corp_id,
+            started_at,
+            values.get(f"{key}-succeeded", 0),
+            values.get(f"{key}-failed", 0),
+        )
+
+
+refresh_tracker = RefreshTracker()
@@ -0,0 +1,107 @@
+"""
+Claim-check storage of the ESI data fetched for a holding corporation.
+The data is stored once in the cache and tasks only receive its key instead of the data itself.
+"""
+
+import datetime as dt
+import hashlib
+import json
+import zlib
+from typing import Dict, NamedTuple
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from allianceauth.services.hooks import get_extension_logger
+
+from markets.app_settings import MARKETS_SNAPSHOT_TIMEOUT
+from markets.esi import HoldingMarketsData
+
+logger = get_extension_logger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_KEY = "markets-holding-snapshot-v{format_version}-{corporation_id}-{digest}"
+
+
+class SnapshotMissingError(Exception):
+    """Signifies that a snapshot expired or was evicted from the cache"""
+
+    def __init__(self, key: str):
+        super().__init__(f"Snapshot {key} is missing")
+        self.key = key
+
+
+class HoldingSnapshot(NamedTuple):
+    """ESI data of a holding corporation loaded back from a snapshot"""
+
+    corporation_id: int
+    markets_data: HoldingMarketsData
+
+
+class _SnapshotEncoder(DjangoJSONEncoder):
+    """Keeps the microseconds of the datetimes, DjangoJSONEncoder rounds them to milliseconds"""
+
+    def default(self, o):
+        if isinstance(o, dt.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _int_keys(dic: Dict) -> Dict:
+    """JSON turns the markets ids into strings"""
+    return {int(key): value for key, value in dic.items()}
+
+
+def store_holding_snapshot(
+    corporation_id: int, markets_data: HoldingMarketsData
+) -> str:
+    """
+    Stores the ESI data of a holding corporation as compressed JSON and returns its key.
+    The key is built from the content so storing the same data again reuses the same key
+    """
+    payload = zlib.compress(
+        json.dumps(
+            {
+                "corporation_id": corporation_id,
+                "markets_info": markets_data.markets_info,
+                "markets_assets": markets_data.markets_assets,
+                "locations": markets_data.locations,
+                "is_modified": markets_data.is_modified,
+                "assets_fetched": markets_data.assets_fetched,
+            },
+            cls=_SnapshotEncoder,
+            sort_keys=True,
+            separators=(",", ":"),
+        ).encode("utf-8")
+    )
+    key = SNAPSHOT_KEY.format(
+        format_version=SNAPSHOT_FORMAT_VERSION,
+        corporation_id=corporation_id,
+        digest=hashlib.sha256(payload).hexdigest()[:16],
+    )
+    cache.set(key, payload, timeout=MARKETS_SNAPSHOT_TIMEOUT)
+    logger.debug("Stored snapshot %s of %s bytes", key, len(payload))
+
+    return key
+
+
+def load_holding_snapshot(key: str) -> HoldingSnapshot:
+    """
+    Loads the ESI data of a holding corporation stored under the key.
+    Raises SnapshotMissingError if it's not in the cache anymore
+    """
+    payload = cache.get(key)
+    if payload is None:
+        raise SnapshotMissingError(key)
+
+    data = json.loads(zlib.decompress(payload).decode("utf-8"))
+    return HoldingSnapshot(
+        data["corporation_id"],
+        HoldingMarketsData(
+            _int_keys(data["markets_info"]),
+            _int_keys(data["markets_assets"]),
+            _int_keys(data["locations"]),
+            is_modified=data["is_modified"],
+            assets_fetched=data["assets_fetched"],
+        ),
+    )
@@ -1,34 +1,62 @@
 """Tasks."""
 
-from typing import List, Optional
+import datetime as dt
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
 
 from celery import shared_task
+from celery.exceptions import Retry
 from moonmining.constants import EveTypeId
 from moonmining.models.moons import Moon as MoonminingMoon
 
+from django.utils import timezone
 from eveuniverse.constants import EveGroupId
 from eveuniverse.models import EveSolarSystem
 
 from allianceauth.analytics.tasks import analytics_event
 from allianceauth.services.hooks import get_extension_logger
 
-from markets.api.fuzzwork import BuySell, get_type_ids_prices
+from markets.api.fuzzwork import BuySell, get_type_ids_aggregates, select_prices
+from markets.app_settings import (
+    MARKETS_PRICE_MOVING_AVERAGE_HOURS,
+    MARKETS_STRUCTURE_LOCATION_RETENTION_DAYS,
+)
 from markets.esi import (
     DownTimeError,
-    get_corporation_markets_assets,
-    get_markets_from_esi,
+    HoldingMarketsData,
+    get_holding_markets_data,
+    get_holdings_markets_data,
     get_structure_info_from_esi,
+    structure_digest,
 )
+from markets.esi_guard import EsiBudgetExhaustedError
+from markets.holding_lock import holding_lock
+from markets.holding_scheduler import holding_scheduler
 from markets.models import (
     EveTypePrice,
+    EveTypePriceHistory,
     HoldingCorporation,
     Markets,
     MarketsHourlyProducts,
     MarketsStoredMoonMaterials,
     MarketsTag,
     Moon,
+    StructureLocation,
+    parse_esi_datetime,
 )
+from markets.moon_index import clear_indexes, find_nearest_moon_id
 from markets.moons import get_markets_hourly_harvest
+from markets.prices import has_price_moved, price_cache
+from markets.refresh_tracker import refresh_tracker
+from markets.snapshots import (
+    SnapshotMissingError,
+    load_holding_snapshot,
+    store_holding_snapshot,
+)
+from markets.token_pool import token_pool
+from markets.type_catalog import get_type_catalog
+from markets.valuation import find_moons_harvesting, revalue_moons
 
 logger = get_extension_logger(__name__)
 
@@ -41,21 +69,140 @@ class TaskError(Exception):
 def update_all_holdings():
     """
     Update all active owners on the application
+    The ESI data of the holdings is fetched concurrently before being handed to the database update
+    Access tokens are resolved once for the whole cycle
     """
-    holding_corps = HoldingCorporation.objects.filter(is_active=True)
-    logger.info("Starting update for %s owner(s)", {len(holding_corps)})
-    for holding in holding_corps:
-        update_holding.delay(holding.corporation.corporation_id)
+    holding_corps = []
+    leases = {}
+    for holding_corp in (
+        HoldingCorporation.objects.filter(is_active=True, owners__is_enabled=True)
+        .select_related("corporation")
+        .distinct()
+    ):
+        corporation_id = holding_corp.corporation.corporation_id
+        if (token := holding_lock.acquire(corporation_id)) is None:
+            logger.info(
+                "Corporation id %s is already being updated. Skipping", corporation_id
+            )
+            continue
+        leases[corporation_id] = token
+        holding_corps.append(holding_corp)
+    logger.info("Starting update for %s owner(s)", len(holding_corps))
+
+    try:
+        update_holdings(holding_corps)
+    finally:
+        for corporation_id, token in leases.items():
+            holding_lock.release(corporation_id, token)
+
+    delete_disappeared_structure_locations()
+
+
+def delete_disappeared_structure_locations():
+    """
+    Deletes the structure locations that disappeared for longer than MARKETS_STRUCTURE_LOCATION_RETENTION_DAYS
+    Called by both update_all_holdings and schedule_holdings_updates to run with either beat schedule
+    """
+    if deleted_locations := StructureLocation.delete_disappeared(
+        dt.timedelta(days=MARKETS_STRUCTURE_LOCATION_RETENTION_DAYS)
+    ):
+        logger.info("Deleted %s disappeared structure locations", deleted_locations)
+
+
+def update_holdings(holding_corps: List[HoldingCorporation]):
+    """Fetches the ESI data of the holdings concurrently and updates their markets"""
+    started_at = time.time()
+
+    known_markets_ids = defaultdict(set)
+    for corporation_pk, structure_id in Markets.objects.filter(
+        corporation__in=holding_corps
+    ).values_list("corporation_id", "structure_id"):
+        known_markets_ids[corporation_pk].add(structure_id)
+
+    with token_pool():
+        for holding_corp, markets_data in get_holdings_markets_data(
+            holding_corps, known_markets_ids
+        ):
+            if isinstance(markets_data, DownTimeError):
+                logger.warning(
+                    "Currently at downtime. Deferring corporation id %s by %s seconds",
+                    holding_corp.corporation.corporation_id,
+                    markets_data.retry_after,
+                )
+                defer_holding_update(
+                    holding_corp.corporation.corporation_id, markets_data.retry_after
+                )
+                continue
+            if isinstance(markets_data, EsiBudgetExhaustedError):
+                logger.warning(
+                    "ESI error budget exhausted. Deferring corporation id %s by %s seconds",
+                    holding_corp.corporation.corporation_id,
+                    markets_data.retry_after,
+                )
+                defer_holding_update(
+                    holding_corp.corporation.corporation_id, markets_data.retry_after
+                )
+                continue
+            if isinstance(markets_data, Exception):
+                logger.error(
+                    "Failed to fetch the ESI data of corporation id %s: %s",
+                    holding_corp.corporation.corporation_id,
+                    markets_data,
+                )
+                continue
+            update_holding_markets(holding_corp, markets_data, started_at)
 
 
 @shared_task
-def update_holding(holding_corp_id: int):
+def schedule_holdings_updates():
+    """
+    Queues the updates of the holdings planned for the next MARKETS_HOLDING_SCHEDULER_TICK minutes
+    Run by the beat schedule every tick, the updates are spread over the refresh interval
+    instead of all starting at once like with update_all_holdings
+    """
+    holding_corps = list(
+        HoldingCorporation.objects.filter(is_active=True, owners__is_enabled=True)
+        .select_related("corporation")
+        .distinct()
+    )
+
+    planned_updates = holding_scheduler.plan(holding_corps)
+    logger.info(
+        "Planned %s updates out of %s holdings",
+        len(planned_updates),
+        len(holding_corps),
+    )
+    for holding_corp_id, countdown in planned_updates:
+        enqueue_holding_update(holding_corp_id, countdown)
+
+    delete_disappeared_structure_locations()
+
+
+@shared_task(bind=True)
+def update_holding(self, holding_corp_id: int):
     """
     Updated the list of markets under a specific owner
     If harvest is set to True the harvest components are also recalculated
+    The task is retried once the ESI error limit resets if the error budget is exhausted
+    and right after the daily downtime if it runs during it
     """
 
+    holding_lock.clear_pending(holding_corp_id)
+    if (token := holding_lock.acquire(holding_corp_id)) is None:
+        logger.info(
+            "Corporation id %s is already being updated. Skipping", holding_corp_id
+        )
+        return
+
+    try:
+        _update_holding(self, holding_corp_id)
+    finally:
+        holding_lock.release(holding_corp_id, token)
+
+
+def _update_holding(task, holding_corp_id: int):
     logger.info("Updating corporation id %s", holding_corp_id)
+    started_at = time.time()
 
     holding_corp = HoldingCorporation.objects.get(
         corporation__corporation_id=holding_corp_id
@@ -65,63 +212,206 @@ def update_holding(holding_corp_id: int):
         logger.info("No active owners for corporation id %s. Skipping", holding_corp_id)
         return
 
+    current_markets_ids = set(
+        Markets.objects.filter(corporation=holding_corp).values_list(
+            "structure_id", flat=True
+        )
+    )
+
     try:
-        markets_info = get_markets_from_esi(holding_corp)
-    except DownTimeError:
-        logger.warning("Currently at downtime. Exiting update")
-        return
+        with token_pool():
+            markets_data = get_holding_markets_data(holding_corp, current_markets_ids)
+    except DownTimeError as exc:
+        logger.warning(
+            "Currently at downtime. Retrying corporation id %s in %s seconds",
+            holding_corp_id,
+            exc.retry_after,
+        )
+        holding_lock.mark_pending(holding_corp_id, exc.retry_after)
+        raise task.retry(exc=exc, countdown=exc.retry_after, max_retries=None)
+    except EsiBudgetExhaustedError as exc:
+        logger.warning(
+            "ESI error budget exhausted. Retrying corporation id %s in %s seconds",
+            holding_corp_id,
+            exc.retry_after,
+        )
+        holding_lock.mark_pending(holding_corp_id, exc.retry_after)
+        raise task.retry(exc=exc, countdown=exc.retry_after, max_retries=None)
 
-    markets_info_dic = {
-        markets["structure_id"]: markets for markets in markets_info
-    }
+    update_holding_markets(holding_corp, markets_data, started_at)
 
-    markets_ids = set(markets["structure_id"] for markets in markets_info)
 
-    try:
-        markets_asset_dic = get_corporation_markets_assets(
-            holding_corp, markets_ids
+def enqueue_holding_update(holding_corp_id: int, countdown: int = 0) -> bool:
+    """
+    Queues an update of the holding in countdown seconds unless one is already running or pending
+    Returns True if the update was queued
+    """
+    if holding_lock.is_running(holding_corp_id) or not holding_lock.mark_pending(
+        holding_corp_id, countdown
+    ):
+        logger.info(
+            "Update of corporation id %s already running or pending. Skipping",
+            holding_corp_id,
         )
-    except DownTimeError:
-        logger.warning("Currently at downtime. Exiting update")
-        return
+        return False
 
-    current_markets_ids = set(
-        markets.structure_id
-        for markets in Markets.objects.filter(corporation=holding_corp)
-    )
+    if countdown:
+        update_holding.apply_async(args=[holding_corp_id], countdown=countdown)
+    else:
+        update_holding.delay(holding_corp_id)
+    return True
+
+
+def defer_holding_update(holding_corp_id: int, countdown: int):
+    """Queues an update of the holding in countdown seconds unless one is already pending"""
+    if holding_lock.mark_pending(holding_corp_id, countdown):
+        update_holding.apply_async(args=[holding_corp_id], countdown=countdown)
+
+
+def update_holding_markets(
+    holding_corp: HoldingCorporation,
+    markets_data: HoldingMarketsData,
+    started_at: Optional[float] = None,
+):
+    """
+    Updates the database with the fetched ESI data of a holding corporation.
+    Removed markets are deleted, new ones are created and the others are updated
+    unless the ESI reported that nothing changed since the last update.
+    Only the markets whose ESI data differs from their last update are updated.
+    Only the structures info of the markets is updated if the assets weren't fetched
+    The update is recorded on the holding once all its markets subtasks completed,
+    started_at is the timestamp of the ESI fetch
+    """
+    if started_at is None:
+        started_at = time.time()
+
+    markets_info_dic = markets_data.markets_info
+    markets_ids = set(markets_info_dic)
+
+    current_markets = {
+        structure_id: (structure_name, fuel_expires, esi_digest)
+        for structure_id, structure_name, fuel_expires, esi_digest in (
+            Markets.objects.filter(corporation=holding_corp).values_list(
+                "structure_id", "structure_name", "fuel_expires", "esi_digest"
+            )
+        )
+    }
+    current_markets_ids = set(current_markets)
 
     disappeared_markets_ids = (
         current_markets_ids - markets_ids
     )  # markets that have been unanchored/destroyed/transferred
     Markets.objects.filter(structure_id__in=disappeared_markets_ids).delete()
+    StructureLocation.mark_disappeared(disappeared_markets_ids)
 
     missing_markets_ids = markets_ids - current_markets_ids
-    for markets_id in missing_markets_ids:
-        location_info = get_structure_info_from_esi(holding_corp, markets_id)
-        create_markets.delay(
-            holding_corp.corporation.corporation_id,
-            markets_info_dic[markets_id],
-            location_info,
+    if missing_markets_ids:
+        holding_corp.assets_updated_at = None  # new markets need their assets
+    elif markets_data.assets_fetched:
+        holding_corp.assets_updated_at = timezone.now()
+    holding_corp.esi_expires = markets_data.expires
+    holding_corp.save(update_fields=["assets_updated_at", "esi_expires"])
+
+    # Compared even when the ESI data didn't change since the last fetch:
+    # markets whose last update failed still differ from the cached payload
+    markets_to_updates = {
+        markets_id
+        for markets_id in current_markets_ids - disappeared_markets_ids
+        if has_markets_data_changed(
+            current_markets[markets_id], markets_id, markets_data
         )
+    }
+    logger.info(
+        "%s markets of corporation id %s changed out of %s. ESI data modified: %s",
+        len(markets_to_updates),
+        holding_corp.corporation.corporation_id,
+        len(current_markets_ids - disappeared_markets_ids),
+        markets_data.is_modified,
+    )
+
+    if not missing_markets_ids and not markets_to_updates:
+        holding_corp.record_update(started_at)
+        return
 
-    markets_to_updates = (
-        current_markets_ids - disappeared_markets_ids - missing_markets_ids
+    snapshot_key = store_holding_snapshot(
+        holding_corp.corporation.corporation_id, markets_data
     )
-    for markets_id in markets_to_updates:
-        update_markets.delay(
-            markets_id, markets_info_dic[markets_id], markets_asset_dic[markets_id]
+    refresh_id = refresh_tracker.start(
+        holding_corp.corporation.corporation_id,
+        started_at,
+        len(missing_markets_ids) + (1 if markets_to_updates else 0),
+    )
+    for markets_id in missing_markets_ids:
+        create_markets.delay(snapshot_key, markets_id, refresh_id)
+    if markets_to_updates:
+        update_markets_bulk.delay(snapshot_key, sorted(markets_to_updates), refresh_id)
+
+
+def has_markets_data_changed(
+    stored_values: Tuple[str, Optional[dt.datetime], str],
+    markets_id: int,
+    markets_data: HoldingMarketsData,
+) -> bool:
+    """
+    Tells if the fetched ESI data of a markets differs from what was stored by its last update.
+    The stored digest is compared when the assets were fetched,
+    otherwise only the structure name and fuel expiry can have changed
+    """
+    structure_name, fuel_expires, esi_digest = stored_values
+    structure_info = markets_data.markets_info[markets_id]
+
+    if markets_data.assets_fetched:
+        return esi_digest != structure_digest(
+            structure_info, markets_data.markets_assets.get(markets_id, [])
         )
 
-    holding_corp.set_update_time_now()
+    return structure_name != structure_info["name"] or fuel_expires != (
+        parse_esi_datetime(structure_info.get("fuel_expires"))
+    )
 
 
-@shared_task
+@shared_task(bind=True)
 def create_markets(
-    holding_corporation_id: int, structure_info: dict, location_info: dict
+    self, snapshot_key: str, markets_id: int, refresh_id: Optional[str] = None
 ):
     """
-    Creates and adds the Markets in the database
+    Creates and adds the Markets in the database from the holding snapshot stored under snapshot_key
+    The stored structure location is used when known, otherwise it's fetched from the ESI
+    unless it's part of the snapshot
+    The task is retried once the ESI error limit resets if the error budget is exhausted
+    Its outcome is reported to the holding refresh refresh_id
     """
+    try:
+        created = _create_markets(self, snapshot_key, markets_id)
+    except Retry:
+        raise
+    except Exception:
+        report_markets_subtask(refresh_id, failed=1)
+        raise
+
+    if created:
+        report_markets_subtask(refresh_id, succeeded=1)
+    else:
+        report_markets_subtask(refresh_id, failed=1)
+
+
+def _create_markets(task, snapshot_key: str, markets_id: int) -> bool:
+    try:
+        holding_corporation_id, markets_data = load_holding_snapshot(snapshot_key)
+    except SnapshotMissingError:
+        logger.warning(
+            "Snapshot %s expired. Markets id %s will be created by the next holding update",
+            snapshot_key,
+            markets_id,
+        )
+        return False
+
+    if Markets.objects.filter(structure_id=markets_id).exists():
+        logger.info("Markets id %s was already created. Skipping", markets_id)
+        return True
+
+    structure_info = markets_data.markets_info[markets_id]
+    location_info = markets_data.locations.get(markets_id)
     holding_corporation = HoldingCorporation.objects.get(
         corporation__corporation_id=holding_corporation_id
     )
@@ -130,37 +420,32 @@ def create_markets(
         structure_info["structure_id"],
         holding_corporation,
     )
-    solar_system, _ = EveSolarSystem.objects.get_or_create_esi(
-        id=location_info["solar_system_id"]
-    )
-    try:
-        nearest_celestial = solar_system.nearest_celestial(
-            x=location_info["position"]["x"],
-            y=location_info["position"]["y"],
-            z=location_info["position"]["z"],
-            group_id=EveGroupId.MOON,
-        )
-    except OSError as exc:
-        logger.exception("%s: Failed to fetch nearest celestial", structure_info)
-        raise exc
-
-    if not nearest_celestial or nearest_celestial.eve_type.id != EveTypeId.MOON:
-        logger.exception(
-            "Couldn't find the moon corresponding to markets %s", structure_info
-        )
-        raise TaskError(
-            f"Couldn't fetch the markets moon. Markets id {structure_info['structure_id']}."
-            f"Structure position {location_info['position']}"
-        )
 
-    eve_moon = nearest_celestial.eve_object
-    moon, _ = Moon.objects.get_or_create(eve_moon=eve_moon)
+    structure_location = StructureLocation.objects.filter(
+        structure_id=structure_info["structure_id"], eve_moon__isnull=False
+    ).first()
+
+    if structure_location is None:
+        if location_info is None:
+            try:
+                location_info = get_structure_info_from_esi(
+                    holding_corporation, structure_info["structure_id"]
+                )
+            except (EsiBudgetExhaustedError, DownTimeError) as exc:
+                raise task.retry(exc=exc, countdown=exc.retry_after, max_retries=None)
+        structure_location = create_structure_location(structure_info, location_info)
+    elif structure_location.disappeared_at:
+        structure_location.disappeared_at = None
+        structure_location.save(update_fields=["disappeared_at"])
+
+    moon, _ = Moon.objects.get_or_create(eve_moon_id=structure_location.eve_moon_id)
 
     markets = Markets(
         moon=moon,
         structure_name=structure_info["name"],
         structure_id=structure_info["structure_id"],
         corporation=holding_corporation,
+        fuel_expires=parse_esi_datetime(structure_info.get("fuel_expires")),
     )
     markets.save()
 
@@ -168,48 +453,239 @@ def create_markets(
 
     markets.tags.add(*default_tags)
 
+    return True
 
-@shared_task()
-def update_markets(
-    markets_structure_id: int,
-    structure_info: dict,
-    markets_assets: Optional[List[dict]] = None,
-):
+
+def create_structure_location(
+    structure_info: dict, location_info: dict
+) -> StructureLocation:
     """
-    Updates a markets already existing in the database. Already receives the fetched ESI information of the structure
+    Finds the moon a structure is anchored on and stores the structure location
+    The moon is looked up in the local moon index first and through eveuniverse if no known moon is close enough
     """
+    solar_system, _ = EveSolarSystem.objects.get_or_create_esi(
+        id=location_info["solar_system_id"]
+    )
+    position = (
+        location_info["position"]["x"],
+        location_info["position"]["y"],
+        location_info["position"]["z"],
+    )
+
+    eve_moon_id = find_nearest_moon_id(solar_system.id, position)
+
+    if eve_moon_id is None:
+        try:
+            nearest_celestial = solar_system.nearest_celestial(
+                x=position[0],
+                y=position[1],
+                z=position[2],
+                group_id=EveGroupId.MOON,
+            )
+        except OSError as exc:
+            logger.exception("%s: Failed to fetch nearest celestial", structure_info)
+            raise exc
+
+        if not nearest_celestial or nearest_celestial.eve_type.id != EveTypeId.MOON:
+            logger.exception(
+                "Couldn't find the moon corresponding to markets %s", structure_info
+            )
+            raise TaskError(
+                f"Couldn't fetch the markets moon. Markets id {structure_info['structure_id']}."
+                f"Structure position {location_info['position']}"
+            )
+
+        eve_moon_id = nearest_celestial.eve_object.id
+        clear_indexes(solar_system.id)  # the moon might have just been created
+
+    structure_location, _ = StructureLocation.objects.update_or_create(
+        structure_id=structure_info["structure_id"],
+        defaults={
+            "solar_system": solar_system,
+            "position_x": position[0],
+            "position_y": position[1],
+            "position_z": position[2],
+            "eve_moon_id": eve_moon_id,
+            "disappeared_at": None,
+        },
+    )
+
+    return structure_location
 
-    logger.info("Updating markets id %s", markets_structure_id)
 
-    markets = Markets.objects.get(structure_id=markets_structure_id)
+def apply_markets_update(
+    markets: Markets,
+    structure_info: dict,
+    markets_assets: Optional[List[dict]],
+) -> Optional[Dict[int, int]]:
+    """
+    Applies the fetched ESI information of a structure to the markets without saving it
+    Returns the amount of each product in the moon material bay
+    If no assets are given only the structure information is applied and None is returned
+    Fuel and magmatic alerts aren't checked, see Markets.evaluate_alerts
+    """
 
     if markets.structure_name != structure_info["name"]:
-        logger.info("Updating markets id %s name", markets_structure_id)
+        logger.info("Updating markets id %s name", markets.structure_id)
         markets.structure_name = structure_info["name"]
 
-    markets.fuel_blocks_count = 0
+    markets.fuel_expires = parse_esi_datetime(structure_info.get("fuel_expires"))
+
+    if markets_assets is None:
+        return None
+
+    markets.esi_digest = structure_digest(structure_info, markets_assets)
+    type_catalog = get_type_catalog()
     fuel_blocks = 0
-    stored_products_to_update = []
+    bay_contents = defaultdict(int)
     for asset in markets_assets:
         if asset["location_flag"] == "StructureFuel":
-            if asset["type_id"] == EveTypePrice.get_magmatic_gas_type_id():
-                markets.set_magmatic_gases(asset["quantity"])
-            elif asset["type_id"] in EveTypePrice.get_fuels_type_ids():
+            if asset["type_id"] == type_catalog.magmatic_gas_type_id:
+                markets.magmatic_gas_count = asset["quantity"]
+            elif asset["type_id"] in type_catalog.fuel_block_type_ids:
                 fuel_blocks += asset["quantity"]
         if asset["location_flag"] == "MoonMaterialBay":
-            stored_moon_material, _ = MarketsStoredMoonMaterials.objects.get_or_create(
-                markets=markets, product_id=asset["type_id"]
-            )
-            stored_moon_material.amount = asset["quantity"]
-            stored_products_to_update.append(stored_moon_material)
+            bay_contents[asset["type_id"]] += asset["quantity"]
+
+    markets.fuel_blocks_count = fuel_blocks
+
+    return dict(bay_contents)
 
-    markets.set_fuel_blocs(fuel_blocks)
 
-    MarketsStoredMoonMaterials.objects.bulk_update(
-        stored_products_to_update, fields=["amount"]
+@shared_task
+def update_markets_bulk(
+    snapshot_key: str, markets_ids: List[int], refresh_id: Optional[str] = None
+):
+    """
+    Updates existing markets of a holding corporation at once from the holding snapshot stored under snapshot_key
+    The markets are loaded in a single query and only the changed ones are written back in bulk
+    with their moon material bays contents
+    Fuel and magmatic thresholds are then evaluated for all the markets at once and the pings queued
+    If the snapshot has no assets only the structures information is updated
+    Its outcome is reported to the holding refresh refresh_id
+    """
+    try:
+        updated = _update_markets_bulk(snapshot_key, markets_ids)
+    except Exception:
+        report_markets_subtask(refresh_id, failed=len(markets_ids))
+        raise
+
+    report_markets_subtask(
+        refresh_id, succeeded=updated, failed=len(markets_ids) - updated
     )
 
-    markets.save()
+
+def _update_markets_bulk(snapshot_key: str, markets_ids: List[int]) -> int:
+    try:
+        holding_corporation_id, markets_data = load_holding_snapshot(snapshot_key)
+    except SnapshotMissingError:
+        logger.warning(
+            "Snapshot %s expired. Its markets will be updated by the next holding update",
+            snapshot_key,
+        )
+        return 0
+
+    structures_info_dic = markets_data.markets_info
+    markets_assets = (
+        markets_data.markets_assets if markets_data.assets_fetched else None
+    )
+
+    markets_list = list(
+        Markets.objects.filter(
+            corporation__corporation__corporation_id=holding_corporation_id,
+            structure_id__in=markets_ids,
+        )
+    )
+    logger.info(
+        "Updating %s markets of corporation id %s",
+        len(markets_list),
+        holding_corporation_id,
+    )
+
+    bay_contents = {}
+    for markets in markets_list:
+        markets_bay_contents = apply_markets_update(
+            markets,
+            structures_info_dic[markets.structure_id],
+            (
+                markets_assets.get(markets.structure_id, [])
+                if markets_assets is not None
+                else None
+            ),
+        )
+        if markets_bay_contents is not None:
+            bay_contents[markets.pk] = markets_bay_contents
+
+    Markets.bulk_save_changes(markets_list)
+    MarketsStoredMoonMaterials.sync_bay_contents(bay_contents)
+
+    if markets_assets is not None:
+        for markets_id, alert, amount in Markets.evaluate_alerts(set(bay_contents)):
+            send_markets_alert.delay(markets_id, alert, amount)
+
+    return len(markets_list)
+
+
+def report_markets_subtask(
+    refresh_id: Optional[str], succeeded: int = 0, failed: int = 0
+):
+    """Reports the outcome of a markets subtask and finalizes its holding refresh if it was the last one"""
+    if refresh_id is None:
+        return
+
+    if summary := refresh_tracker.report(refresh_id, succeeded, failed):
+        finalize_holding_update.delay(*summary)
+
+
+@shared_task
+def finalize_holding_update(
+    holding_corp_id: int, started_at: float, succeeded: int, failed: int
+):
+    """Records the completion of a holding update once all its markets subtasks are done"""
+    holding_corp = HoldingCorporation.objects.filter(
+        corporation__corporation_id=holding_corp_id
+    ).first()
+    if holding_corp is None:
+        logger.info(
+            "Corporation id %s is gone. Not recording its update", holding_corp_id
+        )
+        return
+
+    holding_corp.record_update(started_at, succeeded, failed)
+    if failed:
+        logger.warning(
+            "Update of corporation id %s failed for %s markets out of %s",
+            holding_corp_id,
+            failed,
+            succeeded + failed,
+        )
+
+
+@shared_task
+def send_markets_alert(markets_structure_id: int, alert: str, amount: int):
+    """Sends the low fuel blocks or low magmatic gases ping of a markets to its corporation webhooks"""
+
+    markets = (
+        Markets.objects.select_related("corporation__corporation")
+        .filter(structure_id=markets_structure_id)
+        .first()
+    )
+    if markets is None:
+        logger.info(
+            "Markets id %s is gone. Dropping its %s alert", markets_structure_id, alert
+        )
+        return
+
+    logger.info(
+        "%s level of markets id %s is under the threshold (%s)",
+        alert,
+        markets_structure_id,
+        amount,
+    )
+    if alert == "fuel":
+        markets.corporation.ping_markets_fuel(markets, amount)
+    else:
+        markets.corporation.ping_markets_magma(markets, amount)
 
 
 @shared_task
@@ -301,34 +777,92 @@ def create_moon_from_moonmining(moon_id: int):
 
 @shared_task
 def update_prices():
-    """Task fetching prices and then updating all moon values"""
+    """Task fetching prices and then updating the value of the moons whose goo prices moved"""
 
     goo_ids = EveTypePrice.get_moon_goos_type_ids()
-
-    goo_prices = get_type_ids_prices(goo_ids)
-
-    for type_id, price in goo_prices.items():
-        type_price, _ = EveTypePrice.objects.get_or_create(
-            eve_type_id=type_id,
-        )
-        type_price.update_price(price)
-
     fuel_ids = EveTypePrice.get_fuels_type_ids()
-    fuel_prices = get_type_ids_prices(fuel_ids, BuySell.SELL)
 
-    for type_id, price in fuel_prices.items():
-        type_price, _ = EveTypePrice.objects.get_or_create(
-            eve_type_id=type_id,
+    aggregates = get_type_ids_aggregates(goo_ids | fuel_ids)
+    now = timezone.now()
+    for side in BuySell:
+        EveTypePriceHistory.record_prices(
+            select_prices(aggregates, side), side.value, now
         )
-        type_price.update_price(price)
 
-    moons = Moon.objects.all()
+    if MARKETS_PRICE_MOVING_AVERAGE_HOURS:
+        prices = {
+            **EveTypePriceHistory.get_moving_averages(
+                goo_ids, BuySell.BUY.value, MARKETS_PRICE_MOVING_AVERAGE_HOURS, now
+            ),
+            **EveTypePriceHistory.get_moving_averages(
+                fuel_ids, BuySell.SELL.value, MARKETS_PRICE_MOVING_AVERAGE_HOURS, now
+            ),
+        }
+    else:
+        prices = {
+            **select_prices(aggregates, BuySell.BUY, eve_types_ids=goo_ids),
+            **select_prices(aggregates, BuySell.SELL, eve_types_ids=fuel_ids),
+        }
+
+    type_prices = EveTypePrice.objects.in_bulk(prices, field_name="eve_type_id")
+    new_type_prices = []
+    moved_type_ids = set()
+    for type_id, price in prices.items():
+        if price <= 0:
+            continue
+        if type_id in type_prices:
+            if has_price_moved(type_prices[type_id].price, price):
+                type_prices[type_id].price = price
+                moved_type_ids.add(type_id)
+            type_prices[type_id].last_update = now
+        else:
+            new_type_prices.append(
+                EveTypePrice(eve_type_id=type_id, price=price, last_update=now)
+            )
+            moved_type_ids.add(type_id)
+    EveTypePrice.objects.bulk_update(type_prices.values(), ["price", "last_update"])
+    EveTypePrice.objects.bulk_create(new_type_prices)
+    price_cache.invalidate()
+
+    moved_goo_ids = moved_type_ids & goo_ids
+    if not moved_goo_ids:
+        logger.info("Successfully updated goo and fuel prices. No goo price moved")
+        return
+
     logger.info(
-        "Successfully updated goo and fuel prices. Now updating %s moons", moons.count()
+        "Successfully updated goo and fuel prices. Now updating the moons of %s goos",
+        len(moved_goo_ids),
     )
+    revalue_goo_moons.delay(sorted(moved_goo_ids))
 
-    for moon in moons:
-        update_moon.delay(moon.eve_moon_id)
+
+@shared_task
+def downsample_price_history():
+    """Rolls up the price history in hourly and daily averages and deletes the expired samples"""
+    now = timezone.now()
+    for resolution in (
+        EveTypePriceHistory.Resolution.HOURLY,
+        EveTypePriceHistory.Resolution.DAILY,
+    ):
+        if created_count := EveTypePriceHistory.downsample(resolution, now):
+            logger.info(
+                "Created %s price averages of %s seconds", created_count, resolution
+            )
+
+    if deleted_count := EveTypePriceHistory.delete_expired(now):
+        logger.info("Deleted %s expired price samples", deleted_count)
+
+
+@shared_task
+def revalue_all_moons():
+    """Updates the value of every moon from the current prices"""
+    revalue_moons()
+
+
+@shared_task
+def revalue_goo_moons(goo_ids: List[int]):
+    """Updates the value of the moons harvesting any of the moon goos"""
+    revalue_moons(find_moons_harvesting(goo_ids))
 
 
 def send_analytics(label: str, value):
@@ -0,0 +1,456 @@
+import datetime as dt
+import threading
+import time
+from unittest.mock import Mock, patch
+
+from bravado.exception import HTTPForbidden, HTTPNotModified
+from celery.exceptions import Retry
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from markets.esi import (
+    DownTimeError,
+    ESIError,
+    HoldingMarketsData,
+    get_corporation_markets_assets,
+    get_esi_status,
+    get_holding_markets_data,
+    get_holdings_markets_data,
+    get_structure_info_from_esi,
+    get_structures_from_esi,
+    seconds_until_downtime_end,
+)
+from markets.esi_guard import EsiBudgetExhaustedError
+from markets.tasks import update_holding
+from markets.tests.utils import create_test_holding, create_test_owner
+
+
+class TestHoldingsConcurrentFetch(TestCase):
+
+    @patch("markets.esi.get_holding_markets_data")
+    def test_concurrency_is_capped(self, mock_get_holding_markets_data):
+        """No more than max_workers holdings should be fetched at the same time"""
+
+        lock = threading.Lock()
+        running = {"current": 0, "max": 0}
+
+        def fake_fetch(holding, known_ids):
+            with lock:
+                running["current"] += 1
+                running["max"] = max(running["max"], running["current"])
+            time.sleep(0.05)
+            with lock:
+                running["current"] -= 1
+            return HoldingMarketsData()
+
+        mock_get_holding_markets_data.side_effect = fake_fetch
+
+        holdings = [create_test_holding(holding_id) for holding_id in range(1, 7)]
+
+        results = list(get_holdings_markets_data(holdings, {}, max_workers=2))
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(running["max"], 2)
+
+    @patch("markets.esi.get_holding_markets_data")
+    def test_failure_does_not_stop_other_holdings(self, mock_get_holding_markets_data):
+        """A holding raising an error is returned with its exception"""
+
+        failing_holding = create_test_holding(1)
+        working_holding = create_test_holding(2)
+
+        def fake_fetch(holding, known_ids):
+            if holding == failing_holding:
+                raise ESIError("No owner could fetch data")
+            return HoldingMarketsData(
+                markets_info={known_id: {} for known_id in known_ids}
+            )
+
+        mock_get_holding_markets_data.side_effect = fake_fetch
+
+        results = dict(
+            get_holdings_markets_data(
+                [failing_holding, working_holding], {working_holding.pk: {10, 20}}
+            )
+        )
+
+        self.assertIsInstance(results[failing_holding], ESIError)
+        self.assertEqual(set(results[working_holding].markets_info), {10, 20})
+
+
+@patch("markets.models.Owner.fetch_token")
+@patch("markets.esi.fetch_esi_status")
+class TestCorporationAssetsPages(TestCase):
+
+    @patch("markets.esi._get_corporation_assets_page")
+    def test_fetch_and_filter_all_pages(
+        self, mock_get_page, mock_fetch_esi_status, mock_fetch_token
+    ):
+        """Every page is fetched and only assets in markets bays are kept"""
+
+        mock_fetch_esi_status.return_value.is_daily_downtime = False
+        holding = create_test_holding()
+        create_test_owner(holding)
+
+        pages = {
+            1: [
+                {"location_id": 1, "location_flag": "StructureFuel", "type_id": 4051},
+                {"location_id": 99, "location_flag": "Hangar", "type_id": 34},
+            ],
+            2: [
+                {"location_id": 1, "location_flag": "MoonMaterialBay", "type_id": 16634}
+            ],
+            3: [
+                {"location_id": 2, "location_flag": "StructureFuel", "type_id": 4051},
+                {"location_id": 1, "location_flag": "CorpSAG1", "type_id": 16634},
+            ],
+        }
+        mock_get_page.side_effect = (
+            lambda corporation_id, token, page, request_options: (
+                pages[page],
+                len(pages),
+                {},
+            )
+        )
+
+        assets = get_corporation_markets_assets(holding, {1, 2})
+
+        self.assertEqual(
+            sorted(call.args[2] for call in mock_get_page.call_args_list), [1, 2, 3]
+        )
+        self.assertEqual(
+            sorted(asset["location_flag"] for asset in assets[1]),
+            ["MoonMaterialBay", "StructureFuel"],
+        )
+        self.assertEqual(len(assets[2]), 1)
+        self.assertNotIn(99, assets)
+
+
+@patch("markets.models.Owner.fetch_token")
+@patch("markets.esi.fetch_esi_status")
+@patch("markets.esi._get_corporation_assets_page")
+@patch("markets.esi._get_corporation_structures_page")
+class TestConditionalRequests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.holding = create_test_holding()
+        create_test_owner(self.holding)
+        self.structures = [{"structure_id": 1, "type_id": 81826, "name": "Markets1"}]
+        self.assets = [
+            {"location_id": 1, "location_flag": "StructureFuel", "type_id": 4051}
+        ]
+
+    def test_same_etag_is_not_modified(
+        self,
+        mock_structures_page,
+        mock_assets_page,
+        mock_fetch_esi_status,
+        mock_fetch_token,
+    ):
+        """When the ESI returns the stored ETags the data is flagged as not modified"""
+
+        mock_fetch_esi_status.return_value.is_daily_downtime = False
+        mock_structures_page.return_value = (self.structures, 1, {"ETag": "s1"})
+        mock_assets_page.return_value = (self.assets, 1, {"ETag": "a1"})
+
+        first_data = get_holding_markets_data(self.holding, {1})
+        second_data = get_holding_markets_data(self.holding, {1})
+
+        self.assertTrue(first_data.is_modified)
+        self.assertFalse(second_data.is_modified)
+        self.assertEqual(second_data.markets_info, first_data.markets_info)
+        self.assertEqual(second_data.markets_assets, first_data.markets_assets)
+        self.assertEqual(
+            mock_assets_page.call_args.args[3], {"headers": {"If-None-Match": "a1"}}
+        )
+
+    def test_not_modified_response_reuses_payload(
+        self,
+        mock_structures_page,
+        mock_assets_page,
+        mock_fetch_esi_status,
+        mock_fetch_token,
+    ):
+        """A 304 response returns the stored payload"""
+
+        mock_fetch_esi_status.return_value.is_daily_downtime = False
+        mock_structures_page.return_value = (self.structures, 1, {"ETag": "s1"})
+        mock_assets_page.return_value = (self.assets, 1, {"ETag": "a1"})
+
+        first_data = get_holding_markets_data(self.holding, {1})
+
+        mock_structures_page.side_effect = HTTPNotModified(
+            Mock(status_code=304, headers={})
+        )
+        mock_assets_page.side_effect = HTTPNotModified(
+            Mock(status_code=304, headers={})
+        )
+
+        second_data = get_holding_markets_data(self.holding, {1})
+
+        self.assertFalse(second_data.is_modified)
+        self.assertEqual(second_data.markets_assets, first_data.markets_assets)
+
+    def test_same_payload_with_new_etag_is_not_modified(
+        self,
+        mock_structures_page,
+        mock_assets_page,
+        mock_fetch_esi_status,
+        mock_fetch_token,
+    ):
+        """An identical payload with a new ETag is flagged as not modified"""
+
+        mock_fetch_esi_status.return_value.is_daily_downtime = False
+        mock_structures_page.return_value = (self.structures, 1, {"ETag": "s1"})
+        mock_assets_page.return_value = (self.assets, 1, {"ETag": "a1"})
+
+        get_holding_markets_data(self.holding, {1})
+
+        mock_structures_page.return_value = (self.structures, 1, {"ETag": "s2"})
+        mock_assets_page.return_value = (self.assets, 1, {"ETag": "a2"})
+
+        self.assertFalse(get_holding_markets_data(self.holding, {1}).is_modified)
+
+        mock_assets_page.return_value = (
+            self.assets
+            + [{"location_id": 1, "location_flag": "MoonMaterialBay", "type_id": 1}],
+            1,
+            {"ETag": "a3"},
+        )
+
+        self.assertTrue(get_holding_markets_data(self.holding, {1}).is_modified)
+
+    def test_changes_on_other_pages_are_modified(
+        self,
+        mock_structures_page,
+        mock_assets_page,
+        mock_fetch_esi_status,
+        mock_fetch_token,
+    ):
+        """Only the first page has an ETag, changes on the other pages aren't missed"""
+
+        mock_fetch_esi_status.return_value.is_daily_downtime = False
+        mock_structures_page.return_value = (self.structures, 1, {"ETag": "s1"})
+        bay_quantity = 100
+
+        def assets_page(corporation_id, access_token, page, request_options=None):
+            if page == 1:
+                return self.assets, 2, {"ETag": "a1", "X-Pages": "2"}
+            return (
+                [
+                    {
+                        "location_id": 1,
+                        "location_flag": "MoonMaterialBay",
+                        "type_id": 16634,
+                        "quantity": bay_quantity,
+                    }
+                ],
+                2,
+                {"ETag": "a1-2", "X-Pages": "2"},
+            )
+
+        mock_assets_page.side_effect = assets_page
+
+        get_holding_markets_data(self.holding, {1})
+        bay_quantity = 5000
+        second_data = get_holding_markets_data(self.holding, {1})
+
+        self.assertTrue(second_data.is_modified)
+        self.assertIn(
+            5000, [asset.get("quantity") for asset in second_data.markets_assets[1]]
+        )
+        self.assertEqual(mock_assets_page.call_args_list[2].args[3], {})
+
+    def test_expires_header_is_kept(
+        self,
+        mock_structures_page,
+        mock_assets_page,
+        mock_fetch_esi_status,
+        mock_fetch_token,
+    ):
+        """The Expires header of the structures is returned, including on 304 responses"""
+
+        mock_fetch_esi_status.return_value.is_daily_downtime = False
+        mock_structures_page.return_value = (
+            self.structures,
+            1,
+            {"ETag": "s1", "Expires": "Thu, 01 Jan 2026 10:00:00 GMT"},
+        )
+        mock_assets_page.return_value = (self.assets, 1, {"ETag": "a1"})
+
+        self.assertEqual(
+            get_holding_markets_data(self.holding, {1}).expires,
+            dt.datetime(2026, 1, 1, 10, tzinfo=dt.timezone.utc),
+        )
+
+        mock_structures_page.side_effect = HTTPNotModified(
+            Mock(status_code=304, headers={"Expires": "Thu, 01 Jan 2026 11:00:00 GMT"})
+        )
+
+        self.assertEqual(
+            get_holding_markets_data(self.holding, {1}).expires,
+            dt.datetime(2026, 1, 1, 11, tzinfo=dt.timezone.utc),
+        )
+
+
+@patch("markets.models.Owner.fetch_token")
+@patch("markets.esi.fetch_esi_status")
+class TestErrorBudget(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @patch("markets.esi.esi")
+    def test_exhausted_budget_does_not_disable_owners(
+        self, mock_esi, mock_fetch_esi_status, mock_fetch_token
+    ):
+        """No ESI call is made and owners are kept enabled while the error budget is exhausted"""
+
+        mock_fetch_esi_status.return_value.is_daily_downtime = False
+        holding = create_test_holding()
+        owner = create_test_owner(holding)
+
+        with patch(
+            "markets.esi.esi_guard.check_error_budget",
+            side_effect=EsiBudgetExhaustedError(30),
+        ):
+            with self.assertRaises(EsiBudgetExhaustedError):
+                get_structures_from_esi(holding)
+
+        mock_esi.client.Corporation.get_corporations_corporation_id_structures.return_value.result.assert_not_called()
+        owner.refresh_from_db()
+        self.assertTrue(owner.is_enabled)
+
+    @patch("markets.esi.esi")
+    def test_error_limit_headers_are_recorded(
+        self, mock_esi, mock_fetch_esi_status, mock_fetch_token
+    ):
+        """The error limit of every response is stored in the shared cache"""
+
+        mock_fetch_esi_status.return_value.is_daily_downtime = False
+        holding = create_test_holding()
+        create_test_owner(holding)
+        mock_esi.client.Corporation.get_corporations_corporation_id_structures.return_value.result.return_value = (
+            [],
+            Mock(
+                headers={
+                    "X-Pages": "1",
+                    "X-ESI-Error-Limit-Remain": "5",
+                    "X-ESI-Error-Limit-Reset": "40",
+                }
+            ),
+        )
+
+        get_structures_from_esi(holding)
+
+        with self.assertRaises(EsiBudgetExhaustedError):
+            get_structures_from_esi(holding)
+
+
+@patch("markets.models.Owner.fetch_token")
+@patch("markets.esi.fetch_esi_status")
+@patch("markets.esi._get_corporation_structures_page")
+class TestOwnersRotation(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.holding = create_test_holding()
+
+    def test_forbidden_owner_is_disabled_after_repeated_failures(
+        self, mock_structures_page, mock_fetch_esi_status, mock_fetch_token
+    ):
+        """An owner getting forbidden errors is tried last and only disabled once it reached the failures limit"""
+
+        mock_fetch_esi_status.return_value.is_daily_downtime = False
+        failing_owner = create_test_owner(self.holding, 10001)
+        working_owner = create_test_owner(self.holding, 10002)
+        tokens = {failing_owner.pk: "failing", working_owner.pk: "working"}
+        mock_fetch_token.side_effect = lambda: None
+        used_tokens = []
+
+        def fake_page(corporation_id, access_token, page, request_options):
+            used_tokens.append(access_token)
+            if access_token == "failing":
+                raise HTTPForbidden(Mock(status_code=403))
+            return [], 1, {}
+
+        mock_structures_page.side_effect = fake_page
+
+        with patch(
+            "markets.esi.get_access_token", side_effect=lambda owner: tokens[owner.pk]
+        ), patch("markets.esi.owner_scheduler.max_failures", 2):
+            with patch(
+                "markets.esi.owner_scheduler.order",
+                return_value=[failing_owner, working_owner],
+            ):
+                get_structures_from_esi(self.holding)
+
+            for _ in range(3):
+                get_structures_from_esi(self.holding)
+
+            failing_owner.refresh_from_db()
+            self.assertTrue(failing_owner.is_enabled)
+            self.assertEqual(used_tokens, ["failing"] + ["working"] * 4)
+
+            with patch(
+                "markets.esi.owner_scheduler.order",
+                return_value=[failing_owner, working_owner],
+            ):
+                get_structures_from_esi(self.holding)
+
+        failing_owner.refresh_from_db()
+        self.assertFalse(failing_owner.is_enabled)
+
+
+class TestEsiStatus(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @patch("markets.esi.fetch_esi_status")
+    def test_status_is_cached(self, mock_fetch_esi_status):
+        """The ESI status is fetched once and shared by the following calls"""
+
+        mock_fetch_esi_status.return_value.is_online = True
+        mock_fetch_esi_status.return_value.is_daily_downtime = True
+
+        self.assertTrue(get_esi_status().is_daily_downtime)
+        self.assertTrue(get_esi_status().is_daily_downtime)
+        mock_fetch_esi_status.assert_called_once()
+
+    def test_seconds_until_downtime_end(self):
+        now = dt.datetime(2025, 1, 1, 11, 5, tzinfo=dt.timezone.utc)
+
+        self.assertEqual(seconds_until_downtime_end(now), 10 * 60 + 120)
+
+    @patch("markets.tasks.get_holding_markets_data")
+    def test_update_holding_is_retried_after_downtime(
+        self, mock_get_holding_markets_data
+    ):
+        """An update started during the downtime is rescheduled to its end"""
+
+        holding = create_test_holding()
+        create_test_owner(holding)
+        mock_get_holding_markets_data.side_effect = DownTimeError(600)
+
+        with patch.object(update_holding, "retry", return_value=Retry()) as mock_retry:
+            with self.assertRaises(Retry):
+                update_holding(holding.corporation.corporation_id)
+
+        self.assertEqual(mock_retry.call_args.kwargs["countdown"], 600)
+
+    @patch("markets.esi.fetch_esi_status")
+    def test_structure_info_not_fetched_during_downtime(self, mock_fetch_esi_status):
+        """Structure locations aren't requested during the downtime"""
+
+        mock_fetch_esi_status.return_value.is_daily_downtime = True
+        holding = create_test_holding()
+        create_test_owner(holding)
+
+        with patch("markets.esi.esi") as mock_esi:
+            with self.assertRaises(DownTimeError):
+                get_structure_info_from_esi(holding, 1)
+
+        mock_esi.client.Universe.get_universe_structures_structure_id.assert_not_called()
@@ -0,0 +1,74 @@
+from unittest.mock import patch
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+
+from markets.esi_guard import EsiBudgetExhaustedError, EsiGuard
+
+
+class FakeClock:
+    """Replaces the time module to make time only move when sleeping"""
+
+    def __init__(self, now: float = 1_000_000.5):
+        self.now = now
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestEsiGuard(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.guard = EsiGuard(
+            LocMemCache("markets-test-esi-guard", {}),
+            max_requests_per_second=2,
+            error_limit_threshold=10,
+        )
+        self.guard.cache.clear()
+
+    def test_rate_limit_waits_for_next_window(self):
+        with patch("markets.esi_guard.time", self.clock):
+            for _ in range(5):
+                self.guard.acquire()
+
+        self.assertEqual(self.clock.sleeps, [0.5, 1])
+
+    def test_rate_limit_is_shared_between_guards(self):
+        other_guard = EsiGuard(self.guard.cache, max_requests_per_second=2)
+
+        with patch("markets.esi_guard.time", self.clock):
+            self.guard.acquire()
+            other_guard.acquire()
+            self.guard.acquire()
+
+        self.assertEqual(len(self.clock.sleeps), 1)
+
+    def test_low_error_budget_blocks_requests_until_reset(self):
+        with patch("markets.esi_guard.time", self.clock):
+            self.guard.record_headers(
+                {"X-ESI-Error-Limit-Remain": "40", "X-ESI-Error-Limit-Reset": "30"}
+            )
+            self.guard.acquire()
+
+            self.guard.record_headers(
+                {"X-ESI-Error-Limit-Remain": "10", "X-ESI-Error-Limit-Reset": "25"}
+            )
+            with self.assertRaises(EsiBudgetExhaustedError) as context:
+                self.guard.acquire()
+            self.assertEqual(context.exception.retry_after, 25)
+
+            self.clock.now += 26
+            self.guard.acquire()
+
+    def test_ignore_responses_without_error_limit(self):
+        self.guard.record_headers(None)
+        self.guard.record_headers({"X-Pages": "3"})
+        self.guard.record_headers({"X-ESI-Error-Limit-Remain": "none"})
+
+        self.assertIsNone(self.guard.cache.get(EsiGuard.ERROR_LIMIT_KEY))
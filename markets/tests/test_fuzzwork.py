@@ -1,11 +1,22 @@
+import re
+from unittest.mock import patch
+
 import responses
 
 from django.test import TestCase
 from eveuniverse.models import EveType
 
-from markets.api.fuzzwork import get_type_ids_prices
+from markets.api.fuzzwork import (
+    BuySell,
+    get_session,
+    get_type_ids_aggregates,
+    get_type_ids_prices,
+    select_prices,
+)
 from markets.models import EveTypePrice
+from markets.tasks import update_prices
 from markets.tests.testdata.load_eveuniverse import load_eveuniverse
+from markets.tests.utils import fake_aggregates
 
 
 class TestFuzzWork(TestCase):
@@ -80,3 +91,76 @@ class TestFuzzWork(TestCase):
         type_price.update_price(new_price[16634])
 
         self.assertEqual(type_price.price, 4.48628743026839)
+
+    @responses.activate
+    @patch("markets.api.fuzzwork.MAX_TYPES_PER_REQUEST", 1)
+    def test_types_are_fetched_by_batches(self):
+        """Long type lists are split to keep the URL short"""
+
+        responses.add(
+            responses.GET,
+            "https://market.fuzzwork.co.uk/aggregates/?region=10000002&types=16633",
+            json=fake_aggregates(16633, 1, 2),
+        )
+        responses.add(
+            responses.GET,
+            "https://market.fuzzwork.co.uk/aggregates/?region=10000002&types=16634",
+            json=fake_aggregates(16634, 3, 4),
+        )
+
+        aggregates = get_type_ids_aggregates([16634, 16633])
+
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(select_prices(aggregates), {16633: 1.0, 16634: 3.0})
+        self.assertEqual(
+            select_prices(aggregates, BuySell.SELL, eve_types_ids=[16634]),
+            {16634: 4.0},
+        )
+
+    def test_session_is_shared_and_retries(self):
+        session = get_session()
+
+        self.assertIs(session, get_session())
+        self.assertGreater(
+            session.get_adapter("https://market.fuzzwork.co.uk").max_retries.total, 0
+        )
+
+    @responses.activate
+    @patch("markets.tasks.revalue_goo_moons.delay")
+    def test_update_prices_in_one_request(self, mock_revalue_goo_moons):
+        """Goo buy prices and fuel sell prices come from a single request"""
+
+        responses.add(
+            responses.GET,
+            re.compile(r"https://market\.fuzzwork\.co\.uk/aggregates/.*"),
+            json={**fake_aggregates(16634, 10, 20), **fake_aggregates(81143, 30, 40)},
+        )
+
+        update_prices()
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(EveTypePrice.get_eve_type_id_price(16634), 10)
+        self.assertEqual(EveTypePrice.get_eve_type_id_price(81143), 40)
+        mock_revalue_goo_moons.assert_called_once_with([16634])
+
+    @responses.activate
+    @patch("markets.tasks.revalue_goo_moons.delay")
+    def test_small_price_changes_ignored(self, mock_revalue_goo_moons):
+        """Goo prices moving less than the epsilon are kept and their moons aren't revalued"""
+        EveTypePrice.objects.create(eve_type_id=16634, price=10_000)
+        EveTypePrice.objects.create(eve_type_id=16633, price=10_000)
+
+        responses.add(
+            responses.GET,
+            re.compile(r"https://market\.fuzzwork\.co\.uk/aggregates/.*"),
+            json={
+                **fake_aggregates(16634, 10_005, 20_000),
+                **fake_aggregates(16633, 12_000, 20_000),
+            },
+        )
+
+        update_prices()
+
+        self.assertEqual(EveTypePrice.get_eve_type_id_price(16634), 10_000)
+        self.assertEqual(EveTypePrice.get_eve_type_id_price(16633), 12_000)
+        mock_revalue_goo_moons.assert_called_once_with([16633])
@@ -0,0 +1,80 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+
+from markets.holding_lock import HoldingLock, holding_lock
+from markets.tasks import enqueue_holding_update, update_holding
+
+
+class TestHoldingLock(TestCase):
+
+    def setUp(self):
+        self.lock = HoldingLock(
+            LocMemCache("markets-test-holding-lock", {}), lease_seconds=60
+        )
+        self.lock.cache.clear()
+
+    def test_lease(self):
+        token = self.lock.acquire(1)
+
+        self.assertIsNotNone(token)
+        self.assertIsNone(self.lock.acquire(1))
+        self.assertIsNotNone(self.lock.acquire(2))
+
+        self.lock.release(1, "other token")
+        self.assertTrue(self.lock.is_running(1))
+
+        self.lock.release(1, token)
+        self.assertFalse(self.lock.is_running(1))
+        self.assertIsNotNone(self.lock.acquire(1))
+
+    def test_pending(self):
+        self.assertTrue(self.lock.mark_pending(1))
+        self.assertFalse(self.lock.mark_pending(1))
+
+        self.lock.clear_pending(1)
+        self.assertTrue(self.lock.mark_pending(1))
+
+    def test_fallback_to_local_cache(self):
+        with patch("markets.holding_lock.cache", DummyCache("dummy", {})):
+            lock = HoldingLock()
+            self.assertIsInstance(lock.cache, LocMemCache)
+            self.assertIsNotNone(lock.acquire(1))
+            self.assertIsNone(lock.acquire(1))
+            lock.cache.clear()
+
+
+class TestHoldingUpdateDeduplication(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @patch("markets.tasks.update_holding.delay")
+    def test_enqueue_is_collapsed_while_pending(self, mock_delay):
+        self.assertTrue(enqueue_holding_update(1))
+        self.assertFalse(enqueue_holding_update(1))
+        self.assertTrue(enqueue_holding_update(2))
+
+        self.assertEqual(mock_delay.call_count, 2)
+
+    @patch("markets.tasks.update_holding.delay")
+    def test_enqueue_is_collapsed_while_running(self, mock_delay):
+        holding_lock.acquire(1)
+
+        self.assertFalse(enqueue_holding_update(1))
+        mock_delay.assert_not_called()
+
+    @patch("markets.tasks._update_holding")
+    def test_update_is_skipped_while_running(self, mock_update_holding):
+        token = holding_lock.acquire(1)
+
+        update_holding(1)
+        mock_update_holding.assert_not_called()
+
+        holding_lock.release(1, token)
+        update_holding(1)
+        mock_update_holding.assert_called_once()
+        self.assertFalse(holding_lock.is_running(1))
@@ -0,0 +1,120 @@
+import datetime as dt
+
+from django.test import TestCase
+from django.utils import timezone
+from eveuniverse.models import EveMoon
+
+from markets.holding_scheduler import HoldingScheduler
+from markets.models import HoldingCorporation, Markets, StructureLocation
+from markets.tasks import schedule_holdings_updates
+from markets.tests.testdata.load_eveuniverse import load_eveuniverse
+from markets.tests.utils import create_test_holding, create_test_markets
+
+NOW = dt.datetime(2026, 1, 1, tzinfo=dt.timezone.utc)
+
+
+class TestHoldingScheduler(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def setUp(self):
+        self.scheduler = HoldingScheduler(interval=3600, tick=300)
+
+    def create_holdings(self, count: int, last_updated) -> list:
+        for holding_id in range(1, count + 1):
+            holding = create_test_holding(holding_id)
+            holding.last_updated = last_updated
+            holding.save()
+        return list(HoldingCorporation.objects.select_related("corporation"))
+
+    def test_holdings_are_spread_over_the_interval(self):
+        holdings = self.create_holdings(4, NOW - dt.timedelta(minutes=40))
+
+        self.assertEqual(self.scheduler.plan(holdings, NOW), [(1, 0)])
+        self.assertEqual(
+            self.scheduler.plan(holdings, NOW + dt.timedelta(minutes=14)), [(2, 60)]
+        )
+        self.assertEqual(
+            self.scheduler.plan(holdings, NOW + dt.timedelta(minutes=20)), []
+        )
+
+    def test_recently_updated_holdings_wait_for_next_interval(self):
+        holdings = self.create_holdings(2, NOW - dt.timedelta(minutes=10))
+
+        self.assertEqual(self.scheduler.plan(holdings, NOW), [])
+
+    def test_overdue_holdings_are_spread_over_the_tick(self):
+        holdings = self.create_holdings(3, None)
+
+        self.assertEqual(
+            self.scheduler.plan(holdings, NOW + dt.timedelta(minutes=20)),
+            [(1, 0), (2, 100), (3, 200)],
+        )
+
+    def test_wait_for_esi_cache_expiry(self):
+        holdings = self.create_holdings(1, None)
+
+        holdings[0].esi_expires = NOW + dt.timedelta(seconds=90)
+        self.assertEqual(self.scheduler.plan(holdings, NOW), [(1, 90)])
+
+        holdings[0].esi_expires = NOW + dt.timedelta(minutes=30)
+        self.assertEqual(self.scheduler.plan(holdings, NOW), [])
+
+    def test_holdings_near_fuel_threshold_first(self):
+        markets = create_test_markets()
+        holding = markets.corporation
+        holding.ping_on_remaining_fuel_days = 3
+        holding.last_updated = NOW - dt.timedelta(minutes=10)
+        holding.save()
+        create_test_holding(2)
+        holdings = list(HoldingCorporation.objects.select_related("corporation"))
+
+        self.assertEqual(
+            self.scheduler.plan(holdings, NOW + dt.timedelta(minutes=20)), [(2, 0)]
+        )
+
+        Markets.objects.filter(pk=markets.pk).update(
+            fuel_expires=NOW + dt.timedelta(days=2)
+        )
+        self.assertEqual(
+            self.scheduler.plan(holdings, NOW + dt.timedelta(minutes=20)),
+            [(1, 0), (2, 0)],
+        )
+
+        Markets.objects.filter(pk=markets.pk).update(was_fuel_pinged=True)
+        self.assertEqual(
+            self.scheduler.plan(holdings, NOW + dt.timedelta(minutes=20)), [(2, 0)]
+        )
+
+
+class TestScheduleHoldingsUpdates(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def test_disappeared_structure_locations_are_deleted(self):
+        """The scheduled updates clean up the locations of long disappeared structures"""
+
+        eve_moon = EveMoon.objects.get(id=40178441)
+        for structure_id, disappeared_days in ((1, 60), (2, 1)):
+            StructureLocation.objects.create(
+                structure_id=structure_id,
+                solar_system=eve_moon.eve_planet.eve_solar_system,
+                position_x=eve_moon.position_x,
+                position_y=eve_moon.position_y,
+                position_z=eve_moon.position_z,
+                eve_moon=eve_moon,
+                disappeared_at=timezone.now() - dt.timedelta(days=disappeared_days),
+            )
+
+        schedule_holdings_updates()
+
+        self.assertEqual(
+            list(StructureLocation.objects.values_list("structure_id", flat=True)),
+            [2],
+        )
@@ -1,60 +1,39 @@
+import datetime as dt
+from unittest.mock import patch
+
 from moonmining.models import Moon as MoonMiningMoon
 from moonmining.models import MoonProduct
 
+from django.db import connection
 from django.test import TestCase
-from eveuniverse.models import EveMoon, EveType
-
-from allianceauth.eveonline.models import EveCorporationInfo
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from eveuniverse.models import EveGroup, EveMoon, EveType
 
+from markets.esi import HoldingMarketsData
 from markets.models import (
     EveTypePrice,
-    HoldingCorporation,
     Markets,
+    MarketsHourlyProducts,
     MarketsStoredMoonMaterials,
     MarketsTag,
+    StructureLocation,
+)
+from markets.snapshots import store_holding_snapshot
+from markets.tasks import (
+    apply_markets_update,
+    create_markets,
+    update_holding_markets,
+    update_markets_bulk,
+    update_moons_from_moonmining,
 )
-from markets.tasks import create_markets, update_moons_from_moonmining
 from markets.tests.testdata.load_eveuniverse import load_eveuniverse
+from markets.tests.utils import create_test_holding, create_test_markets
+from markets.type_catalog import invalidate_type_catalog
 
 MOON_ID = 40178441
 
 
-def create_test_markets() -> Markets:
-    """
-    Creates a basic markets for testing purpose
-    """
-
-    corporation = EveCorporationInfo.objects.create(
-        corporation_id=1,
-        corporation_name="corporation1",
-        corporation_ticker="CORP1",
-        member_count=1,
-    )
-    holding = HoldingCorporation(corporation=corporation)
-    holding.save()
-    eve_moon = EveMoon.objects.get(id=MOON_ID)
-
-    structure_info = {
-        "name": "Markets1",
-        "structure_id": 1,
-    }
-
-    location_info = {
-        "position": {
-            "x": eve_moon.position_x,
-            "y": eve_moon.position_y,
-            "z": eve_moon.position_z,
-        },
-        "solar_system_id": eve_moon.eve_planet.eve_solar_system.id,
-    }
-
-    create_markets(holding.corporation.corporation_id, structure_info, location_info)
-
-    markets = Markets.objects.get(structure_id=1)
-
-    return markets
-
-
 class TestMarketses(TestCase):
 
     @classmethod
@@ -138,71 +117,574 @@ class TestMarketses(TestCase):
             2000 * 200 + 1000 * 50, markets.get_stored_moon_materials_value()
         )
 
-    def test_set_fuel_blocks(self):
-        """Test the set_fuel_blocks command"""
+    def test_default_tags(self):
+        """
+        Checks that on markets creation the default tags are correctly added
+        """
+
+        tag1 = MarketsTag.objects.create(name="tag1", default=True)
+        tag2 = MarketsTag.objects.create(name="tag2", default=True)
+        tag3 = MarketsTag.objects.create(name="tag3")
 
         markets = create_test_markets()
-        holding = markets.corporation
-        holding.ping_on_remaining_fuel_days = (
-            1  # 120 fuel blocks being a daily consumption
+
+        self.assertIn(tag1, markets.tags.all())
+        self.assertIn(tag2, markets.tags.all())
+        self.assertNotIn(tag3, markets.tags.all())
+
+    @patch("markets.tasks.get_structure_info_from_esi")
+    @patch("markets.tasks.EveSolarSystem.nearest_celestial")
+    def test_create_markets_from_stored_location(
+        self, mock_nearest_celestial, mock_get_structure_info_from_esi
+    ):
+        """
+        A markets whose location is already stored is created without any ESI call
+        """
+
+        holding = create_test_holding()
+        eve_moon = EveMoon.objects.get(id=MOON_ID)
+        StructureLocation.objects.create(
+            structure_id=1,
+            solar_system=eve_moon.eve_planet.eve_solar_system,
+            position_x=eve_moon.position_x,
+            position_y=eve_moon.position_y,
+            position_z=eve_moon.position_z,
+            eve_moon=eve_moon,
+            disappeared_at=timezone.now(),
+        )
+
+        create_markets(
+            store_holding_snapshot(
+                holding.corporation.corporation_id,
+                HoldingMarketsData({1: {"name": "Markets1", "structure_id": 1}}),
+            ),
+            1,
+        )
+
+        markets = Markets.objects.get(structure_id=1)
+        self.assertEqual(markets.moon.eve_moon, eve_moon)
+        self.assertIsNone(StructureLocation.objects.get(structure_id=1).disappeared_at)
+        mock_nearest_celestial.assert_not_called()
+        mock_get_structure_info_from_esi.assert_not_called()
+
+    def test_bulk_save_changes(self):
+        """Only the changed fields are written and unchanged markets aren't written at all"""
+
+        markets = Markets.objects.get(pk=create_test_markets().pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Markets.bulk_save_changes([markets]), 0)
+
+        assets = [
+            {"location_flag": "StructureFuel", "type_id": 81143, "quantity": 4000}
+        ]
+        apply_markets_update(markets, {"name": "Markets1"}, assets)
+        apply_markets_update(markets, {"name": "Markets1"}, assets)
+        self.assertEqual(markets.changed_fields(), ["magmatic_gas_count", "esi_digest"])
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(Markets.bulk_save_changes([markets]), 1)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertNotIn("fuel_blocks_count", context.captured_queries[0]["sql"])
+
+        self.assertEqual(markets.changed_fields(), [])
+        markets.refresh_from_db()
+        self.assertEqual(markets.magmatic_gas_count, 4000)
+
+
+class TestTieredRefresh(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def setUp(self):
+        self.markets = create_test_markets()
+        self.holding = self.markets.corporation
+        self.now = timezone.now()
+        self.structure_info = {
+            "name": "Markets1",
+            "structure_id": 1,
+            "fuel_expires": self.now + dt.timedelta(days=20),
+        }
+
+    def test_assets_refresh_interval(self):
+        """Assets are fetched when never fetched or older than the refresh interval"""
+
+        markets_info = {1: self.structure_info}
+
+        self.assertTrue(self.holding.needs_assets_refresh(markets_info, self.now))
+
+        self.holding.assets_updated_at = self.now - dt.timedelta(hours=1)
+        self.assertFalse(self.holding.needs_assets_refresh(markets_info, self.now))
+
+        self.holding.assets_updated_at = self.now - dt.timedelta(days=1)
+        self.assertTrue(self.holding.needs_assets_refresh(markets_info, self.now))
+
+    def test_assets_refresh_on_fuel_threshold(self):
+        """Assets are fetched early when the fuel crosses the ping threshold"""
+
+        self.markets.fuel_blocks_count = 3 * 24 * 5 + 5  # 3 days and an hour
+        self.markets.save()
+        self.holding.ping_on_remaining_fuel_days = 3
+
+        self.holding.assets_updated_at = self.now - dt.timedelta(minutes=30)
+        self.assertFalse(
+            self.holding.needs_assets_refresh({1: self.structure_info}, self.now)
+        )
+
+        self.holding.assets_updated_at = self.now - dt.timedelta(hours=2)
+        self.assertTrue(
+            self.holding.needs_assets_refresh({1: self.structure_info}, self.now)
+        )
+
+        self.markets.was_fuel_pinged = True
+        self.markets.save()
+        self.assertFalse(
+            self.holding.needs_assets_refresh({1: self.structure_info}, self.now)
+        )
+
+    def test_assets_refresh_ignores_esi_fuel_expiry(self):
+        """The fuel threshold uses the fuel blocks the alerts are evaluated on, not the ESI fuel expiry"""
+
+        self.markets.fuel_blocks_count = 20 * 24 * 5
+        self.markets.save()
+        self.holding.ping_on_remaining_fuel_days = 3
+        self.holding.assets_updated_at = self.now - dt.timedelta(hours=1)
+        self.structure_info["fuel_expires"] = (
+            self.now + dt.timedelta(days=2)
+        ).isoformat()
+
+        self.assertFalse(
+            self.holding.needs_assets_refresh({1: self.structure_info}, self.now)
+        )
+        self.assertEqual(Markets.evaluate_alerts({self.markets.pk}), [])
+
+    def test_assets_refresh_on_nearly_full_bay(self):
+        """Assets are fetched early when the moon material bay is projected to be nearly full"""
+
+        MarketsHourlyProducts.objects.create(
+            moon=self.markets.moon, product_id=16634, amount=100_000
+        )  # 5 000 m3 an hour
+        MarketsStoredMoonMaterials.objects.create(
+            markets=self.markets, product_id=16634, amount=8_000_000
+        )  # 400 000 m3 stored
+        self.holding.assets_updated_at = self.now - dt.timedelta(hours=5)
+
+        self.assertFalse(
+            self.holding.needs_assets_refresh({1: self.structure_info}, self.now)
+        )
+
+        self.holding.assets_updated_at = self.now - dt.timedelta(hours=11)
+        self.assertTrue(
+            self.holding.needs_assets_refresh({1: self.structure_info}, self.now)
+        )
+
+    def test_update_without_assets(self):
+        """Only the structure info is updated when the assets weren't fetched"""
+
+        self.markets.fuel_blocks_count = 1_000
+        self.markets.save()
+        assets_updated_at = self.now - dt.timedelta(hours=1)
+        self.holding.assets_updated_at = assets_updated_at
+        self.holding.save()
+
+        update_holding_markets(
+            self.holding,
+            HoldingMarketsData(
+                markets_info={1: {**self.structure_info, "name": "Markets renamed"}},
+                assets_fetched=False,
+            ),
+        )
+
+        self.markets.refresh_from_db()
+        self.holding.refresh_from_db()
+        self.assertEqual(self.markets.structure_name, "Markets renamed")
+        self.assertEqual(self.markets.fuel_expires, self.structure_info["fuel_expires"])
+        self.assertEqual(self.markets.fuel_blocks_count, 1_000)
+        self.assertEqual(self.holding.assets_updated_at, assets_updated_at)
+
+
+class TestBulkUpdate(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def test_update_markets_bulk(self):
+        """The markets of a holding and their bay contents are updated in bulk"""
+
+        markets = create_test_markets()
+        MarketsStoredMoonMaterials.objects.create(
+            markets=markets, product_id=16634, amount=50
         )
-        holding.save()
+        assets = [
+            {"location_flag": "StructureFuel", "type_id": 81143, "quantity": 1_000},
+            {"location_flag": "MoonMaterialBay", "type_id": 16634, "quantity": 100},
+            {"location_flag": "MoonMaterialBay", "type_id": 16634, "quantity": 20},
+            {"location_flag": "MoonMaterialBay", "type_id": 16633, "quantity": 300},
+        ]
 
-        self.assertEqual(markets.fuel_blocks_count, 0)
+        update_markets_bulk(
+            store_holding_snapshot(
+                markets.corporation.corporation.corporation_id,
+                HoldingMarketsData(
+                    {1: {"name": "Markets renamed", "structure_id": 1}}, {1: assets}
+                ),
+            ),
+            [1],
+        )
 
-        markets.set_fuel_blocs(1400)
+        markets.refresh_from_db()
+        self.assertEqual(markets.structure_name, "Markets renamed")
+        self.assertEqual(markets.magmatic_gas_count, 1_000)
+        self.assertEqual(
+            {
+                stored.product_id: stored.amount
+                for stored in markets.get_stored_moon_materials()
+            },
+            {16634: 120, 16633: 300},
+        )
 
-        self.assertEqual(markets.fuel_blocks_count, 1400)
-        self.assertFalse(markets.was_fuel_pinged)  # enough fuel to last longer
+    def test_skip_unchanged_markets(self):
+        """Markets whose structure and assets digest didn't change aren't updated again"""
 
-        markets.set_fuel_blocs(20)
+        markets = create_test_markets()
+        structure_info = {"name": "Markets1", "structure_id": 1}
+        assets = [
+            {"location_flag": "StructureFuel", "type_id": 81143, "quantity": 1_000},
+            {"location_flag": "MoonMaterialBay", "type_id": 16634, "quantity": 100},
+        ]
+        update_markets_bulk(
+            store_holding_snapshot(
+                markets.corporation.corporation.corporation_id,
+                HoldingMarketsData({1: structure_info}, {1: assets}),
+            ),
+            [1],
+        )
 
-        self.assertEqual(markets.fuel_blocks_count, 20)
-        self.assertTrue(markets.was_fuel_pinged)
+        with patch("markets.tasks.update_markets_bulk.delay") as mock_update:
+            update_holding_markets(
+                markets.corporation,
+                HoldingMarketsData({1: structure_info}, {1: list(reversed(assets))}),
+            )
+            mock_update.assert_not_called()
+
+            assets[1] = {
+                "location_flag": "MoonMaterialBay",
+                "type_id": 16634,
+                "quantity": 200,
+            }
+            update_holding_markets(
+                markets.corporation,
+                HoldingMarketsData({1: structure_info}, {1: assets}),
+            )
+            mock_update.assert_called_once()
 
-        markets.set_fuel_blocs(1500)
+    def test_skip_unchanged_structures_without_assets(self):
+        """Without assets only a changed name or fuel expiry updates a markets"""
 
-        self.assertEqual(markets.fuel_blocks_count, 1500)
-        self.assertFalse(markets.was_fuel_pinged)
+        markets = create_test_markets()
+        fuel_expires = timezone.now() + dt.timedelta(days=10)
+        Markets.objects.filter(pk=markets.pk).update(fuel_expires=fuel_expires)
+
+        with patch("markets.tasks.update_markets_bulk.delay") as mock_update:
+            update_holding_markets(
+                markets.corporation,
+                HoldingMarketsData(
+                    {
+                        1: {
+                            "name": markets.structure_name,
+                            "structure_id": 1,
+                            "fuel_expires": fuel_expires.isoformat(),
+                        }
+                    },
+                    assets_fetched=False,
+                ),
+            )
+            mock_update.assert_not_called()
+
+            update_holding_markets(
+                markets.corporation,
+                HoldingMarketsData(
+                    {1: {"name": "Markets renamed", "structure_id": 1}},
+                    assets_fetched=False,
+                ),
+            )
+            mock_update.assert_called_once()
 
-    def test_set_magmatic(self):
-        """Test the set_magmatic command"""
+    @patch("markets.tasks.get_structure_info_from_esi", side_effect=OSError)
+    def test_update_is_recorded_once_markets_are_written(
+        self, mock_get_structure_info_from_esi
+    ):
+        """The holding update is recorded after its markets subtasks with their outcome"""
 
         markets = create_test_markets()
         holding = markets.corporation
-        holding.ping_on_remaining_magmatic_days = (
-            1  # 2640 magmatic gases being a daily consumption
+        started_at = timezone.now().timestamp() - 5
+
+        update_holding_markets(
+            holding,
+            HoldingMarketsData(
+                {
+                    1: {"name": "Markets renamed", "structure_id": 1},
+                    2: {"name": "Markets2", "structure_id": 2},
+                },
+                {1: []},
+            ),
+            started_at,
         )
-        holding.save()
 
-        self.assertEqual(markets.fuel_blocks_count, 0)
+        holding.refresh_from_db()
+        self.assertIsNotNone(holding.last_updated)
+        self.assertGreaterEqual(holding.last_update_duration, 5)
+        self.assertEqual(holding.last_update_succeeded, 1)
+        self.assertEqual(holding.last_update_failed, 1)
+        mock_get_structure_info_from_esi.assert_called_once()
 
-        markets.set_magmatic_gases(4000)
+    def test_update_without_changes_is_recorded(self):
+        """A holding update with nothing to write is recorded right away"""
 
-        self.assertEqual(markets.magmatic_gas_count, 4000)
-        self.assertFalse(markets.was_magmatic_pinged)
+        markets = create_test_markets()
+        holding = markets.corporation
+
+        with patch("markets.tasks.update_markets_bulk.delay") as mock_update:
+            update_holding_markets(
+                holding,
+                HoldingMarketsData(
+                    {1: {"name": "Markets1", "structure_id": 1}},
+                    is_modified=False,
+                    assets_fetched=False,
+                ),
+            )
+
+        mock_update.assert_not_called()
+        holding.refresh_from_db()
+        self.assertIsNotNone(holding.last_updated)
+        self.assertEqual(holding.last_update_succeeded, 0)
 
-        markets.set_magmatic_gases(1000)
+    def test_expired_snapshot_recovered_by_next_holding_update(self):
+        """Markets not updated because their snapshot expired are updated by the next holding update"""
 
-        self.assertEqual(markets.magmatic_gas_count, 1000)
-        self.assertTrue(markets.was_magmatic_pinged)
+        markets = create_test_markets()
+        markets_data = HoldingMarketsData(
+            {1: {"name": "Markets renamed", "structure_id": 1}},
+            is_modified=False,
+            assets_fetched=False,
+        )
 
-        markets.set_magmatic_gases(5000)
+        update_markets_bulk("markets-holding-snapshot-expired", [1])
+        markets.refresh_from_db()
+        self.assertEqual(markets.structure_name, "Markets1")
 
-        self.assertEqual(markets.magmatic_gas_count, 5000)
-        self.assertFalse(markets.was_magmatic_pinged)
+        update_holding_markets(markets.corporation, markets_data)
 
-    def test_default_tags(self):
-        """
-        Checks that on markets creation the default tags are correctly added
-        """
+        markets.refresh_from_db()
+        self.assertEqual(markets.structure_name, "Markets renamed")
 
-        tag1 = MarketsTag.objects.create(name="tag1", default=True)
-        tag2 = MarketsTag.objects.create(name="tag2", default=True)
-        tag3 = MarketsTag.objects.create(name="tag3")
+    def test_unmodified_esi_data_updates_stale_markets(self):
+        """Markets whose last update failed are updated even if the ESI data didn't change since"""
 
         markets = create_test_markets()
 
-        self.assertIn(tag1, markets.tags.all())
-        self.assertIn(tag2, markets.tags.all())
-        self.assertNotIn(tag3, markets.tags.all())
+        with patch("markets.tasks.update_markets_bulk.delay") as mock_update:
+            update_holding_markets(
+                markets.corporation,
+                HoldingMarketsData(
+                    {1: {"name": "Markets1", "structure_id": 1}},
+                    {
+                        1: [
+                            {
+                                "location_flag": "StructureFuel",
+                                "type_id": 4051,
+                                "quantity": 10,
+                            }
+                        ]
+                    },
+                    is_modified=False,
+                ),
+            )
+
+        mock_update.assert_called_once()
+        self.assertEqual(mock_update.call_args.args[1], [1])
+
+
+class TestSyncBayContents(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def setUp(self):
+        self.markets = create_test_markets()
+        MarketsStoredMoonMaterials.objects.create(
+            markets=self.markets, product_id=16634, amount=50
+        )
+        MarketsStoredMoonMaterials.objects.create(
+            markets=self.markets, product_id=16633, amount=10
+        )
+
+    def stored_amounts(self):
+        return {
+            stored.product_id: stored.amount
+            for stored in self.markets.get_stored_moon_materials()
+        }
+
+    def test_upsert_and_delete_stale_materials(self):
+        """Amounts are upserted and hauled out materials deleted in two queries"""
+
+        with self.assertNumQueries(2):
+            MarketsStoredMoonMaterials.sync_bay_contents({self.markets.pk: {16634: 70}})
+
+        self.assertEqual(self.stored_amounts(), {16634: 70})
+
+    def test_empty_bay(self):
+        MarketsStoredMoonMaterials.sync_bay_contents({self.markets.pk: {}})
+
+        self.assertEqual(self.stored_amounts(), {})
+
+    def test_backend_without_upsert(self):
+        """Backends without upsert support fall back on separate updates and inserts"""
+
+        with patch.object(
+            connection.features, "supports_update_conflicts_with_target", False
+        ), patch.object(connection.features, "supports_update_conflicts", False):
+            MarketsStoredMoonMaterials.sync_bay_contents(
+                {self.markets.pk: {16634: 70, 16633: 5, 81143: 1}}
+            )
+
+        self.assertEqual(self.stored_amounts(), {16634: 70, 16633: 5, 81143: 1})
+
+
+class TestAlertsEvaluation(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def setUp(self):
+        self.markets = create_test_markets()
+        self.holding = self.markets.corporation
+        self.holding.ping_on_remaining_fuel_days = 1  # 120 fuel blocks a day
+        self.holding.ping_on_remaining_magmatic_days = 1  # 2640 magmatic gases a day
+        self.holding.save()
+
+    def apply_fuel(self, fuel_blocks: int, magmatic_gases: int) -> list:
+        """Applies the fuel assets to the markets, saves it and returns the alerts to send"""
+        markets = Markets.objects.get(pk=self.markets.pk)
+        apply_markets_update(
+            markets,
+            {"name": "Markets1"},
+            [
+                {
+                    "location_flag": "StructureFuel",
+                    "type_id": 4051,
+                    "quantity": fuel_blocks,
+                },
+                {
+                    "location_flag": "StructureFuel",
+                    "type_id": 81143,
+                    "quantity": magmatic_gases,
+                },
+            ],
+        )
+        Markets.bulk_save_changes([markets])
+        alerts = Markets.evaluate_alerts({markets.pk})
+        self.markets.refresh_from_db()
+        return alerts
+
+    def test_fuel_blocks_alerts(self):
+        """Fuel blocks under the threshold are pinged once and unflagged once refilled"""
+
+        invalidate_type_catalog()
+        self.addCleanup(invalidate_type_catalog)
+        EveType.objects.create(
+            id=4051,
+            name="Caldari Fuel Block",
+            eve_group=EveGroup.objects.create(
+                id=1136, name="Fuel Block", eve_category_id=4, published=True
+            ),
+            published=True,
+        )
+
+        self.assertEqual(self.apply_fuel(1400, 4000), [])
+        self.assertEqual(self.markets.fuel_blocks_count, 1400)
+        self.assertFalse(self.markets.was_fuel_pinged)
+
+        self.assertEqual(self.apply_fuel(20, 4000), [(self.markets.pk, "fuel", 20)])
+        self.assertTrue(self.markets.was_fuel_pinged)
+
+        self.assertEqual(self.apply_fuel(1500, 4000), [])
+        self.assertFalse(self.markets.was_fuel_pinged)
+
+    def test_magmatic_gases_alerts(self):
+        """Magmatic gases under the threshold are pinged once and unflagged once refilled"""
+
+        self.holding.ping_on_remaining_fuel_days = 0
+        self.holding.save()
+
+        self.assertEqual(self.apply_fuel(0, 4000), [])
+        self.assertEqual(self.markets.magmatic_gas_count, 4000)
+        self.assertFalse(self.markets.was_magmatic_pinged)
+
+        self.assertEqual(
+            self.apply_fuel(0, 1000), [(self.markets.pk, "magmatic", 1000)]
+        )
+        self.assertTrue(self.markets.was_magmatic_pinged)
+
+        self.assertEqual(self.apply_fuel(0, 5000), [])
+        self.assertFalse(self.markets.was_magmatic_pinged)
+
+    def test_evaluate_alerts(self):
+        """Crossed thresholds flip the pinged flags in bulk and return the alerts to send"""
+
+        Markets.objects.filter(pk=self.markets.pk).update(
+            fuel_blocks_count=20, magmatic_gas_count=4000
+        )
+
+        with self.assertNumQueries(2):
+            alerts = Markets.evaluate_alerts({self.markets.pk})
+
+        self.assertEqual(alerts, [(self.markets.pk, "fuel", 20)])
+        self.markets.refresh_from_db()
+        self.assertTrue(self.markets.was_fuel_pinged)
+        self.assertFalse(self.markets.was_magmatic_pinged)
+
+        self.assertEqual(Markets.evaluate_alerts({self.markets.pk}), [])
+
+        Markets.objects.filter(pk=self.markets.pk).update(fuel_blocks_count=1500)
+        self.assertEqual(Markets.evaluate_alerts({self.markets.pk}), [])
+        self.markets.refresh_from_db()
+        self.assertFalse(self.markets.was_fuel_pinged)
+
+    @patch("markets.models.HoldingCorporation.ping_markets_magma")
+    def test_bulk_update_sends_alerts(self, mock_ping_markets_magma):
+        """The bulk update queues the pings of the markets that crossed a threshold"""
+
+        update_markets_bulk(
+            store_holding_snapshot(
+                self.holding.corporation.corporation_id,
+                HoldingMarketsData(
+                    {1: {"name": "Markets1", "structure_id": 1}},
+                    {
+                        1: [
+                            {
+                                "location_flag": "StructureFuel",
+                                "type_id": 81143,
+                                "quantity": 1_000,
+                            }
+                        ]
+                    },
+                ),
+            ),
+            [1],
+        )
+
+        mock_ping_markets_magma.assert_called_once()
+        self.assertEqual(mock_ping_markets_magma.call_args.args[1], 1_000)
+        self.markets.refresh_from_db()
+        self.assertTrue(self.markets.was_magmatic_pinged)
@@ -0,0 +1,114 @@
+import random
+
+from django.test import TestCase
+from eveuniverse.models import EveMoon
+
+from markets.moon_index import (
+    SolarSystemMoonIndex,
+    clear_indexes,
+    find_nearest_moon_id,
+    find_nearest_moons_ids,
+)
+from markets.tests.testdata.load_eveuniverse import load_eveuniverse
+
+MOON_ID = 40178441
+
+
+class TestSolarSystemMoonIndex(TestCase):
+
+    def test_nearest_matches_brute_force(self):
+        """The pruned search returns the same moon as checking every moon"""
+
+        rng = random.Random(42)
+        moons = [
+            (
+                moon_id,
+                rng.uniform(-1e12, 1e12),
+                rng.uniform(-1e11, 1e11),
+                rng.uniform(-1e12, 1e12),
+            )
+            for moon_id in range(200)
+        ]
+        index = SolarSystemMoonIndex(moons)
+
+        for _ in range(100):
+            position = (
+                rng.uniform(-1e12, 1e12),
+                rng.uniform(-1e11, 1e11),
+                rng.uniform(-1e12, 1e12),
+            )
+            expected = min(
+                moons,
+                key=lambda moon: sum(
+                    (moon[i + 1] - position[i]) ** 2 for i in range(3)
+                ),
+            )
+            self.assertEqual(index.nearest(*position)[0], expected[0])
+
+    def test_empty_index(self):
+        """An index without moons doesn't find anything"""
+
+        self.assertIsNone(SolarSystemMoonIndex([]).nearest(0, 0, 0))
+
+
+class TestFindNearestMoon(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def setUp(self):
+        clear_indexes()
+
+    def test_find_moon_from_database(self):
+        """Structures anchored next to a known moon are resolved without eveuniverse"""
+
+        eve_moon = EveMoon.objects.get(id=MOON_ID)
+        solar_system_id = eve_moon.eve_planet.eve_solar_system.id
+        position = (
+            eve_moon.position_x + 10_000,
+            eve_moon.position_y,
+            eve_moon.position_z - 10_000,
+        )
+
+        self.assertEqual(find_nearest_moon_id(solar_system_id, position), MOON_ID)
+
+    def test_too_far_moon_is_ignored(self):
+        """No moon is returned if the nearest known moon is further than the max distance"""
+
+        eve_moon = EveMoon.objects.get(id=MOON_ID)
+        solar_system_id = eve_moon.eve_planet.eve_solar_system.id
+        position = (eve_moon.position_x + 1e9, eve_moon.position_y, eve_moon.position_z)
+
+        self.assertIsNone(find_nearest_moon_id(solar_system_id, position))
+
+    def test_moon_without_position_is_ignored(self):
+        """Moons without a known position don't break the index of their solar system"""
+
+        eve_moon = EveMoon.objects.get(id=MOON_ID)
+        EveMoon.objects.create(
+            id=40178442, name="Moon without position", eve_planet=eve_moon.eve_planet
+        )
+        solar_system_id = eve_moon.eve_planet.eve_solar_system.id
+        moon_position = (eve_moon.position_x, eve_moon.position_y, eve_moon.position_z)
+
+        self.assertEqual(find_nearest_moon_id(solar_system_id, moon_position), MOON_ID)
+
+    def test_batch_resolution(self):
+        """Several locations are resolved with a single query"""
+
+        eve_moon = EveMoon.objects.get(id=MOON_ID)
+        solar_system_id = eve_moon.eve_planet.eve_solar_system.id
+        moon_position = (eve_moon.position_x, eve_moon.position_y, eve_moon.position_z)
+
+        with self.assertNumQueries(1):
+            moons_ids = find_nearest_moons_ids(
+                [
+                    (solar_system_id, moon_position),
+                    (solar_system_id, (0.0, 0.0, 0.0)),
+                    (30000142, moon_position),
+                ]
+            )
+
+        self.assertEqual(moons_ids, [MOON_ID, None, None])
@@ -0,0 +1,56 @@
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+
+from markets.owner_scheduler import OwnerScheduler
+from markets.tests.utils import create_test_holding, create_test_owner
+
+
+class TestOwnerScheduler(TestCase):
+
+    def setUp(self):
+        self.scheduler = OwnerScheduler(
+            LocMemCache("markets-test-owner-scheduler", {}), max_failures=2
+        )
+        self.scheduler.cache.clear()
+        self.holding = create_test_holding()
+        self.owners = [
+            create_test_owner(self.holding, character_id)
+            for character_id in (10001, 10002, 10003)
+        ]
+
+    def test_healthy_owners_take_turns(self):
+        first_owners = [
+            self.scheduler.order(self.holding, self.owners)[0] for _ in range(3)
+        ]
+
+        self.assertEqual(set(first_owners), set(self.owners))
+
+    def test_failing_owners_are_tried_last(self):
+        self.scheduler.record_failure(self.owners[0])
+        self.scheduler.record_failure(self.owners[1])
+        self.scheduler.record_failure(self.owners[1])
+
+        for _ in range(3):
+            self.assertEqual(
+                self.scheduler.order(self.holding, self.owners),
+                [self.owners[2], self.owners[0], self.owners[1]],
+            )
+
+    def test_slow_owners_come_after_fast_ones(self):
+        self.scheduler.record_success(self.owners[0], 5.0)
+        self.scheduler.record_success(self.owners[1], 0.2)
+        self.scheduler.record_success(self.owners[2], 0.3)
+
+        for _ in range(3):
+            self.assertEqual(
+                self.scheduler.order(self.holding, self.owners)[-1], self.owners[0]
+            )
+
+    def test_success_resets_failures(self):
+        self.assertEqual(self.scheduler.record_failure(self.owners[0]), 1)
+        self.assertFalse(self.scheduler.should_disable(1))
+
+        self.scheduler.record_success(self.owners[0], 0.5)
+
+        self.assertEqual(self.scheduler.health(self.owners[0])["failures"], 0)
+        self.assertTrue(self.scheduler.should_disable(2))
@@ -0,0 +1,194 @@
+import datetime as dt
+import re
+from unittest.mock import patch
+
+import responses
+
+from django.test import RequestFactory, TestCase
+
+from app_utils.testing import create_fake_user
+
+from markets.models import EveTypePrice, EveTypePriceHistory
+from markets.tasks import downsample_price_history, update_prices
+from markets.tests.testdata.load_eveuniverse import load_eveuniverse
+from markets.tests.utils import fake_aggregates
+from markets.views import price_history_data
+
+BUY = EveTypePriceHistory.Side.BUY
+RAW = EveTypePriceHistory.Resolution.RAW
+HOURLY = EveTypePriceHistory.Resolution.HOURLY
+DAILY = EveTypePriceHistory.Resolution.DAILY
+
+NOW = dt.datetime(2024, 6, 15, 12, 10, tzinfo=dt.timezone.utc)
+
+
+class TestPriceHistory(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def record(self, prices: dict, timestamp: dt.datetime):
+        EveTypePriceHistory.record_prices(prices, BUY, timestamp)
+
+    def test_record_prices(self):
+        """Every valid price is stored as a raw sample"""
+        self.record({16634: 1000, 16633: 0}, NOW)
+
+        sample = EveTypePriceHistory.objects.get()
+        self.assertEqual(sample.eve_type_id, 16634)
+        self.assertEqual(sample.resolution, RAW)
+        self.assertEqual((sample.price, sample.low, sample.high), (1000, 1000, 1000))
+
+    def test_downsample_hourly(self):
+        """Raw samples of the ended hours are averaged once"""
+        self.record({16634: 1000}, NOW - dt.timedelta(hours=1, minutes=5))
+        self.record({16634: 2000}, NOW - dt.timedelta(minutes=50))
+        self.record({16634: 3000}, NOW - dt.timedelta(minutes=5))
+
+        self.assertEqual(EveTypePriceHistory.downsample(HOURLY, NOW), 1)
+        self.assertEqual(EveTypePriceHistory.downsample(HOURLY, NOW), 0)
+
+        average = EveTypePriceHistory.objects.get(resolution=HOURLY)
+        self.assertEqual(average.timestamp, NOW.replace(hour=11, minute=0))
+        self.assertEqual(average.price, 1500)
+        self.assertEqual((average.low, average.high, average.samples), (1000, 2000, 2))
+
+    def test_downsample_daily_weights_hourly_averages(self):
+        """Daily averages are weighted by the samples of each hourly average"""
+        EveTypePriceHistory.objects.bulk_create(
+            [
+                EveTypePriceHistory(
+                    eve_type_id=16634,
+                    side=BUY,
+                    resolution=HOURLY,
+                    timestamp=NOW - dt.timedelta(days=1, hours=hours),
+                    price=price,
+                    low=price,
+                    high=price,
+                    samples=samples,
+                )
+                for hours, price, samples in ((1, 1000, 3), (2, 2000, 1))
+            ]
+        )
+
+        EveTypePriceHistory.downsample(DAILY, NOW)
+
+        average = EveTypePriceHistory.objects.get(resolution=DAILY)
+        self.assertEqual(
+            average.timestamp, dt.datetime(2024, 6, 14, tzinfo=dt.timezone.utc)
+        )
+        self.assertEqual(average.price, 1250)
+        self.assertEqual(average.samples, 4)
+
+    def test_delete_expired(self):
+        """Samples are deleted after the retention of their resolution"""
+        self.record({16634: 1000}, NOW - dt.timedelta(days=8))
+        self.record({16634: 1000}, NOW - dt.timedelta(days=6))
+
+        self.assertEqual(EveTypePriceHistory.delete_expired(NOW), 1)
+        self.assertEqual(EveTypePriceHistory.objects.count(), 1)
+
+    def test_get_range_picks_resolution(self):
+        """Range queries use the finest resolution still kept from their start"""
+        self.record({16634: 1000}, NOW - dt.timedelta(hours=2))
+        EveTypePriceHistory.downsample(HOURLY, NOW)
+
+        with patch("markets.models.timezone.now", return_value=NOW):
+            self.assertEqual(
+                EveTypePriceHistory.get_range(16634, BUY, NOW - dt.timedelta(days=1)),
+                [(NOW - dt.timedelta(hours=2), 1000)],
+            )
+            self.assertEqual(
+                EveTypePriceHistory.get_range(16634, BUY, NOW - dt.timedelta(days=30)),
+                [(NOW.replace(hour=10, minute=0), 1000)],
+            )
+
+    def test_moving_averages(self):
+        """Moving averages only use the samples of the window"""
+        self.record({16634: 1000, 16633: 500}, NOW - dt.timedelta(hours=30))
+        self.record({16634: 2000}, NOW - dt.timedelta(hours=12))
+        self.record({16634: 4000}, NOW)
+
+        self.assertEqual(
+            EveTypePriceHistory.get_moving_averages([16634, 16633], BUY, 24, NOW),
+            {16634: 3000},
+        )
+
+    def test_downsample_task(self):
+        """The task rolls up the ended periods and deletes the expired samples"""
+        self.record({16634: 1000}, NOW - dt.timedelta(days=8))
+        self.record({16634: 1000}, NOW - dt.timedelta(hours=1))
+
+        with patch("markets.tasks.timezone.now", return_value=NOW):
+            downsample_price_history()
+
+        self.assertEqual(
+            set(EveTypePriceHistory.objects.values_list("resolution", flat=True)),
+            {RAW, HOURLY, DAILY},
+        )
+        self.assertEqual(EveTypePriceHistory.objects.filter(resolution=RAW).count(), 1)
+
+    @responses.activate
+    @patch("markets.tasks.revalue_goo_moons.delay")
+    def test_update_prices_records_both_sides(self, _):
+        """update_prices stores the buy and sell prices of every type"""
+        responses.add(
+            responses.GET,
+            re.compile(r"https://market\.fuzzwork\.co\.uk/aggregates/.*"),
+            json={**fake_aggregates(16634, 10, 20), **fake_aggregates(81143, 30, 40)},
+        )
+
+        update_prices()
+
+        self.assertEqual(
+            set(
+                EveTypePriceHistory.objects.values_list("eve_type_id", "side", "price")
+            ),
+            {
+                (16634, "buy", 10),
+                (16634, "sell", 20),
+                (81143, "buy", 30),
+                (81143, "sell", 40),
+            },
+        )
+
+    @responses.activate
+    @patch("markets.tasks.MARKETS_PRICE_MOVING_AVERAGE_HOURS", 24)
+    @patch("markets.tasks.revalue_goo_moons.delay")
+    def test_update_prices_with_moving_average(self, _):
+        """Types are valued at their average price when a moving average is set"""
+        self.record(
+            {16634: 30}, dt.datetime.now(tz=dt.timezone.utc) - dt.timedelta(hours=1)
+        )
+        responses.add(
+            responses.GET,
+            re.compile(r"https://market\.fuzzwork\.co\.uk/aggregates/.*"),
+            json=fake_aggregates(16634, 10, 20),
+        )
+
+        update_prices()
+
+        self.assertEqual(EveTypePrice.get_eve_type_id_price(16634), 20)
+
+
+class TestPriceHistoryView(TestCase):
+
+    def setUp(self):
+        self.user = create_fake_user(10001, "Bruce Wayne")
+
+    def get(self, days: str):
+        request = RequestFactory().get("/", {"days": days})
+        request.user = self.user
+        return price_history_data(request, 16634)
+
+    def test_days_out_of_range(self):
+        """Negative or huge day counts are refused instead of failing"""
+        self.assertEqual(self.get("-1").status_code, 400)
+        self.assertEqual(self.get("0").status_code, 400)
+        self.assertEqual(self.get(str(10**9)).status_code, 400)
+        self.assertEqual(self.get("abc").status_code, 400)
+
+    def test_days_in_range(self):
+        self.assertEqual(self.get("30").status_code, 200)
@@ -1,7 +1,13 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
 from django.test import TestCase
+from eveuniverse.models import EveGroup, EveType
 
 from markets.models import EveTypePrice
+from markets.prices import VERSION_CACHE_KEY, PriceCache, has_price_moved, price_cache
 from markets.tests.testdata.load_eveuniverse import load_eveuniverse
+from markets.type_catalog import invalidate_type_catalog
 
 
 class TestPrices(TestCase):
@@ -11,6 +17,9 @@ class TestPrices(TestCase):
         super().setUpClass()
         load_eveuniverse()
 
+    def setUp(self):
+        price_cache.invalidate()
+
     def test_fuel_block_price_not_return_none(self):
         """In case fuel block prices aren't in the database return 0 instead of None"""
 
@@ -26,3 +35,103 @@ class TestPrices(TestCase):
 
         self.assertIsNotNone(magmatic_price)
         self.assertEqual(magmatic_price, 0.0)
+
+    def test_prices_read_without_queries(self):
+        """Once loaded the prices are read from memory"""
+        atmospheric_gases = EveType.objects.get(id=16634)
+        EveTypePrice.objects.create(eve_type=atmospheric_gases, price=1000)
+        EveTypePrice.objects.create(eve_type_id=16633, price=2000)
+        EveTypePrice.get_eve_type_id_price(16634)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(EveTypePrice.get_eve_type_id_price(16634), 1000)
+            self.assertEqual(EveTypePrice.get_eve_type_price(atmospheric_gases), 1000)
+            self.assertEqual(EveTypePrice.get_eve_type_id_price(16633), 2000)
+            self.assertEqual(EveTypePrice.get_magmatic_gases_price(), 0)
+
+    def test_fuel_block_price_is_the_cheapest(self):
+        """The fuel block price is the price of the cheapest fuel block"""
+        invalidate_type_catalog()
+        self.addCleanup(invalidate_type_catalog)
+        fuel_block_group = EveGroup.objects.create(
+            id=1136, name="Fuel Block", eve_category_id=4, published=True
+        )
+        for type_id, price in ((4051, 20_000), (4246, 15_000)):
+            EveTypePrice.objects.create(
+                eve_type=EveType.objects.create(
+                    id=type_id,
+                    name=f"Fuel Block {type_id}",
+                    eve_group=fuel_block_group,
+                    published=True,
+                ),
+                price=price,
+            )
+        EveTypePrice.get_fuel_block_price()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(EveTypePrice.get_fuel_block_price(), 15_000)
+
+    def test_saving_a_price_is_read_right_away(self):
+        """Saving a price drops the snapshot of the process"""
+        type_price = EveTypePrice.objects.create(eve_type_id=16634, price=1000)
+        EveTypePrice.get_eve_type_id_price(16634)
+
+        type_price.update_price(2000)
+
+        self.assertEqual(EveTypePrice.get_eve_type_id_price(16634), 2000)
+
+
+class TestPriceCache(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def setUp(self):
+        cache.delete(VERSION_CACHE_KEY)
+        self.price_cache = PriceCache(ttl=300)
+
+    def test_stale_snapshot_served_while_reloading(self):
+        """Readers don't wait for the reload of a stale snapshot done by another thread"""
+        EveTypePrice.objects.create(eve_type_id=16634, price=1000)
+        snapshot = self.price_cache.get()
+        cache.set(VERSION_CACHE_KEY, 1.0)
+
+        with patch(
+            "markets.prices.time.monotonic", return_value=snapshot.loaded_at + 10
+        ):
+            with self.price_cache._reload_lock, self.assertNumQueries(0):
+                self.assertIs(self.price_cache.get(), snapshot)
+
+            with self.assertNumQueries(1):
+                reloaded = self.price_cache.get()
+
+        self.assertEqual(reloaded.version, 1.0)
+
+    def test_reload_after_ttl(self):
+        """Snapshots older than the TTL are reloaded"""
+        snapshot = self.price_cache.get()
+        EveTypePrice.objects.bulk_create([EveTypePrice(eve_type_id=16634, price=1000)])
+
+        with patch(
+            "markets.prices.time.monotonic", return_value=snapshot.loaded_at + 1
+        ):
+            self.assertEqual(self.price_cache.price(16634), 0)
+
+        with patch(
+            "markets.prices.time.monotonic", return_value=snapshot.loaded_at + 300
+        ):
+            self.assertEqual(self.price_cache.price(16634), 1000)
+
+
+class TestHasPriceMoved(TestCase):
+
+    def test_small_changes_ignored(self):
+        self.assertFalse(has_price_moved(1000, 1000.5, epsilon=0.001))
+        self.assertTrue(has_price_moved(1000, 1002, epsilon=0.001))
+        self.assertTrue(has_price_moved(1000, 998, epsilon=0.001))
+
+    def test_first_price_always_moved(self):
+        self.assertTrue(has_price_moved(0, 1, epsilon=0.001))
+        self.assertFalse(has_price_moved(0, 0, epsilon=0.001))
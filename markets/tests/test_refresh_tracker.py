@@ -0,0 +1,37 @@
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase
+
+from markets.refresh_tracker import RefreshSummary, RefreshTracker
+
+
+class TestRefreshTracker(TestCase):
+
+    def setUp(self):
+        self.tracker = RefreshTracker(LocMemCache("markets-test-refresh", {}))
+        self.tracker.cache.clear()
+
+    def test_last_subtask_gets_summary(self):
+        refresh_id = self.tracker.start(1, 1_000.0, 3)
+
+        self.assertIsNone(self.tracker.report(refresh_id, succeeded=2))
+        self.assertIsNone(self.tracker.report(refresh_id, failed=1))
+        self.assertEqual(
+            self.tracker.report(refresh_id, succeeded=1),
+            RefreshSummary(1, 1_000.0, 3, 1),
+        )
+        self.assertIsNone(
+            self.tracker.cache.get(f"markets-holding-refresh-{refresh_id}-info")
+        )
+
+    def test_refreshes_are_tracked_separately(self):
+        refresh_id = self.tracker.start(1, 1_000.0, 1)
+        other_refresh_id = self.tracker.start(1, 2_000.0, 2)
+
+        self.assertEqual(
+            self.tracker.report(refresh_id, succeeded=1),
+            RefreshSummary(1, 1_000.0, 1, 0),
+        )
+        self.assertIsNone(self.tracker.report(other_refresh_id, succeeded=1))
+
+    def test_expired_refresh(self):
+        self.assertIsNone(self.tracker.report("unknown", succeeded=1))
@@ -0,0 +1,71 @@
+import datetime as dt
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from markets.esi import HoldingMarketsData
+from markets.snapshots import (
+    SnapshotMissingError,
+    load_holding_snapshot,
+    store_holding_snapshot,
+)
+from markets.tasks import update_markets_bulk
+
+
+class TestSnapshots(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.markets_data = HoldingMarketsData(
+            {
+                1: {
+                    "name": "Markets1",
+                    "structure_id": 1,
+                    "fuel_expires": timezone.now() + dt.timedelta(days=3),
+                }
+            },
+            {
+                1: [
+                    {
+                        "location_flag": "MoonMaterialBay",
+                        "type_id": 16634,
+                        "quantity": 100,
+                    }
+                ]
+            },
+            {2: {"solar_system_id": 30000142}},
+            assets_fetched=False,
+        )
+
+    def test_store_and_load(self):
+        key = store_holding_snapshot(1, self.markets_data)
+
+        corporation_id, markets_data = load_holding_snapshot(key)
+
+        self.assertEqual(corporation_id, 1)
+        self.assertEqual(markets_data.markets_assets, self.markets_data.markets_assets)
+        self.assertEqual(markets_data.locations, self.markets_data.locations)
+        self.assertEqual(markets_data.markets_info[1]["name"], "Markets1")
+        self.assertFalse(markets_data.assets_fetched)
+        self.assertIsInstance(cache.get(key), bytes)
+
+    def test_same_data_reuses_key(self):
+        key = store_holding_snapshot(1, self.markets_data)
+
+        self.assertEqual(key, store_holding_snapshot(1, self.markets_data))
+        self.assertNotEqual(key, store_holding_snapshot(2, self.markets_data))
+
+    def test_missing_snapshot(self):
+        key = store_holding_snapshot(1, self.markets_data)
+        cache.delete(key)
+
+        with self.assertRaises(SnapshotMissingError):
+            load_holding_snapshot(key)
+
+    @patch("markets.tasks.Markets.objects")
+    def test_task_with_missing_snapshot_does_nothing(self, mock_markets_objects):
+        update_markets_bulk("markets-holding-snapshot-v1-1-missing", [1])
+
+        mock_markets_objects.filter.assert_not_called()
@@ -0,0 +1,72 @@
+import datetime as dt
+import threading
+from contextvars import copy_context
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+from django.utils import timezone
+
+from markets.tests.utils import create_test_holding, create_test_owner
+from markets.token_pool import TokenPool, get_access_token, token_pool
+
+
+def fake_token(access_token: str, expires_in: int) -> Mock:
+    return Mock(
+        valid_access_token=Mock(return_value=access_token),
+        expires=timezone.now() + dt.timedelta(seconds=expires_in),
+    )
+
+
+@patch("markets.models.Owner.fetch_token")
+class TestTokenPool(TestCase):
+
+    def setUp(self):
+        self.holding = create_test_holding()
+        self.owner = create_test_owner(self.holding)
+
+    def test_access_token_is_resolved_once(self, mock_fetch_token):
+        mock_fetch_token.return_value = fake_token("token-1", 1200)
+        pool = TokenPool(expiry_margin=60)
+
+        self.assertEqual(pool.get_access_token(self.owner), "token-1")
+        self.assertEqual(pool.get_access_token(self.owner), "token-1")
+
+        mock_fetch_token.assert_called_once()
+
+    def test_access_token_is_refreshed_before_expiry(self, mock_fetch_token):
+        mock_fetch_token.side_effect = [
+            fake_token("token-1", 30),
+            fake_token("token-2", 1200),
+        ]
+        pool = TokenPool(expiry_margin=60)
+
+        self.assertEqual(pool.get_access_token(self.owner), "token-1")
+        self.assertEqual(pool.get_access_token(self.owner), "token-2")
+
+    def test_pool_is_shared_with_threads_of_the_cycle(self, mock_fetch_token):
+        mock_fetch_token.return_value = fake_token("token-1", 1200)
+        access_tokens = []
+
+        with token_pool():
+            threads = [
+                threading.Thread(
+                    target=copy_context().run,
+                    args=(lambda: access_tokens.append(get_access_token(self.owner)),),
+                )
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(access_tokens, ["token-1"] * 4)
+        mock_fetch_token.assert_called_once()
+
+    def test_no_pool_outside_of_a_cycle(self, mock_fetch_token):
+        mock_fetch_token.return_value = fake_token("token-1", 1200)
+
+        get_access_token(self.owner)
+        get_access_token(self.owner)
+
+        self.assertEqual(mock_fetch_token.call_count, 2)
@@ -0,0 +1,61 @@
+from django.test import TestCase
+from eveuniverse.models import EveGroup, EveType
+
+from markets.models import EveTypePrice
+from markets.tests.testdata.load_eveuniverse import load_eveuniverse
+from markets.type_catalog import get_type_catalog, invalidate_type_catalog
+
+
+class TestTypeCatalog(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def setUp(self):
+        invalidate_type_catalog()
+
+    def tearDown(self):
+        invalidate_type_catalog()
+
+    def create_fuel_block(self):
+        fuel_block_group = EveGroup.objects.create(
+            id=1136, name="Fuel Block", eve_category_id=4, published=True
+        )
+        EveType.objects.create(
+            id=4051,
+            name="Caldari Fuel Block",
+            eve_group=fuel_block_group,
+            published=True,
+            volume=5,
+        )
+
+    def test_catalog_is_loaded_once(self):
+        self.create_fuel_block()
+
+        catalog = get_type_catalog()
+
+        self.assertEqual(catalog.fuel_type_ids, {4051, 81143})
+        self.assertIn(16634, catalog.moon_goo_type_ids)
+        self.assertNotIn(81143, catalog.moon_goo_type_ids)
+        self.assertEqual(catalog.volumes[4051], 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(EveTypePrice.get_fuels_type_ids(), {4051, 81143})
+            self.assertIn(16634, EveTypePrice.get_moon_goos_type_ids())
+
+    def test_incomplete_catalog_is_not_kept(self):
+        self.assertEqual(get_type_catalog().fuel_block_type_ids, set())
+
+        self.create_fuel_block()
+
+        self.assertEqual(get_type_catalog().fuel_block_type_ids, {4051})
+
+    def test_invalidation(self):
+        self.create_fuel_block()
+        get_type_catalog()
+
+        EveType.objects.filter(id=4051).update(volume=10)
+        invalidate_type_catalog()
+
+        self.assertEqual(get_type_catalog().volumes[4051], 10)
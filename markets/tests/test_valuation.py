@@ -0,0 +1,118 @@
+from django.test import TestCase
+from eveuniverse.models import EveMoon
+
+from markets.models import EveTypePrice, MarketsHourlyProducts, Moon
+from markets.prices import price_cache
+from markets.tasks import revalue_goo_moons
+from markets.tests.testdata.load_eveuniverse import load_eveuniverse
+from markets.valuation import (
+    build_goo_moons_index,
+    compute_moon_values,
+    find_moons_harvesting,
+    revalue_moons,
+)
+
+MOON_ID = 40178441
+OTHER_MOON_ID = 40178442
+
+
+class TestValuation(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        load_eveuniverse()
+
+    def setUp(self):
+        EveTypePrice.objects.create(eve_type_id=16633, price=2000)
+        EveTypePrice.objects.create(eve_type_id=16634, price=1000)
+        self.moon = Moon.objects.create(eve_moon_id=MOON_ID)
+        EveMoon.objects.create(
+            id=OTHER_MOON_ID,
+            name="Other moon",
+            eve_planet=EveMoon.objects.get(id=MOON_ID).eve_planet,
+        )
+        self.other_moon = Moon.objects.create(eve_moon_id=OTHER_MOON_ID, value=1)
+        MarketsHourlyProducts.objects.create(
+            moon=self.moon, product_id=16633, amount=10
+        )
+        MarketsHourlyProducts.objects.create(
+            moon=self.moon, product_id=16634, amount=20
+        )
+
+    def test_compute_moon_values(self):
+        """Moon values are computed from the hourly harvest in a single query"""
+        prices = price_cache.get()
+
+        with self.assertNumQueries(1):
+            moon_values = compute_moon_values(prices)
+
+        self.assertEqual(moon_values, {MOON_ID: (2000 * 10 + 1000 * 20) * 24 * 30})
+
+    def test_same_value_as_single_moon_update(self):
+        """The batch revaluation computes the same value as Moon.update_price"""
+        revalue_moons()
+        batch_value = Moon.objects.get(eve_moon_id=MOON_ID).value
+
+        self.moon.update_price()
+
+        self.assertEqual(batch_value, self.moon.value)
+
+    def test_revalue_all_moons(self):
+        """Every moon is revalued, moons without harvest are worth nothing"""
+        with self.assertNumQueries(4):
+            updated_count = revalue_moons()
+
+        self.assertEqual(updated_count, 2)
+        self.moon.refresh_from_db()
+        self.other_moon.refresh_from_db()
+        self.assertEqual(self.moon.value, 40_000 * 24 * 30)
+        self.assertIsNotNone(self.moon.value_updated_at)
+        self.assertEqual(self.other_moon.value, 0)
+
+    def test_revalue_some_moons(self):
+        """Only the given moons are revalued"""
+        revalue_moons([MOON_ID])
+
+        self.other_moon.refresh_from_db()
+        self.assertEqual(self.other_moon.value, 1)
+        self.assertIsNone(self.other_moon.value_updated_at)
+
+    def test_goo_moons_index(self):
+        """The index lists the moons harvesting each goo"""
+        MarketsHourlyProducts.objects.create(
+            moon=self.other_moon, product_id=16634, amount=5
+        )
+
+        self.assertEqual(
+            build_goo_moons_index([16633, 16634]),
+            {16633: {MOON_ID}, 16634: {MOON_ID, OTHER_MOON_ID}},
+        )
+        self.assertEqual(find_moons_harvesting([16633]), {MOON_ID})
+        self.assertEqual(find_moons_harvesting([16635]), set())
+
+    def test_revalue_goo_moons(self):
+        """Only the moons harvesting a goo whose price moved are revalued"""
+        revalue_goo_moons([16633])
+
+        self.moon.refresh_from_db()
+        self.other_moon.refresh_from_db()
+        self.assertEqual(self.moon.value, 40_000 * 24 * 30)
+        self.assertEqual(self.other_moon.value, 1)
+
+    def test_revalue_moons_in_batches(self):
+        """Given moons are revalued batch_size moons at a time"""
+        with self.assertNumQueries(6):
+            updated_count = revalue_moons([MOON_ID, OTHER_MOON_ID], batch_size=1)
+
+        self.assertEqual(updated_count, 2)
+
+    def test_revalue_with_fresh_prices(self):
+        """Moons are revalued with the stored prices even if the price cache is stale"""
+        price_cache.get()
+        EveTypePrice.objects.filter(eve_type_id=16633).update(price=4000)
+
+        revalue_moons([MOON_ID])
+
+        self.moon.refresh_from_db()
+        self.assertEqual(self.moon.value, (4000 * 10 + 1000 * 20) * 24 * 30)
@@ -1,6 +1,13 @@
+from eveuniverse.models import EveMoon
+
+from allianceauth.authentication.models import CharacterOwnership
 from allianceauth.eveonline.models import EveCorporationInfo
+from app_utils.testing import create_fake_user
 
-from markets.models import HoldingCorporation
+from markets.esi import HoldingMarketsData
+from markets.models import HoldingCorporation, Markets, Owner
+from markets.snapshots import store_holding_snapshot
+from markets.tasks import create_markets
 
 
 def create_test_holding(holding_id: int = 1) -> HoldingCorporation:
@@ -16,3 +23,62 @@ def create_test_holding(holding_id: int = 1) -> HoldingCorporation:
     holding.save()
 
     return holding
+
+
+def create_test_owner(holding, character_id: int = 10001) -> Owner:
+    """Creates an owner with a fake user in the holding corporation"""
+
+    user = create_fake_user(
+        character_id=character_id, character_name=f"Test char {character_id}"
+    )
+    character_ownership, _ = CharacterOwnership.objects.get_or_create(
+        character=user.profile.main_character,
+        user=user,
+        owner_hash=f"fake_hash_{character_id}",
+    )
+    return Owner.objects.create(
+        corporation=holding, character_ownership=character_ownership
+    )
+
+
+def create_test_markets(moon_id: int = 40178441) -> Markets:
+    """
+    Creates a basic markets for testing purpose
+    """
+
+    holding = create_test_holding()
+    eve_moon = EveMoon.objects.get(id=moon_id)
+
+    structure_info = {
+        "name": "Markets1",
+        "structure_id": 1,
+    }
+
+    location_info = {
+        "position": {
+            "x": eve_moon.position_x,
+            "y": eve_moon.position_y,
+            "z": eve_moon.position_z,
+        },
+        "solar_system_id": eve_moon.eve_planet.eve_solar_system.id,
+    }
+
+    create_markets(
+        store_holding_snapshot(
+            holding.corporation.corporation_id,
+            HoldingMarketsData({1: structure_info}, locations={1: location_info}),
+        ),
+        1,
+    )
+
+    return Markets.objects.get(structure_id=1)
+
+
+def fake_aggregates(type_id: int, buy: float, sell: float) -> dict:
+    """Fuzzwork aggregates of a type with the given percentile prices"""
+    return {
+        str(type_id): {
+            "buy": {"percentile": str(buy), "max": str(buy)},
+            "sell": {"percentile": str(sell), "min": str(sell)},
+        }
+    }
@@ -0,0 +1,82 @@
+"""Access tokens of the owners resolved once for a whole refresh cycle"""
+
+import datetime as dt
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+from django.utils import timezone
+
+from allianceauth.services.hooks import get_extension_logger
+
+from markets.app_settings import MARKETS_ESI_TOKEN_EXPIRY_MARGIN
+from markets.models import Owner
+
+logger = get_extension_logger(__name__)
+
+
+class TokenPool:
+    """
+    Keeps the access token of each owner once fetched and refreshed.
+    The same access token is handed out until `expiry_margin` seconds before it expires.
+    Safe to share between threads, an owner's token is only resolved by one of them.
+    """
+
+    def __init__(self, expiry_margin: int = MARKETS_ESI_TOKEN_EXPIRY_MARGIN):
+        self.expiry_margin = dt.timedelta(seconds=expiry_margin)
+        self._access_tokens: Dict[int, Tuple[str, dt.datetime]] = {}
+        self._owners_locks: Dict[int, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _owner_lock(self, owner_pk: int) -> threading.Lock:
+        with self._lock:
+            return self._owners_locks.setdefault(owner_pk, threading.Lock())
+
+    def get_access_token(self, owner: Owner) -> str:
+        """
+        Returns a valid access token of the owner.
+        Raises the same exceptions as `Owner.fetch_token`, failures aren't kept.
+        """
+        with self._owner_lock(owner.pk):
+            if cached := self._access_tokens.get(owner.pk):
+                access_token, expires = cached
+                if timezone.now() < expires - self.expiry_margin:
+                    return access_token
+
+            token = owner.fetch_token()
+            access_token = token.valid_access_token()
+            self._access_tokens[owner.pk] = (access_token, token.expires)
+            logger.debug("Resolved the access token of owner %s", owner)
+            return access_token
+
+
+_current_pool: ContextVar[Optional[TokenPool]] = ContextVar(
+    "markets_token_pool", default=None
+)
+
+
+@contextmanager
+def token_pool() -> Iterator[TokenPool]:
+    """
+    Shares a token pool with every ESI call made in the block.
+    An already active pool is reused.
+    Threads started in the block need to run in a copy of the current context to use it.
+    """
+    if (pool := _current_pool.get()) is not None:
+        yield pool
+        return
+
+    pool = TokenPool()
+    reset_token = _current_pool.set(pool)
+    try:
+        yield pool
+    finally:
+        _current_pool.reset(reset_token)
+
+
+def get_access_token(owner: Owner) -> str:
+    """Returns a valid access token of the owner from the active token pool if there is one"""
+    if (pool := _current_pool.get()) is not None:
+        return pool.get_access_token(owner)
+    return owner.fetch_token().valid_access_token()
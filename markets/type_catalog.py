@@ -0,0 +1,109 @@
+"""Static game data about the types handled by markets, kept in memory by each process"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Optional
+
+from django.core.cache import cache
+from django.db.models import Q
+from eveuniverse.models import EveType
+
+from allianceauth.services.hooks import get_extension_logger
+
+logger = get_extension_logger(__name__)
+
+MOON_GOOS_GROUP_ID = 427
+FUEL_BLOCK_GROUP_ID = 1136
+MAGMATIC_TYPE_ID = 81143
+
+VERSION_CACHE_KEY = "markets-type-catalog-version"
+VERSION_CHECK_INTERVAL = 60
+
+
+@dataclass(frozen=True)
+class TypeCatalog:
+    """Type ids of the fuel blocks, magmatic gas and moon goos with their volumes"""
+
+    fuel_block_type_ids: FrozenSet[int] = frozenset()
+    moon_goo_type_ids: FrozenSet[int] = frozenset()
+    magmatic_gas_type_id: int = MAGMATIC_TYPE_ID
+    volumes: Dict[int, float] = field(default_factory=dict)
+
+    @property
+    def fuel_type_ids(self) -> FrozenSet[int]:
+        """Fuel blocks and magmatic gas type ids"""
+        return self.fuel_block_type_ids | {self.magmatic_gas_type_id}
+
+    @property
+    def is_complete(self) -> bool:
+        """False if the fuel blocks or moon goos aren't loaded in eveuniverse yet"""
+        return bool(self.fuel_block_type_ids and self.moon_goo_type_ids)
+
+    @classmethod
+    def load(cls) -> "TypeCatalog":
+        """Loads the catalog from eveuniverse in a single query"""
+        fuel_block_type_ids, moon_goo_type_ids, volumes = set(), set(), {}
+        for type_id, group_id, volume in EveType.objects.filter(
+            Q(
+                eve_group_id__in=[FUEL_BLOCK_GROUP_ID, MOON_GOOS_GROUP_ID],
+                published=True,
+            )
+            | Q(id=MAGMATIC_TYPE_ID)
+        ).values_list("id", "eve_group_id", "volume"):
+            volumes[type_id] = volume
+            if type_id == MAGMATIC_TYPE_ID:
+                continue
+            if group_id == FUEL_BLOCK_GROUP_ID:
+                fuel_block_type_ids.add(type_id)
+            else:
+                moon_goo_type_ids.add(type_id)
+
+        return cls(
+            frozenset(fuel_block_type_ids),
+            frozenset(moon_goo_type_ids),
+            volumes=volumes,
+        )
+
+
+_catalog: Optional[TypeCatalog] = None  # pylint: disable = invalid-name
+_catalog_version = None  # pylint: disable = invalid-name
+_version_checked_at = 0.0  # pylint: disable = invalid-name
+_lock = threading.Lock()
+
+
+def get_type_catalog() -> TypeCatalog:
+    """
+    Returns the type catalog of this process, loading it on first use.
+    The shared version is checked every VERSION_CHECK_INTERVAL seconds to pick up invalidations
+    from other processes. Incomplete catalogs aren't kept to get the data once it's loaded.
+    """
+    global _catalog, _catalog_version, _version_checked_at  # pylint: disable = global-statement
+
+    with _lock:
+        now = time.monotonic()
+        if _catalog is not None and now - _version_checked_at >= VERSION_CHECK_INTERVAL:
+            _version_checked_at = now
+            if cache.get(VERSION_CACHE_KEY) != _catalog_version:
+                _catalog = None
+
+        if _catalog is not None:
+            return _catalog
+
+        version = cache.get(VERSION_CACHE_KEY)
+        catalog = TypeCatalog.load()
+        if catalog.is_complete:
+            _catalog, _catalog_version, _version_checked_at = catalog, version, now
+        else:
+            logger.debug("Type catalog incomplete, not keeping it")
+
+        return catalog
+
+
+def invalidate_type_catalog():
+    """Drops the type catalog of every process to have it reloaded on next use"""
+    global _catalog  # pylint: disable = global-statement
+
+    cache.set(VERSION_CACHE_KEY, time.time(), timeout=None)
+    with _lock:
+        _catalog = None
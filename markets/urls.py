@@ -50,4 +50,9 @@ urlpatterns = [
     #      name="remove_corporation_webhook",
     #  ),
     # path("prices", views.prices, name="prices"),
+    # path(
+    #     "prices/<int:type_id>/history",
+    #     views.price_history_data,
+    #     name="price_history_data",
+    # ),
 ]
@@ -0,0 +1,105 @@
+"""Revaluation of the moons in bulk from their hourly harvest and the current prices"""
+
+import datetime as dt
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from django.utils import timezone
+
+from allianceauth.services.hooks import get_extension_logger
+
+from markets.app_settings import MARKETS_MOON_REVALUATION_BATCH_SIZE
+from markets.models import MarketsHourlyProducts, Moon
+from markets.prices import PriceSnapshot
+
+logger = get_extension_logger(__name__)
+
+HOURS_PER_MONTH = 24 * 30
+
+
+def build_goo_moons_index(goo_ids: Iterable[int]) -> Dict[int, Set[int]]:
+    """Returns the ids of the moons harvesting each of the moon goos, in a single query"""
+    index = defaultdict(set)
+    for goo_id, moon_id in MarketsHourlyProducts.objects.filter(
+        product_id__in=list(goo_ids)
+    ).values_list("product_id", "moon_id"):
+        index[goo_id].add(moon_id)
+    return dict(index)
+
+
+def find_moons_harvesting(goo_ids: Iterable[int]) -> Set[int]:
+    """Returns the ids of the moons harvesting any of the moon goos"""
+    return set().union(*build_goo_moons_index(goo_ids).values())
+
+
+def compute_moon_values(
+    prices: PriceSnapshot, moon_ids: Optional[Iterable[int]] = None
+) -> Dict[int, float]:
+    """
+    Returns the monthly harvest value of the moons by moon id,
+    reading the harvest of every moon in a single query.
+    Moons without any harvest aren't returned
+    """
+    hourly_products = MarketsHourlyProducts.objects.all()
+    if moon_ids is not None:
+        hourly_products = hourly_products.filter(moon_id__in=moon_ids)
+
+    hourly_values = defaultdict(float)
+    for moon_id, product_id, amount in hourly_products.values_list(
+        "moon_id", "product_id", "amount"
+    ).iterator(chunk_size=MARKETS_MOON_REVALUATION_BATCH_SIZE):
+        hourly_values[moon_id] += prices.price(product_id) * amount
+
+    return {
+        moon_id: hourly_value * HOURS_PER_MONTH
+        for moon_id, hourly_value in hourly_values.items()
+    }
+
+
+def _revalue(
+    prices: PriceSnapshot,
+    now: dt.datetime,
+    moon_ids: Optional[List[int]],
+    batch_size: int,
+) -> int:
+    moon_values = compute_moon_values(prices, moon_ids)
+
+    moons = [
+        Moon(eve_moon_id=moon_id, value=value, value_updated_at=now)
+        for moon_id, value in moon_values.items()
+    ]
+    for start in range(0, len(moons), batch_size):
+        Moon.objects.bulk_update(
+            moons[start : start + batch_size], ["value", "value_updated_at"]
+        )
+
+    moons_without_harvest = Moon.objects.filter(hourly_products__isnull=True)
+    if moon_ids is not None:
+        moons_without_harvest = moons_without_harvest.filter(eve_moon_id__in=moon_ids)
+    return len(moons) + moons_without_harvest.update(value=0, value_updated_at=now)
+
+
+def revalue_moons(
+    moon_ids: Optional[Iterable[int]] = None,
+    batch_size: int = MARKETS_MOON_REVALUATION_BATCH_SIZE,
+) -> int:
+    """
+    Updates the value of the moons, all of them if no moon ids are given.
+    The prices are loaded fresh instead of read from the price cache,
+    whose snapshot can lag behind prices that were just updated.
+    Values are written `batch_size` moons at a time. Returns the number of moons updated
+    """
+    prices = PriceSnapshot.load()
+    now = timezone.now()
+
+    if moon_ids is None:
+        updated_count = _revalue(prices, now, None, batch_size)
+    else:
+        moon_ids = sorted(moon_ids)
+        updated_count = sum(
+            _revalue(prices, now, moon_ids[start : start + batch_size], batch_size)
+            for start in range(0, len(moon_ids), batch_size)
+        )
+
+    logger.info("Revalued %s moons", updated_count)
+    return updated_count
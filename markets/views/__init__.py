@@ -12,4 +12,4 @@ from .corporations import (
 from .general import add_owner, index, modal_loader_body
 from .markets import MarketsListJson, markets_details, markets_fdd_data, markets
 from .moons import MoonListJson, list_moons, moon_details, moons_fdd_data
-from .prices import prices
+from .prices import price_history_data, prices
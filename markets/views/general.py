@@ -97,7 +97,7 @@ def add_owner(request, token):
         owner.enable()  # Gives another chance to the toon at being used for updates
 
     # TODO figure out why I need to type all this to get the right corp id
-    tasks.update_holding.delay(owner.corporation.corporation.corporation_id)
+    tasks.enqueue_holding_update(owner.corporation.corporation.corporation_id)
     messages.success(request, f"Update of refineries started for {owner}.")
     if MARKETS_ADMIN_NOTIFICATIONS_ENABLED:
         notify_admins(
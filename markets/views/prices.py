@@ -1,9 +1,13 @@
 """Price views"""
 
+import datetime as dt
+
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render
+from django.utils import timezone
 
-from markets.models import EveTypePrice
+from markets.models import EveTypePrice, EveTypePriceHistory
 from markets.views.general import add_common_context
 
 
@@ -21,3 +25,36 @@ def prices(request):
             }
         ),
     )
+
+
+@login_required
+def price_history_data(request, type_id: int) -> JsonResponse:
+    """
+    Provides the price history of a type for charting.
+    The side of the market and number of days can be given with the `side` and `days` parameters
+    """
+    side = request.GET.get("side", EveTypePriceHistory.Side.BUY)
+    if side not in EveTypePriceHistory.Side.values:
+        return HttpResponseBadRequest(f"Unknown side {side}")
+    max_days = EveTypePriceHistory.RETENTION_DAYS[EveTypePriceHistory.Resolution.DAILY]
+    try:
+        days = int(request.GET.get("days", 30))
+    except ValueError:
+        return HttpResponseBadRequest("days must be a number")
+    if not 1 <= days <= max_days:
+        return HttpResponseBadRequest(f"days must be between 1 and {max_days}")
+
+    start = timezone.now() - dt.timedelta(days=days)
+    return JsonResponse(
+        {
+            "type_id": type_id,
+            "side": side,
+            "resolution": EveTypePriceHistory.resolution_covering(start),
+            "prices": [
+                [timestamp.isoformat(), price]
+                for timestamp, price in EveTypePriceHistory.get_range(
+                    type_id, side, start
+                )
+            ],
+        }
+    )